@@ -1,155 +1,80 @@
-from typing import TypedDict, Annotated, List
-from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
-
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
-from langchain_groq import ChatGroq
 import os
 
-# 1. Define state
-class ChatState(TypedDict):
-    messages: Annotated[List[BaseMessage], add_messages]
-
-
-# 2. Initialize LLM with proper error handling and fallback for GROQ
-def initialize_llm():
-    groq_api_key = os.getenv("GROQ_API_KEY")
-    
-    
-        # Try to get from env file
-        # api 
-    
-    if not groq_api_key:
-        raise ValueError("GROQ_API_KEY environment variable not set properly")
-        
-    # Try multiple GROQ models in order of preference
-    models_to_try = [
-        "llama-3.1-70b-versatile",
-        "llama-3.1-8b-instant", 
-        "llama3-groq-70b-8192-tool-use-preview", 
-        "llama3-groq-8b-8192-tool-use-preview", 
-        "gemma2-9b-it"
-    ]
-    
-    for model_name in models_to_try:
-        try:
-            llm = ChatGroq(
-                model=model_name,
-                temperature=0.7,
-                groq_api_key=groq_api_key,
-                max_retries=2
-            )
-            # Test the model with a simple call to verify it works
-            test_response = llm.invoke([HumanMessage(content="Test")])
-            print(f"Successfully initialized with GROQ model: {model_name}")
-            return llm
-        except Exception as e:
-            print(f"GROQ Model {model_name} not available or failed: {str(e)}")
-            continue
-    
-    # If no GROQ models are available, create a mock/fallback LLM
-    print("No GROQ models available. Creating fallback response handler.")
-    
-    # Create a mock-like object that behaves like an LLM for fallback
-    class FallbackLLM:
-        def invoke(self, messages):
-            # Extract user message content
-            user_message = ""
-            for msg in messages:
-                if hasattr(msg, 'content'):
-                    user_message = str(msg.content)
-                    break
-            
-            # Generate a helpful response based on the user's message
-            if user_message.lower().startswith("hello") or user_message.lower().startswith("hi"):
-                response_text = "Hello! I'm the RAHI Assistant. How can I help you find services or navigate our platform today? 🇮🇳"
-            elif "plumber" in user_message.lower() or "electrician" in user_message.lower() or "carpenter" in user_message.lower():
-                response_text = f"I can help you find a {user_message.lower()}! Please visit our Services page (/services) to browse professionals in your area. RAHI connects you with trusted local workers. 🛠️"
-            elif "book" in user_message.lower() or "hire" in user_message.lower():
-                response_text = "To book a service, please visit our Services page (/services) where you can find and hire skilled professionals like electricians, plumbers, and carpenters. Easy booking with fair prices! 💼"
-            elif "track" in user_message.lower() or "status" in user_message.lower():
-                response_text = "You can track your bookings and check status on the Tracking page (/tracking). Enter your booking ID to see real-time updates! 📍"
-            elif "payment" in user_message.lower() or "pay" in user_message.lower():
-                response_text = "RAHI ensures fair payments with transparent pricing. Workers receive same-day payouts with our low 8-12% commission. Payments are secure and timely! 💰"
-            else:
-                response_text = f"I understand you're asking about '{user_message}'. As RAHI Assistant, I can help you navigate our platform. Visit /services to find professionals, /tracking to monitor bookings, or /login to manage your account. How else can I assist? 🤝"
-            
-            # Return a mock response object with content attribute
-            class MockResponse:
-                def __init__(self, content):
-                    self.content = content
-            
-            return MockResponse(response_text)
-    
-    return FallbackLLM()
-
-
-# Initialize the LLM - this will use the first working model or fallback
-llm = initialize_llm()
+from rahi_common.chat_service import ChatService
+from rahi_common.prompt_builder import PromptBuilder, PromptSection
 
 # RAHI System Prompt
-RAHI_SYSTEM_PROMPT = """
+# The prompt is split into a compact core and optional sections; the chat graph sends
+# the core plus only the sections relevant to the user's message.
+RAHI_CORE_PROMPT = """
 You are RAHI's intelligent assistant. RAHI is an ethical platform connecting gig workers with customers.
 You help users navigate the platform and answer questions about our services.
+"""
+
+# Always sent last, after the selected sections, as in the original single prompt
+GUIDELINES_PROMPT = """
+Guidelines:
+- If a user wants to book or find a professional (like an electrician), tell them to go to the Services section (/services).
+- Be helpful, concise, and professional.
+- Use emojis occasionally to be friendly. 🇮🇳
+"""
 
+NAVIGATION_PROMPT = """
 Navigation Links:
 - Booking/Services: /services
 - Login/Register: /login
 - Tracking: /tracking
 - Home: /
+"""
 
+KEY_INFO_PROMPT = """
 Key Information:
 - Services: Electrician, Plumber, Carpenter, Cleaning, etc.
 - Payouts: Same-day payouts for workers.
 - Commission: Fair 8-12% commission.
 - Mission: Worker dignity and fair work.
-
-Guidelines:
-- If a user wants to book or find a professional (like an electrician), tell them to go to the Services section (/services).
-- Be helpful, concise, and professional.
-- Use emojis occasionally to be friendly. 🇮🇳
 """
 
-# 3. Chat node
-def chat_node(state: ChatState):
-    messages = state["messages"]
-    
-    # Prepend system message if it's the start
-    if len(messages) == 1:
-        messages = [SystemMessage(content=RAHI_SYSTEM_PROMPT)] + messages
-        
-    try:
-        response = llm.invoke(messages)
-        return {"messages": [response]}
-    except Exception as e:
-        # Return a helpful error message
-        from langchain_core.messages import AIMessage
-        error_message = AIMessage(content=f"I'm having trouble processing your request right now. Please try again later. Error: {str(e)}")
-        return {"messages": [error_message]}
-
-
-# 4. Build graph
-graph = StateGraph(ChatState)
-graph.add_node("chat", chat_node)
-
-graph.add_edge(START, "chat")
-graph.add_edge("chat", END)
-
-chatbot = graph.compile()
-
-
-# 5. Helper function (important for API usage)
-def ask_chatbot(user_input: str) -> str:
-    initial_state = {
-        "messages": [HumanMessage(content=user_input)]
-    }
-    try:
-        result = chatbot.invoke(initial_state)
-        # Ensure we return a string
-        content = result["messages"][-1].content
-        if isinstance(content, list):
-            # Handle possible list-format content in some LLM types
-            return " ".join([part.get('text', '') if isinstance(part, dict) else str(part) for part in content])
-        return str(content)
-    except Exception as e:
-        return f"I'm having trouble processing your request: {str(e)}. You can try navigating to /services for bookings."
+NAVIGATION_KEYWORDS = (
+    "find_worker", "book", "booking", "hire", "find", "need", "service", "services", "track", "tracking",
+    "status", "login", "register", "account", "page", "where", "home", "chahiye",
+)
+KEY_INFO_KEYWORDS = (
+    "price", "pricing", "cost", "charge", "commission", "fee", "payout", "payouts", "payment",
+    "pay", "earn", "kitna", "mission", "about", "rahi", "plumber", "electrician", "carpenter", "cleaning",
+)
+
+prompt_builder = PromptBuilder(
+    RAHI_CORE_PROMPT,
+    [
+        PromptSection("navigation", NAVIGATION_PROMPT, NAVIGATION_KEYWORDS),
+        PromptSection("key_info", KEY_INFO_PROMPT, KEY_INFO_KEYWORDS),
+    ],
+    default_sections=("navigation",),
+    closing=GUIDELINES_PROMPT
+)
+
+# Full prompt with every section, kept for reference and savings reporting
+RAHI_SYSTEM_PROMPT = prompt_builder.full_prompt
+
+# Policy documents extracted by scripts/extract.py (JSONL shards, or a knowledge.json file);
+# the chat graph adds only the best-matching chunks
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+KNOWLEDGE_FILE = os.getenv("KNOWLEDGE_FILE", os.path.join(SERVICE_DIR, "..", "..", "backend", "data", "knowledge"))
+
+# Model routing, the chat graph, retrieval, conversation memory, the reply cache and
+# single-flight coalescing are shared with the other chat service (rahi_common.chat_service)
+chat_service = ChatService(prompt_builder, SERVICE_DIR, KNOWLEDGE_FILE)
+
+ask_chatbot = chat_service.ask_chatbot
+ask_chatbot_batch = chat_service.ask_chatbot_batch
+stream_chatbot = chat_service.stream_chatbot
+warm_up_llm = chat_service.warm_up_llm
+llm_ready = chat_service.llm_ready
+model_router_state = chat_service.model_router_state
+llm_status = chat_service.llm_status
+llm_usage = chat_service.llm_usage
+response_cache = chat_service.response_cache
+conversation_store = chat_service.conversation_store
+single_flight = chat_service.single_flight
+knowledge_index = chat_service.knowledge_index
@@ -1,7 +1,17 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from typing import List, Optional
+import asyncio
 import logging
+import json
+import time
+import os
+import sys
+# Modules shared with the other Python services (rahi_common) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+from rahi_common.instrumentation import instrument
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,41 +32,204 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency, status counters, X-Request-ID propagation and GET /metrics
+instrument(app, "chatbot-service")
+
 class ChatRequest(BaseModel):
     message: str
     user_id: str = None
     context: dict = {}
+    conversation_id: str = None
 
 class ChatResponse(BaseModel):
     reply: str
     success: bool
     conversation_id: str = None
 
+class BatchChatRequest(BaseModel):
+    messages: List[str]
+    context: dict = {}
+    max_concurrency: Optional[int] = None
+
+class BatchChatItem(BaseModel):
+    index: int
+    success: bool
+    reply: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatItem]
+    total: int
+    failed: int
+
 # Import the chatbot logic
-from chatbot import ask_chatbot
+from chatbot import ask_chatbot, ask_chatbot_batch, stream_chatbot, warm_up_llm, llm_ready, llm_status, llm_usage, model_router_state, response_cache, conversation_store, prompt_builder, single_flight, knowledge_index
+from rahi_common.concurrency import InFlightLimiter, CapacityExceeded, SlotStreamingResponse
+
+# Concurrency limits (per worker process)
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "200"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "2"))
+CHAT_RETRY_AFTER = int(os.getenv("CHAT_RETRY_AFTER", "2"))
+
+chat_limiter = InFlightLimiter(CHAT_MAX_IN_FLIGHT, CHAT_QUEUE_TIMEOUT, CHAT_RETRY_AFTER)
+
+# Batch limits: a whole batch holds one in-flight slot and fans out up to this many model calls
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "1000"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "16"))
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     try:
-        logger.info(f"Received chat request: {request.message[:50]}...")
-        reply = ask_chatbot(request.message)
-        logger.info("Successfully processed chat request")
-        return ChatResponse(reply=reply, success=True)
+        async with chat_limiter.slot():
+            logger.info(f"Received chat request: {request.message[:50]}...")
+            # Only client-supplied conversations are stored; one-off questions leave nothing on disk
+            conversation_id = request.conversation_id
+            reply = await ask_chatbot(request.message, request.context, conversation_id)
+            logger.info("Successfully processed chat request")
+            return ChatResponse(reply=reply, success=True, conversation_id=conversation_id)
+    except CapacityExceeded as e:
+        logger.warning(f"Chat request rejected: {chat_limiter.limit} requests already in flight")
+        raise HTTPException(
+            status_code=503,
+            detail="Chatbot is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Error processing chat request: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch_endpoint(request: BatchChatRequest):
+    """Answer a list of independent messages; results keep the request order."""
+    if not request.messages:
+        raise HTTPException(status_code=422, detail="messages must not be empty")
+    if len(request.messages) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {CHAT_BATCH_MAX_ITEMS} messages per batch")
+
+    concurrency = min(request.max_concurrency or CHAT_BATCH_CONCURRENCY, CHAT_BATCH_CONCURRENCY)
+    try:
+        async with chat_limiter.slot():
+            logger.info(f"Received chat batch: {len(request.messages)} messages, concurrency {concurrency}")
+            outcomes = await ask_chatbot_batch(request.messages, request.context, max(1, concurrency))
+    except CapacityExceeded as e:
+        logger.warning(f"Chat batch rejected: {chat_limiter.limit} requests already in flight")
+        raise HTTPException(
+            status_code=503,
+            detail="Chatbot is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    results = [
+        BatchChatItem(index=index, success=error is None, reply=reply, error=error)
+        for index, (reply, error) in enumerate(outcomes)
+    ]
+    failed = sum(1 for item in results if not item.success)
+    logger.info(f"Chat batch finished: {len(results) - failed} ok, {failed} failed")
+    return BatchChatResponse(results=results, total=len(results), failed=failed)
+
+def sse_event(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """Stream the reply as Server-Sent Events: one `data` event per token, then `done`."""
+    started = time.perf_counter()
+    try:
+        await chat_limiter.acquire()
+    except CapacityExceeded as e:
+        logger.warning(f"Chat stream rejected: {chat_limiter.limit} requests already in flight")
+        raise HTTPException(
+            status_code=503,
+            detail="Chatbot is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    logger.info(f"Received chat stream request: {request.message[:50]}...")
+    conversation_id = request.conversation_id
+
+    async def event_stream():
+        first_token_at = None
+        try:
+            async for token in stream_chatbot(request.message, conversation_id):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield sse_event({"token": token})
+
+            finished = time.perf_counter()
+            ttft_ms = round(((first_token_at or finished) - started) * 1000, 1)
+            total_ms = round((finished - started) * 1000, 1)
+            logger.info(f"Chat stream finished: ttft={ttft_ms}ms total={total_ms}ms")
+            yield sse_event({"success": True, "conversation_id": conversation_id, "ttft_ms": ttft_ms, "total_ms": total_ms}, event="done")
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
+            yield sse_event({"success": False, "error": str(e)}, event="error")
+
+    # The response releases the slot however it ends, even if the body never starts
+    return SlotStreamingResponse(
+        event_stream(),
+        chat_limiter,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/")
 async def root():
     return {
         "message": "RAHI Chatbot Service is running", 
         "version": "1.0.0", 
-        "endpoints": ["/chat", "/health"]
+        "endpoints": ["/chat", "/chat/stream", "/chat/batch", "/health", "/ready"]
     }
 
+_warm_up_task = None
+
+@app.on_event("startup")
+async def start_llm_warm_up():
+    # Select the model in the background so the port binds immediately
+    global _warm_up_task
+    _warm_up_task = asyncio.create_task(warm_up_llm())
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "RAHI Chatbot Service"}
+    return {"status": "healthy", "service": "RAHI Chatbot Service", "chat": chat_limiter.stats()}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once a Groq model is known to work; 503 while starting or serving only the fallback."""
+    if llm_ready():
+        return {"status": "ready", "model": llm_status["model"], "source": llm_status["source"]}
+    status = "fallback" if llm_status["ready"] else "starting"
+    return JSONResponse(status_code=503, content={"status": status, "error": llm_status["error"]})
+
+@app.get("/debug/models")
+async def debug_models():
+    """Routing state per model: circuit state, latency EWMA and error rate."""
+    return model_router_state()
+
+@app.get("/debug/cache")
+async def debug_cache():
+    """Reply cache counters, plus leader vs coalesced calls for identical in-flight questions."""
+    return {**response_cache.stats(), "coalescing": single_flight.stats()}
+
+@app.get("/debug/conversations")
+async def debug_conversations():
+    """Conversation store tiers: hot (in memory) and spilled (SQLite) sessions."""
+    return conversation_store.stats()
+
+@app.get("/debug/prompt")
+async def debug_prompt():
+    """System prompt sizes and input tokens saved by sending only relevant sections."""
+    return prompt_builder.stats()
+
+@app.get("/debug/retrieval")
+async def debug_retrieval():
+    """Knowledge index size, build time and query latency."""
+    return knowledge_index.stats()
+
+@app.get("/debug/llm")
+async def debug_llm(limit: int = 50):
+    """Tokens and latency per model, the slowest recent calls and the last `limit` calls."""
+    return llm_usage.snapshot(limit=min(max(limit, 0), llm_usage.capacity))
 
 if __name__ == "__main__":
     import uvicorn
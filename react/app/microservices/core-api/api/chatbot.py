@@ -1,94 +1,12 @@
-from typing import TypedDict, Annotated, List
-from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
-
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
-from langchain_groq import ChatGroq
 import os
 
-# 1. Define state
-class ChatState(TypedDict):
-    messages: Annotated[List[BaseMessage], add_messages]
-
-
-# 2. Initialize LLM with proper error handling and fallback for GROQ
-def initialize_llm():
-    groq_api_key = os.getenv("GROQ_API_KEY")
-    
-    
-        # Try to get from env fil
-    #    api
-    
-    if not groq_api_key:
-        raise ValueError("GROQ_API_KEY environment variable not set properly")
-        
-    # Try multiple GROQ models in order of preference
-    models_to_try = [
-        "llama-3.1-70b-versatile",
-        "llama-3.1-8b-instant", 
-        "llama3-groq-70b-8192-tool-use-preview", 
-        "llama3-groq-8b-8192-tool-use-preview", 
-        "gemma2-9b-it"
-    ]
-    
-    for model_name in models_to_try:
-        try:
-            llm = ChatGroq(
-                model=model_name,
-                temperature=0.7,
-                groq_api_key=groq_api_key,
-                max_retries=2
-            )
-            # Test the model with a simple call to verify it works
-            test_response = llm.invoke([HumanMessage(content="Test")])
-            print(f"Successfully initialized with GROQ model: {model_name}")
-            return llm
-        except Exception as e:
-            print(f"GROQ Model {model_name} not available or failed: {str(e)}")
-            continue
-    
-    # If no GROQ models are available, create a mock/fallback LLM
-    print("No GROQ models available. Creating fallback response handler.")
-    
-    # Create a mock-like object that behaves like an LLM for fallback
-    class FallbackLLM:
-        def invoke(self, messages):
-            # Extract user message content
-            user_message = ""
-            for msg in messages:
-                if hasattr(msg, 'content'):
-                    user_message = str(msg.content)
-                    break
-            
-            # Generate a helpful response based on the user's message
-            if user_message.lower().startswith("hello") or user_message.lower().startswith("hi"):
-                response_text = "Hello! I'm the RAHI Assistant. How can I help you find services or navigate our platform today? 🇮🇳"
-            elif "plumber" in user_message.lower() or "electrician" in user_message.lower() or "carpenter" in user_message.lower():
-                response_text = f"I can help you find a {user_message.lower()}! Please visit our Services page (/services) to browse professionals in your area. RAHI connects you with trusted local workers. 🛠️"
-            elif "book" in user_message.lower() or "hire" in user_message.lower():
-                response_text = "To book a service, please visit our Services page (/services) where you can find and hire skilled professionals like electricians, plumbers, and carpenters. Easy booking with fair prices! 💼"
-            elif "track" in user_message.lower() or "status" in user_message.lower():
-                response_text = "You can track your bookings and check status on the Tracking page (/tracking). Enter your booking ID to see real-time updates! 📍"
-            elif "payment" in user_message.lower() or "pay" in user_message.lower():
-                response_text = "RAHI ensures fair payments with transparent pricing. Workers receive same-day payouts with our low 8-12% commission. Payments are secure and timely! 💰"
-            else:
-                response_text = f"I understand you're asking about '{user_message}'. As RAHI Assistant, I can help you navigate our platform. Visit /services to find professionals, /tracking to monitor bookings, or /login to manage your account. How else can I assist? 🤝"
-            
-            # Return a mock response object with content attribute
-            class MockResponse:
-                def __init__(self, content):
-                    self.content = content
-            
-            return MockResponse(response_text)
-    
-    return FallbackLLM()
-
-
-# Initialize the LLM - this will use the first working model or fallback
-llm = initialize_llm()
+from rahi_common.chat_service import ChatService
+from rahi_common.prompt_builder import PromptBuilder, PromptSection
 
 # RAHI Voice Assistant - Professional System Prompt
-RAHI_SYSTEM_PROMPT = """
+# The prompt is split into a compact core and optional sections; the chat graph sends
+# the core plus only the sections relevant to the user's message.
+RAHI_CORE_PROMPT = """
 You are RAHI's trusted voice assistant - a helpful, respectful, and culturally-aware companion for customers across India.
 
 ## Your Identity:
@@ -104,6 +22,14 @@ You are RAHI's trusted voice assistant - a helpful, respectful, and culturally-a
 4. **Cultural Sensitivity**: Be aware of regional differences across India (Tier-2, Tier-3 cities)
 5. **Ethical Focus**: Always highlight RAHI's mission of worker dignity and fair treatment
 
+## Important Limitations:
+- Don't make promises about service availability (say "Let me check...")
+- Don't reveal technical system details or errors
+- Don't engage in non-RAHI topics (politics, religion, personal advice)
+- Don't use slang or overly casual language
+"""
+
+NAVIGATION_PROMPT = """
 ## Your Capabilities:
 ### Navigation Help:
 - Guide users to book services: "/services"
@@ -111,27 +37,31 @@ You are RAHI's trusted voice assistant - a helpful, respectful, and culturally-a
 - Direct to login/registration: "/login" 
 - Return to homepage: "/"
 
+### Response Style (Simple & Clear):
+   - DO: "You can find plumbers on our Services page. Shall I take you there?"
+   - DON'T: "Navigate to the service catalog interface for plumbing personnel."
+
+### Handling Requests (Action-Oriented):
+   - Always offer to help: "I can help you with that!"
+   - Take action immediately: "Let me take you to the booking page..."
+   - Confirm understanding: "So you need a plumber, is that correct?"
+"""
+
+PRICING_PROMPT = """
 ### Information You Can Provide:
 - **Services**: Plumber, Electrician, Carpenter, AC Repair, Cleaning, etc.
 - **Pricing**: Fair 8-12% commission (much lower than competitors)
 - **Worker Benefits**: Same-day payouts, no penalties, full control over schedule
 - **How RAHI Works**: 60-second matching, verified professionals, real-time tracking
 - **Difference from Urban Company**: Focus on Tier-2/3 cities, ethical treatment, no worker penalties
+"""
 
+CULTURAL_PROMPT = """
 ## Communication Guidelines:
 
 ### Greeting Style (Warm but Professional):
    - "Namaste! I am your RAHI Assistant. How may I help you today?"
    - "Hello! Welcome to RAHI. I'm here to assist you."
-   
-### Response Style (Simple & Clear):
-   - DO: "You can find plumbers on our Services page. Shall I take you there?"
-   - DON'T: "Navigate to the service catalog interface for plumbing personnel."
-
-### Handling Requests (Action-Oriented):
-   - Always offer to help: "I can help you with that!"
-   - Take action immediately: "Let me take you to the booking page..."
-   - Confirm understanding: "So you need a plumber, is that correct?"
 
 ### Empathy & Patience (For First-Time Users):
    - "No problem, I'll guide you step-by-step."
@@ -147,13 +77,9 @@ You are RAHI's trusted voice assistant - a helpful, respectful, and culturally-a
    - "Is there anything else I can help you with?"
    - "Feel free to ask if you need anything!"
    - "Have a great day! RAHI is always here to serve you."
+"""
 
-## Important Limitations:
-- Don't make promises about service availability (say "Let me check...")
-- Don't reveal technical system details or errors
-- Don't engage in non-RAHI topics (politics, religion, personal advice)
-- Don't use slang or overly casual language
-
+EXAMPLES_PROMPT = """
 ## Example Interactions:
 
 **User**: "Mujhe ek electrician chahiye" (I need an electrician)
@@ -164,7 +90,10 @@ You are RAHI's trusted voice assistant - a helpful, respectful, and culturally-a
 
 **User**: "Urban Company se kitna sasta hai?" (How much cheaper than Urban Company?)
 **You**: "RAHI focuses on fairness over high fees. Our workers keep 88-92% of earnings, while Urban Company takes 25-30%. This lets us offer you better prices!"
+"""
 
+# Always sent last, after the selected sections, as in the original single prompt
+CLOSING_PROMPT = """
 ## Remember:
 - You represent RAHI's values: Dignity, Fairness, Respect
 - Every interaction should leave the user feeling valued and helped
@@ -174,46 +103,58 @@ You are RAHI's trusted voice assistant - a helpful, respectful, and culturally-a
 Now, assist the user with respect, warmth, and professionalism. Jai Hind! 🇮🇳
 """
 
-# 3. Chat node
-def chat_node(state: ChatState):
-    messages = state["messages"]
-    
-    # Prepend system message if it's the start
-    if len(messages) == 1:
-        messages = [SystemMessage(content=RAHI_SYSTEM_PROMPT)] + messages
-        
-    try:
-        response = llm.invoke(messages)
-        return {"messages": [response]}
-    except Exception as e:
-        # Return a helpful error message
-        from langchain_core.messages import AIMessage
-        error_message = AIMessage(content=f"I'm having trouble processing your request right now. Please try again later. Error: {str(e)}")
-        return {"messages": [error_message]}
-
-
-# 4. Build graph
-graph = StateGraph(ChatState)
-graph.add_node("chat", chat_node)
-
-graph.add_edge(START, "chat")
-graph.add_edge("chat", END)
-
-chatbot = graph.compile()
-
-
-# 5. Helper function (important for API usage)
-def ask_chatbot(user_input: str) -> str:
-    initial_state = {
-        "messages": [HumanMessage(content=user_input)]
-    }
-    try:
-        result = chatbot.invoke(initial_state)
-        # Ensure we return a string
-        content = result["messages"][-1].content
-        if isinstance(content, list):
-            # Handle possible list-format content in some LLM types
-            return " ".join([part.get('text', '') if isinstance(part, dict) else str(part) for part in content])
-        return str(content)
-    except Exception as e:
-        return f"I'm having trouble processing your request: {str(e)}. You can try navigating to /services for bookings."
\ No newline at end of file
+NAVIGATION_KEYWORDS = (
+    "find_worker", "book", "booking", "hire", "find", "need", "service", "services", "plumber", "electrician",
+    "carpenter", "cleaning", "ac", "repair", "track", "tracking", "status", "login", "register",
+    "account", "page", "where", "chahiye", "dhoondo", "bulao",
+)
+PRICING_KEYWORDS = (
+    "price", "prices", "pricing", "cost", "charge", "charges", "commission", "fee", "fees",
+    "payout", "payouts", "payment", "pay", "earn", "earnings", "kitna", "sasta", "mehenga",
+    "cheap", "urban", "company", "competitor", "benefits",
+)
+CULTURAL_KEYWORDS = (
+    "greeting",
+    "namaste", "namaskar", "hello", "hi", "hey", "ji", "bhai", "madad", "help", "samajh",
+    "confused", "first", "kaise", "mistri", "thekedar", "thanks", "dhanyavad", "shukriya", "bye",
+)
+EXAMPLES_KEYWORDS = (
+    "mujhe", "chahiye", "kitna", "hai", "se", "karna", "kya", "kaise", "urban",
+)
+
+prompt_builder = PromptBuilder(
+    RAHI_CORE_PROMPT,
+    [
+        PromptSection("navigation", NAVIGATION_PROMPT, NAVIGATION_KEYWORDS),
+        PromptSection("pricing", PRICING_PROMPT, PRICING_KEYWORDS),
+        PromptSection("cultural", CULTURAL_PROMPT, CULTURAL_KEYWORDS),
+        PromptSection("examples", EXAMPLES_PROMPT, EXAMPLES_KEYWORDS),
+    ],
+    default_sections=("navigation",),
+    closing=CLOSING_PROMPT
+)
+
+# Full prompt with every section, kept for reference and savings reporting
+RAHI_SYSTEM_PROMPT = prompt_builder.full_prompt
+
+# Policy documents extracted by scripts/extract.py (JSONL shards, or a knowledge.json file);
+# the chat graph adds only the best-matching chunks
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+KNOWLEDGE_FILE = os.getenv("KNOWLEDGE_FILE", os.path.join(SERVICE_DIR, "..", "..", "..", "backend", "data", "knowledge"))
+
+# Model routing, the chat graph, retrieval, conversation memory, the reply cache and
+# single-flight coalescing are shared with the other chat service (rahi_common.chat_service)
+chat_service = ChatService(prompt_builder, SERVICE_DIR, KNOWLEDGE_FILE)
+
+ask_chatbot = chat_service.ask_chatbot
+ask_chatbot_batch = chat_service.ask_chatbot_batch
+stream_chatbot = chat_service.stream_chatbot
+warm_up_llm = chat_service.warm_up_llm
+llm_ready = chat_service.llm_ready
+model_router_state = chat_service.model_router_state
+llm_status = chat_service.llm_status
+llm_usage = chat_service.llm_usage
+response_cache = chat_service.response_cache
+conversation_store = chat_service.conversation_store
+single_flight = chat_service.single_flight
+knowledge_index = chat_service.knowledge_index
@@ -0,0 +1,102 @@
+import time
+
+# Upper bounds in seconds, 1 ms to ~30 s, each 25% above the last; quantiles are
+# interpolated inside a bucket, so estimates are within a few percent
+LATENCY_BUCKETS = tuple(round(0.001 * 1.25 ** i, 6) for i in range(47))
+
+
+class RollingHistogram:
+    """Latency histogram over a sliding time window, plus all-time totals.
+
+    The window is split into `slots` time slices, each with its own bucket
+    counts; a slice is cleared when the clock comes back around to it, so
+    recording and reading cost O(buckets) with no per-sample storage. The
+    all-time `counts`, `sum` and `count` only grow and are what a Prometheus
+    histogram exposes; the windowed view drives percentiles and SLO checks.
+    """
+
+    def __init__(self, window: float = 900.0, slots: int = 15, buckets: tuple = LATENCY_BUCKETS):
+        self.window = window
+        self.buckets = buckets
+        self.slot_width = window / slots
+        self._slot_ids = [-1] * slots
+        self._slot_counts = [[0] * (len(buckets) + 1) for _ in range(slots)]  # last entry: above the top bucket
+        self._slot_errors = [0] * slots
+
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def _bucket(self, seconds: float) -> int:
+        low, high = 0, len(self.buckets)
+        while low < high:
+            mid = (low + high) // 2
+            if seconds <= self.buckets[mid]:
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def _slot(self, now: float) -> int:
+        slot_id = int(now // self.slot_width)
+        index = slot_id % len(self._slot_ids)
+        if self._slot_ids[index] != slot_id:
+            self._slot_ids[index] = slot_id
+            self._slot_counts[index] = [0] * (len(self.buckets) + 1)
+            self._slot_errors[index] = 0
+        return index
+
+    def observe(self, seconds: float, now: float = None):
+        bucket = self._bucket(seconds)
+        self._slot_counts[self._slot(now or time.time())][bucket] += 1
+        self.counts[bucket] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def observe_error(self, now: float = None):
+        """A failed request: counted against availability, not latency."""
+        self._slot_errors[self._slot(now or time.time())] += 1
+        self.errors += 1
+
+    def window_counts(self, now: float = None) -> tuple:
+        """(bucket counts, errors) over the slices still inside the window."""
+        current = int((now or time.time()) // self.slot_width)
+        counts = [0] * (len(self.buckets) + 1)
+        errors = 0
+        for index, slot_id in enumerate(self._slot_ids):
+            if current - slot_id < len(self._slot_ids):
+                for bucket, value in enumerate(self._slot_counts[index]):
+                    counts[bucket] += value
+                errors += self._slot_errors[index]
+        return counts, errors
+
+    def quantile(self, q: float, counts: list = None):
+        """Estimated q-quantile in seconds over the window, or None without samples."""
+        counts = counts or self.window_counts()[0]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bucket, value in enumerate(counts):
+            if value and seen + value >= rank:
+                if bucket == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[bucket - 1] if bucket else 0.0
+                return lower + (self.buckets[bucket] - lower) * (rank - seen) / value
+            seen += value
+        return self.buckets[-1]
+
+    def snapshot(self, now: float = None) -> dict:
+        counts, errors = self.window_counts(now)
+        samples = sum(counts)
+        attempts = samples + errors
+        return {
+            "samples": samples,
+            "errors": errors,
+            "availability": samples / attempts if attempts else None,
+            "p50": self.quantile(0.5, counts),
+            "p95": self.quantile(0.95, counts),
+            "p99": self.quantile(0.99, counts),
+        }
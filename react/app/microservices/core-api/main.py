@@ -2,12 +2,20 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+# Modules shared with the other Python services (rahi_common)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from api.chatbot import ask_chatbot
+from api.chatbot import ask_chatbot, stream_chatbot, warm_up_llm, llm_ready, llm_status, llm_usage, model_router_state, response_cache, conversation_store, prompt_builder, single_flight, knowledge_index
+from rahi_common.concurrency import InFlightLimiter, CapacityExceeded, SlotStreamingResponse
+from rahi_common.instrumentation import instrument
+import asyncio
 import logging
+import json
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,30 +32,144 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency, status counters, X-Request-ID propagation and GET /metrics
+instrument(app, "core-api")
+
+# Concurrency limits (per worker process)
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "200"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "2"))
+CHAT_RETRY_AFTER = int(os.getenv("CHAT_RETRY_AFTER", "2"))
+
+chat_limiter = InFlightLimiter(CHAT_MAX_IN_FLIGHT, CHAT_QUEUE_TIMEOUT, CHAT_RETRY_AFTER)
+
 class ChatRequest(BaseModel):
     message: str
     context: dict = {}  # Additional context can be passed here
+    conversation_id: str = None  # Continue an earlier conversation
 
 
 @app.post("/chat")
 async def chat_endpoint(request: ChatRequest):
     try:
-        logger.info(f"Received chat request: {request.message[:50]}...")
-        reply = ask_chatbot(request.message)
-        logger.info("Successfully processed chat request")
-        return {"reply": reply, "success": True}
+        async with chat_limiter.slot():
+            logger.info(f"Received chat request: {request.message[:50]}...")
+            # Only client-supplied conversations are stored; one-off questions leave nothing on disk
+            conversation_id = request.conversation_id
+            reply = await ask_chatbot(request.message, request.context, conversation_id)
+            logger.info("Successfully processed chat request")
+            return {"reply": reply, "success": True, "conversation_id": conversation_id}
+    except CapacityExceeded as e:
+        logger.warning(f"Chat request rejected: {chat_limiter.limit} requests already in flight")
+        raise HTTPException(
+            status_code=503,
+            detail="Voice assistant is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Error processing chat request: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+def sse_event(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """Stream the reply as Server-Sent Events: one `data` event per token, then `done`."""
+    started = time.perf_counter()
+    try:
+        await chat_limiter.acquire()
+    except CapacityExceeded as e:
+        logger.warning(f"Chat stream rejected: {chat_limiter.limit} requests already in flight")
+        raise HTTPException(
+            status_code=503,
+            detail="Voice assistant is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    logger.info(f"Received chat stream request: {request.message[:50]}...")
+    conversation_id = request.conversation_id
+
+    async def event_stream():
+        first_token_at = None
+        try:
+            async for token in stream_chatbot(request.message, conversation_id):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield sse_event({"token": token})
+
+            finished = time.perf_counter()
+            ttft_ms = round(((first_token_at or finished) - started) * 1000, 1)
+            total_ms = round((finished - started) * 1000, 1)
+            logger.info(f"Chat stream finished: ttft={ttft_ms}ms total={total_ms}ms")
+            yield sse_event({"success": True, "conversation_id": conversation_id, "ttft_ms": ttft_ms, "total_ms": total_ms}, event="done")
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
+            yield sse_event({"success": False, "error": str(e)}, event="error")
+
+    # The response releases the slot however it ends, even if the body never starts
+    return SlotStreamingResponse(
+        event_stream(),
+        chat_limiter,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/")
 async def root():
-    return {"message": "RAHI Voice Assistant API is running", "version": "1.0.0", "endpoints": ["/chat", "/health"]}
+    return {"message": "RAHI Voice Assistant API is running", "version": "1.0.0", "endpoints": ["/chat", "/chat/stream", "/health", "/ready"]}
+
+_warm_up_task = None
+
+@app.on_event("startup")
+async def start_llm_warm_up():
+    # Select the model in the background so the port binds immediately
+    global _warm_up_task
+    _warm_up_task = asyncio.create_task(warm_up_llm())
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "RAHI Voice Assistant API"}
+    return {"status": "healthy", "service": "RAHI Voice Assistant API", "chat": chat_limiter.stats()}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once a Groq model is known to work; 503 while starting or serving only the fallback."""
+    if llm_ready():
+        return {"status": "ready", "model": llm_status["model"], "source": llm_status["source"]}
+    status = "fallback" if llm_status["ready"] else "starting"
+    return JSONResponse(status_code=503, content={"status": status, "error": llm_status["error"]})
+
+
+@app.get("/debug/models")
+async def debug_models():
+    """Routing state per model: circuit state, latency EWMA and error rate."""
+    return model_router_state()
+
+@app.get("/debug/cache")
+async def debug_cache():
+    """Reply cache counters, plus leader vs coalesced calls for identical in-flight questions."""
+    return {**response_cache.stats(), "coalescing": single_flight.stats()}
+
+@app.get("/debug/conversations")
+async def debug_conversations():
+    """Conversation store tiers: hot (in memory) and spilled (SQLite) sessions."""
+    return conversation_store.stats()
+
+@app.get("/debug/prompt")
+async def debug_prompt():
+    """System prompt sizes and input tokens saved by sending only relevant sections."""
+    return prompt_builder.stats()
+
+@app.get("/debug/retrieval")
+async def debug_retrieval():
+    """Knowledge index size, build time and query latency."""
+    return knowledge_index.stats()
+
+@app.get("/debug/llm")
+async def debug_llm(limit: int = 50):
+    """Tokens and latency per model, the slowest recent calls and the last `limit` calls."""
+    return llm_usage.snapshot(limit=min(max(limit, 0), llm_usage.capacity))
 
 
 if __name__ == "__main__":
@@ -1,9 +1,21 @@
+import argparse
+import asyncio
+import json
 import os
+import random
+import re
+import sys
 import time
-import requests
-import smtplib
-from email.mime.text import MIMEText
+import httpx
 from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+# Modules shared with the other Python services (rahi_common) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+
+from latency import RollingHistogram
+from rahi_common.smtp_pool import SmtpPool, build_message
+from timeseries import TimeSeriesStore, parse_time
 
 # Load environment variables from .env file
 def load_env():
@@ -22,6 +34,32 @@ FRONTENT_URL = os.getenv("VITE_FRONTEND_URL", "http://localhost:8080")
 BACKEND_URL = os.getenv("VITE_BACKEND_API_URL", "http://localhost:8000")
 HEALTH_ENDPOINT = f"{BACKEND_URL}/health"
 
+# Microservices behind the API gateway are read from its nginx upstreams and probed at /health
+NGINX_CONF = os.getenv("MONITOR_NGINX_CONF", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api-gateway", "nginx.conf"))
+MONITOR_HEALTH_PATH = os.getenv("MONITOR_HEALTH_PATH", "/health")
+MONITOR_TARGETS_FILE = os.getenv("MONITOR_TARGETS_FILE")  # JSON list of extra/overriding targets
+
+# Per-target defaults; override one target with e.g. MONITOR_BOOKING_SERVICE_INTERVAL=10
+MONITOR_INTERVAL = float(os.getenv("MONITOR_INTERVAL", "30"))
+MONITOR_TIMEOUT = float(os.getenv("MONITOR_TIMEOUT", "5"))
+MONITOR_JITTER = float(os.getenv("MONITOR_JITTER", "0.1"))  # +/- fraction of the interval
+ALERT_AFTER_FAILURES = int(os.getenv("MONITOR_ALERT_AFTER", "3"))  # consecutive failures (prevents flapping)
+SUMMARY_INTERVAL = float(os.getenv("MONITOR_SUMMARY_INTERVAL", "3600"))
+
+# Latency SLOs over a rolling window; per target e.g. MONITOR_BACKEND_SLO_P95=0.5
+SLO_WINDOW = float(os.getenv("MONITOR_SLO_WINDOW", "900"))  # seconds of samples behind the percentiles
+SLO_P95 = float(os.getenv("MONITOR_SLO_P95", "1.0"))  # seconds
+SLO_AVAILABILITY = float(os.getenv("MONITOR_SLO_AVAILABILITY", "0.99"))  # successful share of probes
+SLO_MIN_SAMPLES = int(os.getenv("MONITOR_SLO_MIN_SAMPLES", "5"))
+SLO_SUSTAIN = int(os.getenv("MONITOR_SLO_SUSTAIN", "3"))  # consecutive breaching checks before alerting
+
+# Prometheus text format on a small asyncio HTTP server; port 0 disables it
+METRICS_HOST = os.getenv("MONITOR_METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("MONITOR_METRICS_PORT", "9108"))
+
+# Probe history (raw samples + 1m/1h rollups) in memory-mapped ring files; empty disables it
+HISTORY_DIR = os.getenv("MONITOR_HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "monitor_history"))
+
 # Email Configuration (Loaded from .env)
 ADMIN_EMAIL = os.getenv("SMTP_EMAIL_ADMIN", "founder@rahi.com")
 EMAIL_NOTIFY_LIST = [ADMIN_EMAIL, "it-admin@rahi.com"]
@@ -30,6 +68,22 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 
+# One logged-in SMTP session is kept and reused across alerts
+alert_pool = None
+
+def get_alert_pool():
+    global alert_pool
+    if alert_pool is None:
+        alert_pool = SmtpPool(
+            SMTP_SERVER,
+            SMTP_PORT,
+            SMTP_USERNAME,
+            SMTP_PASSWORD,
+            size=int(os.getenv("SMTP_POOL_SIZE", "1")),
+            max_idle=float(os.getenv("SMTP_MAX_IDLE", "300"))
+        )
+    return alert_pool
+
 def send_alert_email(subject, body):
     """Sends an alert email if a system failure is detected."""
     print(f"🚨 ALERT: {subject}")
@@ -40,84 +94,350 @@ def send_alert_email(subject, body):
         return
 
     try:
-        msg = MIMEText(body)
-        msg['Subject'] = f"[RAHI SYSTEM ALERT] {subject}"
-        msg['From'] = "alerts@rahi.com"
-        msg['To'] = ", ".join(EMAIL_NOTIFY_LIST)
-
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(msg)
-            print("✅ Alert email sent successfully.")
+        # One message per recipient, sent back to back on one session, so a refused address does not stop the others
+        messages = [build_message("alerts@rahi.com", recipient, f"[RAHI SYSTEM ALERT] {subject}", body)
+                    for recipient in EMAIL_NOTIFY_LIST]
+        results = get_alert_pool().send_many(messages)
     except Exception as e:
         print(f"❌ Failed to send email: {e}")
+        return
+    for recipient, (_, error) in zip(EMAIL_NOTIFY_LIST, results):
+        if error is None:
+            print(f"✅ Alert email sent to {recipient}.")
+        else:
+            print(f"❌ Failed to send email to {recipient}: {error}")
 
-def check_system_health():
-    """Checks the health of the frontend and backend."""
-    status_report = {
-        "timestamp": datetime.now().isoformat(),
-        "frontend": "DOWN",
-        "backend": "DOWN",
-        "errors": []
+class Target:
+    """One HTTP endpoint probed on its own schedule, with its probe state."""
+
+    def __init__(self, name, url, interval=None, timeout=None, jitter=None, expect_healthy=False):
+        prefix = "MONITOR_" + re.sub(r"[^A-Z0-9]+", "_", name.upper()) + "_"
+        self.name = name
+        self.url = url
+        self.interval = float(interval or os.getenv(prefix + "INTERVAL", MONITOR_INTERVAL))
+        self.timeout = float(timeout or os.getenv(prefix + "TIMEOUT", MONITOR_TIMEOUT))
+        self.jitter = float(jitter if jitter is not None else os.getenv(prefix + "JITTER", MONITOR_JITTER))
+        self.expect_healthy = expect_healthy  # body must be JSON with "status": "healthy"
+        self.slo_p95 = float(os.getenv(prefix + "SLO_P95", SLO_P95))
+        self.slo_availability = float(os.getenv(prefix + "SLO_AVAILABILITY", SLO_AVAILABILITY))
+        self.histogram = RollingHistogram(SLO_WINDOW)
+
+        self.status = "UNKNOWN"
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_latency = None
+        self.last_checked = None
+        self.last_status_code = 0
+        self.slo_strikes = 0
+        self.slo_breached = []  # SLOs currently in breach (alert sent)
+
+    def next_delay(self):
+        # Jitter keeps targets that share an interval from probing in lockstep
+        return max(0.1, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+def parse_upstreams(conf_path):
+    """Map nginx upstream names to the first server address, e.g. {"auth_service": "auth-service:8001"}."""
+    if not os.path.exists(conf_path):
+        return {}
+    with open(conf_path, "r") as f:
+        conf = f.read()
+    return {
+        name: server
+        for name, server in re.findall(r"upstream\s+(\w+)\s*{[^}]*?server\s+([^\s;]+)", conf)
     }
 
-    # Check Frontend
-    try:
-        fe_resp = requests.get(FRONTENT_URL, timeout=5)
-        if fe_resp.status_code == 200:
-            status_report["frontend"] = "UP"
-        else:
-            status_report["errors"].append(f"Frontend returned status code {fe_resp.status_code}")
-    except Exception as e:
-        status_report["errors"].append(f"Frontend unreachable: {str(e)}")
 
-    # Check Backend
+def load_targets():
+    targets = {
+        "frontend": Target("frontend", FRONTENT_URL),
+        "backend": Target("backend", HEALTH_ENDPOINT, expect_healthy=True),
+    }
+    for name, server in parse_upstreams(NGINX_CONF).items():
+        targets[name] = Target(name, f"http://{server}{MONITOR_HEALTH_PATH}")
+    if MONITOR_TARGETS_FILE:
+        with open(MONITOR_TARGETS_FILE, "r") as f:
+            for spec in json.load(f):
+                targets[spec["name"]] = Target(**spec)
+    return list(targets.values())
+
+
+async def probe(client, target):
+    """One health request; updates and returns the target's state. Never raises."""
+    started = time.perf_counter()
+    error = None
+    target.last_status_code = 0
     try:
-        be_resp = requests.get(HEALTH_ENDPOINT, timeout=5)
-        if be_resp.status_code == 200:
-            status_report["backend"] = "UP"
-            data = be_resp.json()
+        resp = await client.get(target.url, timeout=target.timeout)
+        target.last_status_code = resp.status_code
+        if resp.status_code != 200:
+            error = f"{target.name} returned status code {resp.status_code}"
+        elif target.expect_healthy:
+            data = resp.json()
             if data.get("status") != "healthy":
-                status_report["errors"].append(f"Backend reporting unhealthy: {data}")
-        else:
-            status_report["errors"].append(f"Backend health check returned {be_resp.status_code}")
+                error = f"{target.name} reporting unhealthy: {data}"
     except Exception as e:
-        status_report["errors"].append(f"Backend unreachable: {str(e)}")
+        error = f"{target.name} unreachable: {type(e).__name__} {str(e)}".strip()
+    target.last_latency = time.perf_counter() - started
+    target.last_checked = datetime.now().isoformat()
+    target.last_error = error
+    if error:
+        target.status = "DOWN"
+        target.consecutive_failures += 1
+        target.histogram.observe_error()
+    else:
+        target.status = "UP"
+        target.consecutive_failures = 0
+        target.histogram.observe(target.last_latency)
+    return target
 
-    return status_report
 
-def monitor_loop():
-    """Continuous monitoring loop."""
-    print("🚀 Starting RAHI Real-Time Monitoring Agent...")
-    print(f"Monitoring: {FRONTENT_URL} and {BACKEND_URL}")
-    
-    consecutive_failures = 0
-    
+async def check_system_health(client=None, targets=None):
+    """Probes every target once, concurrently; a sweep takes about as long as the slowest probe."""
+    targets = targets or load_targets()
+    if client is None:
+        async with httpx.AsyncClient() as client:
+            return await check_system_health(client, targets)
+
+    await asyncio.gather(*(probe(client, target) for target in targets))
+    return {
+        "timestamp": datetime.now().isoformat(),
+        **{target.name: target.status for target in targets},
+        "latency_ms": {target.name: round(target.last_latency * 1000, 1) for target in targets},
+        "p95_ms": {target.name: ms(target.histogram.quantile(0.95)) for target in targets},
+        "errors": [target.last_error for target in targets if target.last_error]
+    }
+
+
+def ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def slo_violations(target, snapshot):
+    """Which of the target's SLOs the current window breaks (empty with too few samples)."""
+    violations = []
+    if snapshot["samples"] + snapshot["errors"] < SLO_MIN_SAMPLES:
+        return violations
+    if snapshot["p95"] is not None and snapshot["p95"] > target.slo_p95:
+        violations.append(f"p95 latency {ms(snapshot['p95'])} ms > {ms(target.slo_p95)} ms")
+    if snapshot["availability"] is not None and snapshot["availability"] < target.slo_availability:
+        violations.append(f"availability {snapshot['availability']:.2%} < {target.slo_availability:.2%}")
+    return violations
+
+
+async def check_slo(target):
+    """Alert once when a breach has lasted SLO_SUSTAIN checks; report when it clears."""
+    snapshot = target.histogram.snapshot()
+    violations = slo_violations(target, snapshot)
+    if not violations:
+        if target.slo_breached:
+            print(f"✅ {target.name} back within SLO (p95 {ms(snapshot['p95'])} ms)")
+        target.slo_strikes = 0
+        target.slo_breached = []
+        return
+    target.slo_strikes += 1
+    if target.slo_strikes >= SLO_SUSTAIN and not target.slo_breached:
+        target.slo_breached = violations
+        minutes = SLO_WINDOW / 60
+        subject = f"SLO breach: {target.name}"
+        body = f"System Report at {target.last_checked}\n\n"
+        body += f"{target.name} ({target.url}) over the last {minutes:g} minutes:\n"
+        body += "\n".join(f"- {violation}" for violation in violations)
+        body += f"\n\np50 {ms(snapshot['p50'])} ms, p95 {ms(snapshot['p95'])} ms, p99 {ms(snapshot['p99'])} ms, "
+        body += f"{snapshot['samples']} ok / {snapshot['errors']} failed probes"
+        await asyncio.to_thread(send_alert_email, subject, body)
+
+
+async def alert_down(target):
+    subject = f"Critical System Downtime Detected: {target.name}"
+    body = f"System Report at {target.last_checked}\n\n"
+    body += f"{target.name} ({target.url}): DOWN for {target.consecutive_failures} consecutive checks\n"
+    body += f"Error: {target.last_error}"
+    # SMTP is blocking; keep the other probes running meanwhile
+    await asyncio.to_thread(send_alert_email, subject, body)
+
+
+async def watch_target(client, target, history=None):
+    """Probe one target forever on its own interval, alerting after repeated failures."""
+    # Spread the first probes over one interval so targets do not all fire together
+    await asyncio.sleep(random.uniform(0, target.interval * target.jitter))
     while True:
-        report = check_system_health()
-        
-        if report["frontend"] == "DOWN" or report["backend"] == "DOWN":
-            consecutive_failures += 1
-            if consecutive_failures >= 3: # Alert after 3 consecutive failures (prevent flapping)
-                subject = "Critical System Downtime Detected"
-                body = f"System Report at {report['timestamp']}\n\n"
-                body += f"Frontend: {report['frontend']}\n"
-                body += f"Backend: {report['backend']}\n"
-                body += f"Errors:\n" + "\n".join(report["errors"])
-                
-                send_alert_email(subject, body)
-                consecutive_failures = 0 # Reset after alert
+        started = time.monotonic()
+        was_down = target.status == "DOWN"
+        await probe(client, target)
+        if history is not None:
+            history.record(target.name, time.time(), target.last_latency, target.status == "UP", target.last_status_code)
+        if target.status == "DOWN":
+            if target.consecutive_failures >= ALERT_AFTER_FAILURES:
+                await alert_down(target)
+                target.consecutive_failures = 0  # Reset after alert
+        elif was_down:
+            print(f"✅ {target.name} recovered ({target.last_latency * 1000:.0f} ms)")
+        await check_slo(target)
+        await asyncio.sleep(max(0.0, target.next_delay() - (time.monotonic() - started)))
+
+
+async def report_loop(targets):
+    while True:
+        await asyncio.sleep(SUMMARY_INTERVAL)
+        down = [target.name for target in targets if target.status == "DOWN"]
+        slow = [target.name for target in targets if target.slo_breached]
+        if down or slow:
+            print(f"⚠️ Down at {datetime.now().isoformat()}: {', '.join(down) or '-'}; outside SLO: {', '.join(slow) or '-'}")
         else:
-            consecutive_failures = 0
-            # Optional: Log success once an hour
-            if datetime.now().minute == 0 and datetime.now().second < 30:
-                print(f"✅ System Healthy at {report['timestamp']}")
+            p95 = ", ".join(f"{t.name} {ms(t.histogram.quantile(0.95))}" for t in targets)
+            print(f"✅ System Healthy at {datetime.now().isoformat()} (p95 ms: {p95})")
+
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics(targets):
+    """All probe state in the Prometheus text exposition format (0.0.4)."""
+    lines = [
+        "# HELP rahi_probe_up Whether the last probe succeeded.",
+        "# TYPE rahi_probe_up gauge",
+    ]
+    lines += [f'rahi_probe_up{{target="{label(t.name)}"}} {int(t.status == "UP")}' for t in targets]
+    lines += [
+        "# HELP rahi_probe_consecutive_failures Failed probes in a row.",
+        "# TYPE rahi_probe_consecutive_failures gauge",
+    ]
+    lines += [f'rahi_probe_consecutive_failures{{target="{label(t.name)}"}} {t.consecutive_failures}' for t in targets]
+    lines += [
+        "# HELP rahi_probe_total Probes by result.",
+        "# TYPE rahi_probe_total counter",
+    ]
+    for t in targets:
+        lines.append(f'rahi_probe_total{{target="{label(t.name)}",result="success"}} {t.histogram.count}')
+        lines.append(f'rahi_probe_total{{target="{label(t.name)}",result="failure"}} {t.histogram.errors}')
+    lines += [
+        "# HELP rahi_probe_duration_seconds Response time of successful probes.",
+        "# TYPE rahi_probe_duration_seconds histogram",
+    ]
+    for t in targets:
+        name, histogram = label(t.name), t.histogram
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'rahi_probe_duration_seconds_bucket{{target="{name}",le="{bound:g}"}} {cumulative}')
+        lines.append(f'rahi_probe_duration_seconds_bucket{{target="{name}",le="+Inf"}} {histogram.count}')
+        lines.append(f'rahi_probe_duration_seconds_sum{{target="{name}"}} {histogram.sum:.6f}')
+        lines.append(f'rahi_probe_duration_seconds_count{{target="{name}"}} {histogram.count}')
+    lines += [
+        f"# HELP rahi_probe_window_duration_seconds Response-time percentiles over the last {SLO_WINDOW:g}s.",
+        "# TYPE rahi_probe_window_duration_seconds gauge",
+    ]
+    snapshots = {t.name: t.histogram.snapshot() for t in targets}
+    for t in targets:
+        for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+            value = snapshots[t.name][key]
+            if value is not None:
+                lines.append(f'rahi_probe_window_duration_seconds{{target="{label(t.name)}",quantile="{quantile}"}} {value:.6f}')
+    lines += [
+        "# HELP rahi_probe_window_availability Share of successful probes over the window.",
+        "# TYPE rahi_probe_window_availability gauge",
+    ]
+    for t in targets:
+        if snapshots[t.name]["availability"] is not None:
+            lines.append(f'rahi_probe_window_availability{{target="{label(t.name)}"}} {snapshots[t.name]["availability"]:.6f}')
+    lines += [
+        "# HELP rahi_slo_p95_seconds Configured p95 latency objective.",
+        "# TYPE rahi_slo_p95_seconds gauge",
+    ]
+    lines += [f'rahi_slo_p95_seconds{{target="{label(t.name)}"}} {t.slo_p95:g}' for t in targets]
+    lines += [
+        "# HELP rahi_slo_breach Whether the target is in an alerted SLO breach.",
+        "# TYPE rahi_slo_breach gauge",
+    ]
+    lines += [f'rahi_slo_breach{{target="{label(t.name)}"}} {int(bool(t.slo_breached))}' for t in targets]
+    return "\n".join(lines) + "\n"
+
+
+def query_history(history, query):
+    """GET /history?target=backend&since=24h[&until=...][&resolution=auto|raw|1m|1h]"""
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    if history is None:
+        return "404 Not Found", {"error": "history is disabled"}
+    if "target" not in params:
+        return "200 OK", {"targets": history.targets()}
+    if not history.has(params["target"]):
+        # Only targets with recorded history; querying never creates ring files
+        return "404 Not Found", {"error": f"no history for target {params['target']!r}"}
+    now = time.time()
+    try:
+        start = parse_time(params.get("since", "24h"), now)
+        end = parse_time(params["until"], now) if "until" in params else now
+        return "200 OK", history.query(params["target"], start, end, params.get("resolution", "auto"))
+    except ValueError as e:
+        return "400 Bad Request", {"error": str(e)}
+
+
+async def serve_metrics(targets, host=METRICS_HOST, port=METRICS_PORT, history=None):
+    """Minimal HTTP/1.0 server for GET /metrics and /history; no web framework needed for two endpoints."""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass  # skip headers
+            parts = request_line.decode("latin-1").split()
+            url = urlsplit(parts[1]) if len(parts) > 1 else urlsplit("")
+            path = url.path
+            if parts and parts[0] == "GET" and path == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", render_metrics(targets)
+            elif parts and parts[0] == "GET" and path == "/history":
+                status, result = query_history(history, url.query)
+                content_type, body = "application/json", json.dumps(result)
+            elif parts and parts[0] == "GET" and path == "/health":
+                status, content_type, body = "200 OK", "application/json", json.dumps({"status": "healthy"})
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Not Found\n"
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
+
+
+async def monitor_loop():
+    """Continuous monitoring: one task per target sharing a pooled HTTP client."""
+    targets = load_targets()
+    print("🚀 Starting RAHI Real-Time Monitoring Agent...")
+    print(f"Monitoring {len(targets)} targets: " + ", ".join(f"{t.name} ({t.url}, every {t.interval:g}s)" for t in targets))
+
+    history = TimeSeriesStore(HISTORY_DIR) if HISTORY_DIR else None
+    limits = httpx.Limits(max_connections=len(targets) * 2, max_keepalive_connections=len(targets))
+    try:
+        async with httpx.AsyncClient(limits=limits) as client:
+            tasks = [report_loop(targets), *(watch_target(client, target, history) for target in targets)]
+            if METRICS_PORT:
+                tasks.append(serve_metrics(targets, history=history))
+            await asyncio.gather(*tasks)
+    finally:
+        if history is not None:
+            history.flush()
 
-        time.sleep(30) # Wait 30 seconds before next check
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAHI monitoring agent")
+    parser.add_argument("--once", action="store_true", help="probe every target once, print the report and exit")
+    args = parser.parse_args()
     try:
-        monitor_loop()
+        if args.once:
+            print(json.dumps(asyncio.run(check_system_health()), indent=2))
+        else:
+            asyncio.run(monitor_loop())
     except KeyboardInterrupt:
         print("\n👋 Monitoring Agent stopped by user.")
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from monitoring_agent import query_history
+from timeseries import TimeSeriesStore, parse_time
+
+HOUR = 1_700_000_000 // 3600 * 3600  # start of an hour
+
+
+def test_record_and_query_resolutions(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), raw_capacity=100)
+    for i in range(10):
+        store.record("backend", HOUR + i * 30, 0.1 * (i + 1), ok=i != 9, status=200 if i != 9 else 500)
+
+    raw = store.query("backend", HOUR, HOUR + 3600, "raw")["points"]
+    assert len(raw) == 10
+    assert raw[0] == {"ts": float(HOUR), "latency_ms": 100.0, "ok": True, "status": 200}
+
+    minutes = store.query("backend", HOUR, HOUR + 3600, "1m")["points"]
+    assert [point["count"] + point["errors"] for point in minutes] == [2, 2, 2, 2, 2]
+    assert minutes[-1]["errors"] == 1
+
+    hour = store.query("backend", HOUR, HOUR + 3600, "1h")["points"][0]
+    assert hour["count"] == 9 and hour["errors"] == 1
+    # The current hour's p95 comes from raw samples until the next hour starts
+    assert hour["p95_ms"] == round(float(np.percentile(np.float32([0.1 * (i + 1) for i in range(9)]), 95)) * 1000, 1)
+
+
+def test_hour_p95_is_kept_after_raw_ring_wraps(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), raw_capacity=4)
+    for i in range(4):
+        store.record("backend", HOUR + i, 0.5, ok=True)
+    for i in range(4):
+        store.record("backend", HOUR + 3600 + i, 0.1, ok=True)  # finishes the first hour, then overwrites it
+    first = store.query("backend", HOUR, HOUR + 3600, "1h")["points"][0]
+    assert first["p95_ms"] == 500.0
+    assert store.query("backend", HOUR, HOUR + 3600, "raw")["points"] == []
+
+
+def test_history_survives_reopen(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    store.record("api gateway", HOUR, 0.2, ok=True)
+    store.flush()
+
+    reopened = TimeSeriesStore(str(tmp_path))
+    assert reopened.targets() == ["api_gateway"]
+    assert reopened.has("api gateway")
+    assert len(reopened.query("api gateway", HOUR, HOUR + 60)["points"]) == 1
+
+
+def test_unknown_target_is_404_and_creates_nothing(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    store.record("backend", HOUR, 0.2, ok=True)
+    before = sorted(os.listdir(tmp_path))
+
+    status, body = query_history(store, "target=../../etc/nope&since=1h")
+    assert status == "404 Not Found"
+    status, body = query_history(store, "target=backend&since=" + str(HOUR - 1))
+    assert status == "200 OK" and len(body["points"]) == 1
+    assert sorted(os.listdir(tmp_path)) == before
+
+
+def test_parse_time():
+    assert parse_time("90m", 10_000) == 10_000 - 5400
+    assert parse_time("1700000000", 0) == 1_700_000_000
@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+import numpy as np
+
+MAGIC = b"RAHITS01"
+HEADER = np.dtype([("magic", "S8"), ("capacity", "<u4"), ("step", "<u4"), ("head", "<u8")])
+
+# Raw probe results, appended in a ring
+RAW = np.dtype([("ts", "<f8"), ("latency", "<f4"), ("status", "<u2"), ("ok", "u1"), ("pad", "u1")])
+# Rollups live in the slot for their time bucket; `bucket` tells a current record from a stale one
+MINUTE = np.dtype([("bucket", "<i4"), ("count", "<u2"), ("errors", "<u2"), ("sum", "<f4"), ("max", "<f4")])
+HOUR = np.dtype([("bucket", "<i4"), ("count", "<u2"), ("errors", "<u2"), ("sum", "<f4"), ("max", "<f4"),
+                 ("p95", "<f4"), ("pad", "<u4")])
+
+RESOLUTIONS = {"1m": (MINUTE, 60), "1h": (HOUR, 3600)}
+
+
+def safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+def open_ring(path: str, dtype: np.dtype, capacity: int, step: int = 0, readonly: bool = False) -> tuple:
+    """Map a ring file, creating it zero-filled; returns (header, records).
+
+    An existing file keeps the capacity it was created with. With `readonly`
+    a missing file raises FileNotFoundError instead of being created.
+    """
+    mode = "r" if readonly else "r+"
+    if not readonly and not os.path.exists(path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            header = np.zeros(1, HEADER)
+            header[0] = (MAGIC, capacity, step, 0)
+            f.write(header.tobytes())
+            f.truncate(HEADER.itemsize + capacity * dtype.itemsize)
+        os.replace(tmp_path, path)
+    header = np.memmap(path, dtype=HEADER, mode=mode, shape=(1,))
+    if header[0]["magic"] != MAGIC:
+        raise ValueError(f"{path} is not a time-series ring file")
+    records = np.memmap(path, dtype=dtype, mode=mode, offset=HEADER.itemsize, shape=(int(header[0]["capacity"]),))
+    return header, records
+
+
+class TargetSeries:
+    """Probe history of one target: a raw ring plus 1-minute and 1-hour rollups.
+
+    Each series is three files of fixed-width records mapped with numpy
+    memmap, so opening costs nothing and writes go straight to the page
+    cache. The raw ring keeps the latest `raw_capacity` samples; rollups
+    are written in place as samples arrive and overwrite themselves once
+    their ring wraps. An hour's p95 is computed from raw samples when the
+    next hour starts. A `readonly` series maps existing files for queries
+    and never creates or writes them.
+    """
+
+    def __init__(self, directory: str, name: str, raw_capacity: int, minute_capacity: int, hour_capacity: int,
+                 readonly: bool = False):
+        base = os.path.join(directory, safe_name(name))
+        self.name = name
+        self.readonly = readonly
+        self.raw_header, self.raw = open_ring(base + ".raw", RAW, raw_capacity, readonly=readonly)
+        self.rollups = {
+            resolution: open_ring(f"{base}.{resolution}", dtype, capacity, step, readonly)[1]
+            for resolution, (dtype, step), capacity in (
+                ("1m", RESOLUTIONS["1m"], minute_capacity),
+                ("1h", RESOLUTIONS["1h"], hour_capacity),
+            )
+        }
+        latest = self.latest()
+        self._hour = int(latest["ts"] // 3600) if latest is not None else None
+
+    def latest(self):
+        head = int(self.raw_header[0]["head"])
+        if not head:
+            return None
+        return self.raw[(head - 1) % len(self.raw)]
+
+    def _rollup(self, resolution: str, ts: float, latency: float, ok: bool):
+        records = self.rollups[resolution]
+        bucket = int(ts // RESOLUTIONS[resolution][1])
+        slot = bucket % len(records)
+        record = records[slot:slot + 1]  # a view, so field updates land in the file
+        if record["bucket"][0] != bucket:
+            record[0] = np.zeros(1, records.dtype)[0]
+            record["bucket"] = bucket
+            if resolution == "1h":
+                record["p95"] = np.nan
+        if ok:
+            record["count"] = min(int(record["count"][0]) + 1, 65535)
+            record["sum"] += latency
+            record["max"] = max(float(record["max"][0]), latency)
+        else:
+            record["errors"] = min(int(record["errors"][0]) + 1, 65535)
+
+    def _finish_hour(self, hour: int):
+        samples = self.raw_range(hour * 3600, (hour + 1) * 3600)
+        latencies = samples["latency"][samples["ok"] == 1]
+        records = self.rollups["1h"]
+        slot = hour % len(records)
+        if records[slot]["bucket"] == hour and len(latencies):
+            records["p95"][slot] = np.percentile(latencies, 95)
+
+    def record(self, ts: float, latency: float, ok: bool, status: int = 0):
+        hour = int(ts // 3600)
+        if self._hour is not None and hour > self._hour:
+            self._finish_hour(self._hour)
+        self._hour = hour
+
+        head = int(self.raw_header[0]["head"])
+        self.raw[head % len(self.raw)] = (ts, latency, status, int(ok), 0)
+        # The head moves only after the record is written, so a crash never exposes a torn sample
+        self.raw_header[0]["head"] = head + 1
+        self._rollup("1m", ts, latency, ok)
+        self._rollup("1h", ts, latency, ok)
+
+    def raw_range(self, start: float, end: float) -> np.ndarray:
+        head = int(self.raw_header[0]["head"])
+        count = min(head, len(self.raw))
+        if not count:
+            return self.raw[:0]
+        # Oldest first: the ring from the head onwards, then from the start up to the head
+        index = (np.arange(head - count, head) % len(self.raw))
+        samples = self.raw[index]
+        return samples[(samples["ts"] >= start) & (samples["ts"] < end)]
+
+    def rollup_range(self, resolution: str, start: float, end: float) -> np.ndarray:
+        records = self.rollups[resolution]
+        step = RESOLUTIONS[resolution][1]
+        first, last = int(start // step), int((end - 1e-9) // step)
+        selected = records[(records["bucket"] >= first) & (records["bucket"] <= last)
+                           & ((records["count"] > 0) | (records["errors"] > 0))]
+        return np.sort(selected, order="bucket")
+
+    def oldest(self, resolution: str):
+        """Earliest timestamp still held at a resolution, or None."""
+        if resolution == "raw":
+            head = int(self.raw_header[0]["head"])
+            if not head:
+                return None
+            return float(self.raw[0 if head <= len(self.raw) else head % len(self.raw)]["ts"])
+        records = self.rollups[resolution]
+        present = records["bucket"][(records["count"] > 0) | (records["errors"] > 0)]
+        return float(present.min() * RESOLUTIONS[resolution][1]) if len(present) else None
+
+    def flush(self):
+        if self.readonly:
+            return
+        self.raw.flush()
+        self.raw_header.flush()
+        for records in self.rollups.values():
+            records.flush()
+
+
+class TimeSeriesStore:
+    """Per-target probe history under one directory (see TargetSeries).
+
+    With the defaults (30 s probes) a target costs ~0.7 MB on disk: 2 days
+    of raw samples, 14 days of 1-minute and 400 days of 1-hour rollups.
+    """
+
+    def __init__(self, directory: str, raw_capacity: int = 5760, minute_capacity: int = 20160,
+                 hour_capacity: int = 9600):
+        self.directory = directory
+        self.raw_capacity = raw_capacity
+        self.minute_capacity = minute_capacity
+        self.hour_capacity = hour_capacity
+        self._series = {}
+        self._readers = {}  # series opened read-only for queries
+        os.makedirs(directory, exist_ok=True)
+
+    def series(self, name: str, create: bool = True) -> TargetSeries:
+        """The series being recorded for `name`; with create=False, an existing one opened read-only."""
+        if name in self._series:
+            return self._series[name]
+        if not create:
+            if name not in self._readers:
+                self._readers[name] = TargetSeries(
+                    self.directory, name, self.raw_capacity, self.minute_capacity, self.hour_capacity, readonly=True
+                )
+            return self._readers[name]
+        self._readers.pop(name, None)
+        self._series[name] = TargetSeries(
+            self.directory, name, self.raw_capacity, self.minute_capacity, self.hour_capacity
+        )
+        return self._series[name]
+
+    def targets(self) -> list:
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith(".raw"))
+
+    def has(self, name: str) -> bool:
+        return safe_name(name) in self.targets()
+
+    def record(self, name: str, ts: float, latency: float, ok: bool, status: int = 0):
+        self.series(name).record(ts, latency, ok, status)
+
+    def choose_resolution(self, name: str, start: float, end: float, max_points: int = 2000) -> str:
+        """Finest resolution that still holds `start` without returning more than ~max_points."""
+        series = self.series(name, create=False)
+        steps = (("raw", 30), ("1m", 60), ("1h", 3600))
+        oldest = {resolution: series.oldest(resolution) for resolution, _ in steps}
+        for index, (resolution, step) in enumerate(steps):
+            if oldest[resolution] is None:
+                continue
+            # Covered if it reaches back to `start`, or no coarser rollup holds anything older
+            covered = oldest[resolution] <= start or all(
+                oldest[coarser] is None or oldest[coarser] + coarser_step > oldest[resolution]
+                for coarser, coarser_step in steps[index + 1:]
+            )
+            if covered and (end - max(start, oldest[resolution])) / step <= max_points:
+                return resolution
+        return "1h"
+
+    def query(self, name: str, start: float, end: float, resolution: str = "auto") -> dict:
+        """Points in [start, end): raw samples or rollups with count/errors/mean/max (and p95 for 1h).
+
+        Raises FileNotFoundError for a target without history; nothing is created.
+        """
+        if resolution == "auto":
+            resolution = self.choose_resolution(name, start, end)
+        series = self.series(name, create=False)
+        if resolution == "raw":
+            points = [
+                {"ts": float(s["ts"]), "latency_ms": round(float(s["latency"]) * 1000, 1),
+                 "ok": bool(s["ok"]), "status": int(s["status"])}
+                for s in series.raw_range(start, end)
+            ]
+        elif resolution in RESOLUTIONS:
+            step = RESOLUTIONS[resolution][1]
+            points = []
+            for r in series.rollup_range(resolution, start, end):
+                point = {
+                    "ts": float(r["bucket"]) * step,
+                    "count": int(r["count"]),
+                    "errors": int(r["errors"]),
+                    "mean_ms": round(float(r["sum"]) / int(r["count"]) * 1000, 1) if r["count"] else None,
+                    "max_ms": round(float(r["max"]) * 1000, 1) if r["count"] else None,
+                }
+                if resolution == "1h":
+                    p95 = float(r["p95"])
+                    if np.isnan(p95):
+                        # The current hour is only finished when the next one starts; use raw samples meanwhile
+                        samples = series.raw_range(point["ts"], point["ts"] + step)
+                        latencies = samples["latency"][samples["ok"] == 1]
+                        p95 = float(np.percentile(latencies, 95)) if len(latencies) else None
+                    point["p95_ms"] = round(p95 * 1000, 1) if p95 is not None else None
+                points.append(point)
+        else:
+            raise ValueError(f"Unknown resolution {resolution!r}; use raw, 1m, 1h or auto")
+        return {"target": name, "resolution": resolution, "start": start, "end": end, "points": points}
+
+    def flush(self):
+        for series in self._series.values():
+            series.flush()
+
+
+def parse_time(value: str, now: float) -> float:
+    """Epoch seconds, an ISO timestamp, or a relative age such as 90m, 24h, 7d."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", value)
+    if match:
+        return now - float(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    default_dir = os.getenv("MONITOR_HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "monitor_history"))
+    parser = argparse.ArgumentParser(description="Query the monitoring agent's probe history")
+    parser.add_argument("--dir", default=default_dir, help="history directory (MONITOR_HISTORY_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("targets", help="list targets with history")
+    query = commands.add_parser("query", help="print a target's samples or rollups for a time range")
+    query.add_argument("target")
+    query.add_argument("--since", default="24h", help="start: epoch, ISO time or age like 24h (default 24h)")
+    query.add_argument("--until", default=None, help="end: epoch, ISO time or age (default now)")
+    query.add_argument("--resolution", default="auto", choices=["auto", "raw", "1m", "1h"])
+    query.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = parser.parse_args()
+
+    store = TimeSeriesStore(args.dir)
+    if args.command == "targets":
+        for name in store.targets():
+            latest = store.series(name, create=False).latest()
+            when = datetime.fromtimestamp(float(latest["ts"])).isoformat(timespec="seconds") if latest is not None else "-"
+            print(f"{name}\tlast sample {when}")
+        return
+
+    if not store.has(args.target):
+        parser.error(f"no history for target {args.target!r}; see the targets command")
+    now = time.time()
+    result = store.query(args.target, parse_time(args.since, now), parse_time(args.until, now) if args.until else now,
+                         args.resolution)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['target']} ({result['resolution']}, {len(result['points'])} points)")
+    for point in result["points"]:
+        when = datetime.fromtimestamp(point["ts"]).isoformat(timespec="seconds")
+        values = "  ".join(f"{key}={value}" for key, value in point.items() if key != "ts")
+        print(f"{when}  {values}")
+
+
+if __name__ == "__main__":
+    main()
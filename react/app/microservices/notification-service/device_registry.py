@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DeviceRegistry:
+    """Push device tokens indexed by user and topic.
+
+    Lookups are served from in-memory indexes (user -> tokens, topic ->
+    tokens); every change is written through to SQLite so the registry
+    survives restarts. The indexes are per process, which matches the
+    service's single uvicorn process.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS device_tokens (
+                token TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                platform TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS topic_tokens (
+                topic TEXT NOT NULL,
+                token TEXT NOT NULL,
+                PRIMARY KEY (topic, token)
+            );
+            """
+        )
+        self._user_of = {}  # token -> user_id
+        self._by_user = {}  # user_id -> set of tokens
+        self._by_topic = {}  # topic -> set of tokens
+        self.removed = 0
+        self._load()
+
+    def _load(self):
+        for token, user_id in self._conn.execute("SELECT token, user_id FROM device_tokens"):
+            self._user_of[token] = user_id
+            self._by_user.setdefault(user_id, set()).add(token)
+        for topic, token in self._conn.execute("SELECT topic, token FROM topic_tokens"):
+            if token in self._user_of:
+                self._by_topic.setdefault(topic, set()).add(token)
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN")
+        try:
+            yield
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def register(self, token: str, user_id: str, platform: str = None, topics=()):
+        with self._lock:
+            previous = self._user_of.get(token)
+            if previous is not None and previous != user_id:
+                # The device changed hands (logout/login); drop it from the old user
+                self._by_user[previous].discard(token)
+            self._user_of[token] = user_id
+            self._by_user.setdefault(user_id, set()).add(token)
+            for topic in topics:
+                self._by_topic.setdefault(topic, set()).add(token)
+            with self._transaction():
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO device_tokens VALUES (?, ?, ?, ?)", (token, user_id, platform, time.time())
+                )
+                self._conn.executemany("INSERT OR IGNORE INTO topic_tokens VALUES (?, ?)", [(topic, token) for topic in topics])
+
+    def unsubscribe(self, token: str, topics):
+        with self._lock:
+            for topic in topics:
+                self._by_topic.get(topic, set()).discard(token)
+            with self._transaction():
+                self._conn.executemany("DELETE FROM topic_tokens WHERE topic = ? AND token = ?", [(topic, token) for topic in topics])
+
+    def remove(self, tokens) -> int:
+        """Forget tokens (unregistered devices, or ones the provider rejected). Blocks on SQLite; call off the event loop."""
+        with self._lock:
+            removed = []
+            for token in tokens:
+                user_id = self._user_of.pop(token, None)
+                if user_id is None:
+                    continue
+                removed.append((token,))
+                self._by_user.get(user_id, set()).discard(token)
+                if not self._by_user.get(user_id):
+                    self._by_user.pop(user_id, None)
+                for members in self._by_topic.values():
+                    members.discard(token)
+            # One transaction for the whole prune rather than a commit per token
+            with self._transaction():
+                self._conn.executemany("DELETE FROM device_tokens WHERE token = ?", removed)
+                self._conn.executemany("DELETE FROM topic_tokens WHERE token = ?", removed)
+            self.removed += len(removed)
+        return len(removed)
+
+    def resolve(self, user_ids=(), topics=(), tokens=()) -> list:
+        """Distinct registered tokens for any of the users and topics, plus explicit tokens."""
+        with self._lock:
+            resolved = set(tokens)
+            for user_id in user_ids:
+                resolved |= self._by_user.get(user_id, set())
+            for topic in topics:
+                resolved |= self._by_topic.get(topic, set())
+        return sorted(resolved)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tokens": len(self._user_of),
+                "users": len(self._by_user),
+                "topics": len(self._by_topic),
+                "removed": self.removed,
+            }
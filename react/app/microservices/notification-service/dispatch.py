@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from outbox import DEAD, QUEUED, SENDING, SENT, SKIPPED, SUPERSEDED
+from rate_limit import is_rate_limited
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def is_permanent(error: Exception) -> bool:
+    """Client errors other than throttling (e.g. an invalid number) will not succeed on retry."""
+    if getattr(error, "permanent", False):
+        return True
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+def notification_view(record: dict) -> dict:
+    return {
+        "notification_id": record["id"],
+        "channel": record["channel"],
+        "batch_id": record["batch_id"],
+        "status": record["status"],
+        "attempts": record["attempts"],
+        "next_attempt_at": record["next_attempt_at"] if record["status"] == QUEUED else None,
+        "provider_id": record["provider_id"],
+        "error": record["error"],
+        "created_at": record["created_at"],
+        "updated_at": record["updated_at"],
+    }
+
+
+def batch_view(progress: dict) -> dict:
+    batch, counts = progress["batch"], progress["counts"]
+    done = counts[SENT] + counts[DEAD]
+    finished = done == batch["total"]
+    elapsed = ((progress["last_update"] if finished else time.time()) or time.time()) - batch["created_at"]
+    return {
+        "batch_id": batch["id"],
+        "channel": batch["channel"],
+        "total": batch["total"],
+        **counts,
+        "done": finished,
+        "progress": round(done / batch["total"], 3) if batch["total"] else 1.0,
+        "elapsed_seconds": round(elapsed, 3),
+        "sent_per_second": round(counts[SENT] / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+class Dispatcher:
+    """Delivers notifications from the durable outbox with a pool of async workers.
+
+    Handlers only write to the outbox and return; every outbox (SQLite) call
+    runs on a thread via `asyncio.to_thread` so a busy database never blocks
+    the event loop. A feeder task claims due
+    rows into a small in-memory buffer and workers call the channel's sender
+    on a dedicated thread pool (one thread per worker) because provider SDKs
+    such as Twilio block; coroutine senders (e.g. httpx-based push) are
+    awaited on the loop instead. Senders take the payload dict and return the
+    provider's message ID.
+
+    A channel with a limiter (TokenBucket) waits for a token before each call
+    and retries calls the provider throttled (429) after the limiter backs off.
+    Other failures are retried with exponential backoff and jitter until
+    `max_attempts`, then dead-lettered; 4xx errors are dead-lettered at once.
+    """
+
+    def __init__(self, outbox, senders: dict, workers: int = 8, max_pending: int = 100000,
+                 limiters: dict = None, max_throttle_retries: int = 5, max_attempts: int = 5,
+                 retry_base: float = 2.0, retry_max: float = 300.0, retention: float = 7 * 24 * 3600.0,
+                 stale_after: float = 300.0, poll_interval: float = 1.0):
+        self.outbox = outbox
+        self.senders = senders
+        self.workers = workers
+        self.max_pending = max_pending
+        self.limiters = limiters or {}
+        self.max_throttle_retries = max_throttle_retries
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.retention = retention
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+
+        self._queue = asyncio.Queue(maxsize=workers * 2)  # claimed rows waiting for a worker
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="notify")
+        self._feeder_task = None
+        self._tasks = []
+        self._pending = 0
+        self._maintained_at = 0.0
+        self.counts = {SENT: 0, "retried": 0, DEAD: 0, SUPERSEDED: 0, "merged": 0, SKIPPED: 0}
+
+    def start(self):
+        if self._tasks:
+            return
+        self._maintained_at = 0.0
+        self._feeder_task = asyncio.create_task(self._feeder())
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Stop claiming new work, let claimed notifications finish, then stop the workers."""
+        if self._feeder_task:
+            self._feeder_task.cancel()
+            await asyncio.gather(self._feeder_task, return_exceptions=True)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping with {self._queue.qsize()} claimed notifications unsent; they will be retried")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._executor.shutdown(wait=False)
+
+    # -- submission ------------------------------------------------------
+
+    async def _count_pending(self) -> int:
+        counts = await asyncio.to_thread(self.outbox.counts)
+        return counts[QUEUED] + counts[SENDING]
+
+    def _check_capacity(self, count: int):
+        if self._pending + count > self.max_pending:
+            raise QueueFull(f"Outbox has {self._pending} pending notifications (limit {self.max_pending})")
+
+    async def submit(self, channel: str, payload: dict, idempotency_key: str = None, collapse_key: str = None) -> tuple:
+        """Store a notification for delivery; returns (record, created)."""
+        self._check_capacity(1)
+        record, created = await asyncio.to_thread(self.outbox.add, channel, payload, idempotency_key, collapse_key)
+        if created:
+            self._pending += 1 - record["superseded"]
+            self.counts[SUPERSEDED] += record["superseded"]
+            self._wakeup.set()
+        return record, created
+
+    async def submit_skipped(self, channel: str, payload: dict, reason: str, idempotency_key: str = None) -> tuple:
+        """Record a notification that cannot be sent (e.g. its provider is not configured); returns (record, created)."""
+        record, created = await asyncio.to_thread(self.outbox.add_skipped, channel, payload, reason, idempotency_key)
+        if created:
+            self.counts[SKIPPED] += 1
+        return record, created
+
+    async def submit_digest(self, channel: str, payload: dict, digest_key: str, window: float, max_wait: float,
+                            merge, idempotency_key: str = None) -> tuple:
+        """Store a notification to be merged with others for the same key; returns (record, created)."""
+        self._check_capacity(1)
+        record, created = await asyncio.to_thread(
+            self.outbox.add_digest, channel, payload, digest_key, window, max_wait, merge, idempotency_key
+        )
+        if created:
+            if record["merged"]:
+                self.counts["merged"] += 1
+            else:
+                self._pending += 1
+                self._wakeup.set()
+        return record, created
+
+    async def submit_batch(self, channel: str, payloads: list, idempotency_key: str = None) -> tuple:
+        """Store many notifications in one transaction; returns (batch, created)."""
+        self._check_capacity(len(payloads))
+        batch, created = await asyncio.to_thread(self.outbox.add_batch, channel, payloads, idempotency_key)
+        if created:
+            self._pending += len(payloads)
+            self._wakeup.set()
+        return batch, created
+
+    async def get(self, notification_id: str):
+        return await asyncio.to_thread(self.outbox.get, notification_id)
+
+    async def get_batch(self, batch_id: str):
+        return await asyncio.to_thread(self.outbox.batch_progress, batch_id)
+
+    async def retry_dead(self, notification_id: str) -> bool:
+        if not await asyncio.to_thread(self.outbox.requeue_dead, notification_id):
+            return False
+        self._pending += 1
+        self._wakeup.set()
+        return True
+
+    # -- delivery --------------------------------------------------------
+
+    async def _maintain(self, now: float):
+        """Requeue stuck sends, purge old rows and resync the pending count, once a minute."""
+        if now - self._maintained_at < 60:
+            return
+        self._maintained_at = now
+        recovered = await asyncio.to_thread(self.outbox.recover, self.stale_after)
+        if recovered:
+            logger.warning(f"Requeued {recovered} notifications stuck in sending state")
+        await asyncio.to_thread(self.outbox.purge, now - self.retention)
+        self._pending = await self._count_pending()
+
+    async def _feeder(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            await self._maintain(now)
+            timeout = self.poll_interval
+            free = self._queue.maxsize - self._queue.qsize()
+            if free:
+                for record in await asyncio.to_thread(self.outbox.claim_due, free, now):
+                    self._queue.put_nowait(record)
+                if not self._queue.full():
+                    # Nothing more is due: sleep until the next retry, a new submission or the poll interval
+                    next_due = await asyncio.to_thread(self.outbox.next_due_at)
+                    if next_due is not None:
+                        timeout = min(timeout, next_due - now)
+                    if timeout <= 0:
+                        continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            record = await self._queue.get()
+            try:
+                await self._deliver(record)
+            except Exception as e:
+                logger.error(f"Unexpected error delivering {record['id']}: {str(e)}")
+            finally:
+                self._queue.task_done()
+                self._wakeup.set()
+
+    async def _call_sender(self, record: dict):
+        sender = self.senders[record["channel"]]
+        if asyncio.iscoroutinefunction(sender):
+            return await sender(record["payload"])
+        return await asyncio.get_running_loop().run_in_executor(self._executor, sender, record["payload"])
+
+    async def _send(self, record: dict):
+        limiter = self.limiters.get(record["channel"])
+        if limiter is None:
+            return await self._call_sender(record)
+
+        throttled = 0
+        while True:
+            await limiter.acquire()
+            try:
+                provider_id = await self._call_sender(record)
+            except Exception as e:
+                if not is_rate_limited(e) or throttled >= self.max_throttle_retries:
+                    raise
+                throttled += 1
+                limiter.record_throttle()
+                logger.warning(f"{record['channel']} provider throttled, backing off to {limiter.rate:.2f}/s")
+                continue
+            limiter.record_success()
+            return provider_id
+
+    def retry_delay(self, attempts: int) -> float:
+        """Exponential backoff with equal jitter: half the delay fixed, half random."""
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _deliver(self, record: dict):
+        notification_id, channel = record["id"], record["channel"]
+        try:
+            provider_id = await self._send(record)
+        except Exception as e:
+            attempts = record["attempts"] + 1
+            if is_permanent(e) or attempts >= self.max_attempts:
+                await asyncio.to_thread(self.outbox.mark_dead, notification_id, str(e))
+                self.counts[DEAD] += 1
+                self._pending -= 1
+                logger.error(f"Error sending {channel} {notification_id}, dead-lettered after {attempts} attempts: {str(e)}")
+            else:
+                delay = self.retry_delay(attempts)
+                await asyncio.to_thread(self.outbox.mark_retry, notification_id, str(e), time.time() + delay)
+                self.counts["retried"] += 1
+                logger.warning(f"Error sending {channel} {notification_id} (attempt {attempts}), retrying in {delay:.1f}s: {str(e)}")
+            return
+
+        await asyncio.to_thread(self.outbox.mark_sent, notification_id, provider_id)
+        self.counts[SENT] += 1
+        self._pending -= 1
+        logger.info(f"{channel} {notification_id} sent ({provider_id})")
+
+    async def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "claimed": self._queue.qsize(),
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "outbox": await asyncio.to_thread(self.outbox.counts),
+            **self.counts,
+            "limiters": {channel: limiter.stats() for channel, limiter in self.limiters.items()},
+        }
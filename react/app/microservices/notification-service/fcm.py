@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+import httpx
+
+FCM_SCOPE = "https://www.googleapis.com/auth/firebase.messaging"
+
+# Error codes meaning the token will never work again; the device must re-register
+INVALID_TOKEN_ERRORS = {"UNREGISTERED", "NOT_FOUND", "SENDER_ID_MISMATCH"}
+
+
+class PushError(Exception):
+    def __init__(self, message: str, status_code: int = None, permanent: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.permanent = permanent
+
+
+def error_code(response: httpx.Response) -> str:
+    """FCM v1 puts the specific code in error.details[].errorCode, the generic one in error.status."""
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        return ""
+    for detail in error.get("details", []):
+        if detail.get("errorCode"):
+            return detail["errorCode"]
+    return error.get("status", "")
+
+
+def chunked(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class FcmClient:
+    """Multicast push over the FCM HTTP v1 API on one pooled httpx client.
+
+    FCM v1 takes one token per request, so recipients are cut into
+    provider-sized chunks (500, the old multicast limit) and each chunk is
+    sent as concurrent requests, at most `concurrency` in flight, over kept-
+    alive connections. Tokens FCM reports as unregistered are handed to
+    `on_invalid` on a worker thread, since it writes to the device database,
+    and the send waits for it. Throttled (429) and 5xx sends are retried a few times within
+    the call so recipients that already got the message are not sent it again.
+    """
+
+    def __init__(self, endpoint: str, credentials_file: str = None, access_token: str = None,
+                 batch_size: int = 500, concurrency: int = 50, timeout: float = 10.0, retries: int = 2,
+                 on_invalid=None, transport: httpx.AsyncBaseTransport = None):
+        self.endpoint = endpoint
+        self.credentials_file = credentials_file
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.on_invalid = on_invalid
+        self.transport = transport  # e.g. httpx.ASGITransport for a fake FCM in tests
+
+        self._client = None
+        self._credentials = None
+        self._static_token = access_token
+        self._token_lock = None
+
+        self.requests = 0
+        self.delivered = 0
+        self.failed = 0
+        self.invalid = 0
+
+    # -- transport -------------------------------------------------------
+
+    def _http(self) -> httpx.AsyncClient:
+        # Created on first use so it binds to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                transport=self.transport,
+            )
+            self._token_lock = asyncio.Lock()
+        return self._client
+
+    async def _access_token(self) -> str:
+        if self._static_token:
+            return self._static_token
+        async with self._token_lock:
+            if self._credentials is None:
+                from google.oauth2 import service_account
+                self._credentials = service_account.Credentials.from_service_account_file(
+                    self.credentials_file, scopes=[FCM_SCOPE]
+                )
+            if not self._credentials.valid:
+                from google.auth.transport.requests import Request
+                await asyncio.to_thread(self._credentials.refresh, Request())
+            return self._credentials.token
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # -- sending ---------------------------------------------------------
+
+    @staticmethod
+    def build_message(token: str, title: str, body: str, data: dict = None, collapse_key: str = None) -> dict:
+        message = {"token": token, "notification": {"title": title, "body": body}}
+        if data:
+            # FCM data values must be strings
+            message["data"] = {str(key): str(value) for key, value in data.items()}
+        if collapse_key:
+            # Devices that were offline get only the latest message per key
+            message["android"] = {"collapse_key": collapse_key}
+            message["apns"] = {"headers": {"apns-collapse-id": collapse_key[:64]}}
+        return {"message": message}
+
+    async def _send_one(self, slots: asyncio.Semaphore, token: str, title: str, body: str,
+                        data: dict, collapse_key: str) -> tuple:
+        """Returns (outcome, detail): ("sent", message name), ("invalid", code) or ("retry"/"failed", error)."""
+        async with slots:
+            self.requests += 1
+            try:
+                response = await self._http().post(
+                    self.endpoint,
+                    json=self.build_message(token, title, body, data, collapse_key),
+                    headers={"Authorization": f"Bearer {await self._access_token()}"},
+                )
+            except httpx.HTTPError as e:
+                return "retry", PushError(f"{type(e).__name__}: {str(e)}")
+        if response.status_code == 200:
+            return "sent", response.json().get("name")
+        code = error_code(response)
+        if code in INVALID_TOKEN_ERRORS or (code == "INVALID_ARGUMENT" and "token" in response.text.lower()):
+            return "invalid", code
+        error = PushError(f"FCM {response.status_code} {code}".strip(), status_code=response.status_code)
+        if response.status_code == 429 or response.status_code >= 500:
+            error.retry_after = response.headers.get("Retry-After")
+            return "retry", error
+        if response.status_code == 401:
+            self._credentials = None  # reload and refresh on the next send
+        return "failed", error
+
+    async def send_multicast(self, tokens: list, title: str, body: str, data: dict = None,
+                             collapse_key: str = None) -> dict:
+        """Send one notification to every token; returns delivery counts.
+
+        Raises PushError if nothing could be delivered, so the dispatcher
+        retries (or dead-letters) the whole notification.
+        """
+        started = time.monotonic()
+        slots = asyncio.Semaphore(self.concurrency)
+        delivered, invalid, failed = 0, [], []
+        last_error = None
+        pending = list(tokens)
+        for attempt in range(self.retries + 1):
+            retry, wait = [], 0.0
+            for chunk in chunked(pending, self.batch_size):
+                results = await asyncio.gather(
+                    *(self._send_one(slots, token, title, body, data, collapse_key) for token in chunk)
+                )
+                for token, (outcome, detail) in zip(chunk, results):
+                    if outcome == "sent":
+                        delivered += 1
+                    elif outcome == "invalid":
+                        invalid.append(token)
+                    elif outcome == "retry":
+                        retry.append(token)
+                        last_error = detail
+                        try:
+                            wait = max(wait, float(getattr(detail, "retry_after", None) or 0))
+                        except ValueError:
+                            pass
+                    else:
+                        failed.append(token)
+                        last_error = detail
+            if not retry:
+                break
+            if attempt == self.retries:
+                failed.extend(retry)
+                break
+            pending = retry
+            await asyncio.sleep(wait or min(30.0, 2 ** attempt))
+
+        if invalid and self.on_invalid:
+            await asyncio.to_thread(self.on_invalid, invalid)
+        self.delivered += delivered
+        self.failed += len(failed)
+        self.invalid += len(invalid)
+
+        if failed and not delivered:
+            raise last_error
+        return {
+            "recipients": len(tokens),
+            "delivered": delivered,
+            "invalid_removed": len(invalid),
+            "failed": len(failed),
+            "seconds": round(time.monotonic() - started, 3),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "invalid_tokens": self.invalid,
+        }
@@ -1,12 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
+import asyncio
 import logging
 import os
-from typing import Optional
+import sys
+from typing import List, Optional
 from twilio.rest import Client
 from dotenv import load_dotenv
 
+# Modules shared with the other Python services (rahi_common) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+
+from device_registry import DeviceRegistry
+from dispatch import Dispatcher, QueueFull, batch_view, notification_view
+from fcm import FcmClient, PushError
+from rahi_common.instrumentation import instrument, span
+from outbox import Outbox
+from rate_limit import TokenBucket
+from rahi_common.smtp_pool import SmtpPool, build_message
+
 # Load environment variables
 load_dotenv()
 
@@ -29,6 +42,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency, status counters, X-Request-ID propagation and GET /metrics
+instrument(app, "notification-service")
+
 # Twilio configuration
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
@@ -45,18 +61,52 @@ class SmsRequest(BaseModel):
     to_phone: str
     message: str
     user_id: Optional[str] = None
+    priority: bool = False  # OTPs and the like; never held for a digest
+
+class BulkSmsRecipient(BaseModel):
+    to_phone: str
+    message: Optional[str] = None  # overrides the batch template
+    variables: dict = {}
+    user_id: Optional[str] = None
+
+class BulkSmsRequest(BaseModel):
+    recipients: List[BulkSmsRecipient]
+    message: Optional[str] = None  # template, e.g. "Hi {name}, new jobs in {area}"
+
+class BulkSmsResponse(BaseModel):
+    success: bool
+    message: str
+    batch_id: str
+    total: int
 
 class EmailRequest(BaseModel):
     to_email: EmailStr
     subject: str
     body: str
     user_id: Optional[str] = None
+    priority: bool = False
 
 class PushNotificationRequest(BaseModel):
     user_id: str
     title: str
     message: str
     data: Optional[dict] = None
+    collapse_key: Optional[str] = None  # e.g. "booking-456"; a newer push replaces a queued one
+
+class MulticastPushRequest(BaseModel):
+    user_ids: List[str] = []
+    topics: List[str] = []
+    tokens: List[str] = []
+    title: str
+    message: str
+    data: Optional[dict] = None
+    collapse_key: Optional[str] = None
+
+class DeviceRegistration(BaseModel):
+    token: str
+    user_id: str
+    platform: Optional[str] = None  # android, ios, web
+    topics: List[str] = []
 
 class NotificationResponse(BaseModel):
     success: bool
@@ -64,78 +114,312 @@ class NotificationResponse(BaseModel):
     provider: str
     notification_id: Optional[str] = None
 
-@app.post("/send-sms", response_model=NotificationResponse)
-async def send_sms(request: SmsRequest):
-    """Send SMS notification using Twilio"""
-    try:
-        if not twilio_client:
-            raise HTTPException(status_code=503, detail="SMS service not configured")
-        
-        logger.info(f"Sending SMS to {request.to_phone}: {request.message[:30]}...")
-        
+def deliver_sms(payload: dict) -> str:
+    """Blocking Twilio call; runs on a dispatcher worker thread."""
+    logger.info(f"Sending SMS to {payload['to_phone']}: {payload['message'][:30]}...")
+    with span("twilio.messages.create"):
         message = twilio_client.messages.create(
-            body=request.message,
+            body=payload["message"],
             from_=TWILIO_PHONE_NUMBER,
-            to=request.to_phone
+            to=payload["to_phone"]
         )
-        
-        logger.info(f"SMS sent successfully. SID: {message.sid}")
-        return NotificationResponse(
-            success=True,
-            message="SMS sent successfully",
-            provider="twilio",
-            notification_id=message.sid
+    return message.sid
+
+def deliver_email(payload: dict) -> str:
+    """Send an email over a pooled SMTP session; returns the Message-ID."""
+    msg = build_message(SMTP_FROM, payload["to_email"], payload["subject"], payload["body"])
+    with span("smtp.send"):
+        return email_pool.send(msg)
+
+async def deliver_push(payload: dict) -> str:
+    """Send a push to every device of the payload's users/topics/tokens via FCM."""
+    user_ids = payload.get("user_ids") or ([payload["user_id"]] if payload.get("user_id") else [])
+    # Resolved at send time so devices registered or removed since queueing are accounted for
+    tokens = device_registry.resolve(user_ids, payload.get("topics", []), payload.get("tokens", []))
+    if not tokens:
+        raise PushError("No registered devices for recipients", permanent=True)
+    async with span("fcm.send_multicast"):
+        result = await fcm_client.send_multicast(
+            tokens, payload["title"], payload["message"], payload.get("data"), payload.get("collapse_key")
         )
-    except Exception as e:
-        logger.error(f"Error sending SMS: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to send SMS: {str(e)}")
+    logger.info(f"Push '{payload['title']}' delivered to {result['delivered']}/{result['recipients']} devices "
+                f"in {result['seconds']}s ({result['invalid_removed']} invalid tokens removed, {result['failed']} failed)")
+    return f"delivered {result['delivered']}/{result['recipients']}, invalid {result['invalid_removed']}, failed {result['failed']}"
+
+# SMTP configuration (same variables as the monitoring agent)
+SMTP_SERVER = os.getenv("SMTP_SERVER")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_FROM = os.getenv("SMTP_FROM", "notifications@rahi.com")
+
+# Sessions stay logged in and are reused across sends
+email_pool = None
+if SMTP_SERVER:
+    email_pool = SmtpPool(
+        SMTP_SERVER,
+        SMTP_PORT,
+        SMTP_USERNAME,
+        SMTP_PASSWORD,
+        starttls=os.getenv("SMTP_STARTTLS", "true").lower() == "true",
+        use_ssl=os.getenv("SMTP_SSL", "false").lower() == "true",
+        size=int(os.getenv("SMTP_POOL_SIZE", "4")),
+        timeout=float(os.getenv("SMTP_TIMEOUT", "10"))
+    )
+else:
+    logger.warning("SMTP server not configured. Email functionality will be disabled.")
+
+# Push: device tokens by user/topic live in memory, persisted next to the outbox
+NOTIFICATION_DB = os.getenv("NOTIFICATION_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "notifications.db"))
+device_registry = DeviceRegistry(NOTIFICATION_DB)
+
+FCM_PROJECT_ID = os.getenv("FCM_PROJECT_ID")
+FCM_ENDPOINT = os.getenv("FCM_ENDPOINT", f"https://fcm.googleapis.com/v1/projects/{FCM_PROJECT_ID}/messages:send")
+FCM_CREDENTIALS = os.getenv("FCM_CREDENTIALS", os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
+FCM_ACCESS_TOKEN = os.getenv("FCM_ACCESS_TOKEN")  # static bearer token, e.g. for a local fake FCM
+PUSH_MULTICAST_MAX_RECIPIENTS = int(os.getenv("PUSH_MULTICAST_MAX_RECIPIENTS", "100000"))
+
+fcm_client = None
+if (FCM_PROJECT_ID or os.getenv("FCM_ENDPOINT")) and (FCM_CREDENTIALS or FCM_ACCESS_TOKEN):
+    fcm_client = FcmClient(
+        FCM_ENDPOINT,
+        credentials_file=FCM_CREDENTIALS,
+        access_token=FCM_ACCESS_TOKEN,
+        batch_size=int(os.getenv("FCM_BATCH_SIZE", "500")),
+        concurrency=int(os.getenv("FCM_CONCURRENCY", "50")),
+        timeout=float(os.getenv("FCM_TIMEOUT", "10")),
+        on_invalid=device_registry.remove  # awaited on a worker thread by send_multicast
+    )
+else:
+    logger.warning("FCM not configured. Push functionality will be disabled.")
+
+# Twilio's messages-per-second quota for our sender; 429s halve the rate until calls succeed again
+SMS_RATE_PER_SECOND = float(os.getenv("SMS_RATE_PER_SECOND", "10"))
+SMS_BULK_MAX_RECIPIENTS = int(os.getenv("SMS_BULK_MAX_RECIPIENTS", "10000"))
 
-@app.post("/send-email", response_model=NotificationResponse)
-async def send_email(request: EmailRequest):
-    """Send email notification (placeholder - integrate with email service)"""
+# Digest mode: non-priority SMS/email to the same user within the window are merged into one message
+NOTIFICATION_DIGEST_WINDOW = float(os.getenv("NOTIFICATION_DIGEST_WINDOW", "0"))  # seconds; 0 disables
+NOTIFICATION_DIGEST_MAX_WAIT = float(os.getenv("NOTIFICATION_DIGEST_MAX_WAIT", "120"))
+SMS_MAX_LENGTH = 1600  # Twilio's limit for a concatenated message
+
+# Handlers write to a durable SQLite outbox and return 202; a pool of workers makes the provider calls
+outbox = Outbox(NOTIFICATION_DB)
+dispatcher = Dispatcher(
+    outbox,
+    {"sms": deliver_sms, "email": deliver_email, "push": deliver_push},
+    workers=int(os.getenv("NOTIFICATION_WORKERS", "8")),
+    max_pending=int(os.getenv("NOTIFICATION_MAX_PENDING", "100000")),
+    limiters={"sms": TokenBucket(SMS_RATE_PER_SECOND)},
+    max_attempts=int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "5")),
+    retry_base=float(os.getenv("NOTIFICATION_RETRY_BASE", "2")),
+    retry_max=float(os.getenv("NOTIFICATION_RETRY_MAX", "300")),
+    retention=float(os.getenv("NOTIFICATION_RETENTION", str(7 * 24 * 3600)))
+)
+
+@app.on_event("startup")
+async def start_dispatcher():
+    dispatcher.start()
+
+@app.on_event("shutdown")
+async def stop_dispatcher():
+    await dispatcher.stop()
+    if email_pool:
+        email_pool.close()
+    if fcm_client:
+        await fcm_client.close()
+
+def merge_sms(current: dict, new: dict) -> dict:
+    """Combine a queued SMS digest with a new message, newest last, within the SMS length limit."""
+    parts = current.get("parts") or [current["message"]]
+    if new["message"] != parts[-1]:
+        parts = parts + [new["message"]]
+    kept = list(parts)
+    message = "\n".join(kept)
+    while len(kept) > 1 and len(message) > SMS_MAX_LENGTH:
+        # Drop the oldest updates first; the latest status matters most
+        kept.pop(0)
+        message = f"(+{len(parts) - len(kept)} earlier updates)\n" + "\n".join(kept)
+    return {**current, "message": message[:SMS_MAX_LENGTH], "parts": parts}
+
+def merge_email(current: dict, new: dict) -> dict:
+    """Combine a queued email digest with a new email into one message with a section per update."""
+    parts = current.get("parts") or [{"subject": current["subject"], "body": current["body"]}]
+    parts = parts + [{"subject": new["subject"], "body": new["body"]}]
+    body = "\n\n---\n\n".join(f"{part['subject']}\n\n{part['body']}" for part in parts)
+    return {**current, "subject": f"{len(parts)} updates: {new['subject']}", "body": body, "parts": parts}
+
+DIGEST_MERGE = {"sms": merge_sms, "email": merge_email}
+
+async def enqueue(channel: str, payload: dict, provider: str, label: str,
+            idempotency_key: Optional[str], response: Response, collapse_key: Optional[str] = None,
+            skip_reason: Optional[str] = None) -> NotificationResponse:
+    digest = (NOTIFICATION_DIGEST_WINDOW > 0 and channel in DIGEST_MERGE and not payload.get("priority")
+              and payload.get("user_id"))
     try:
-        logger.info(f"Sending email to {request.to_email}: {request.subject}")
-        
-        # TODO: Integrate with email service (SendGrid, SMTP, etc.)
-        # For now, log the request
-        logger.info(f"Email queued: To={request.to_email}, Subject={request.subject}")
-        
-        return NotificationResponse(
-            success=True,
-            message="Email queued for sending",
-            provider="email_service",
-            notification_id="email_" + request.to_email.replace("@", "_").replace(".", "_")
-        )
-    except Exception as e:
-        logger.error(f"Error sending email: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
+        if skip_reason:
+            # Accepted as before the provider was wired in, but recorded as skipped rather than sent
+            record, created = await dispatcher.submit_skipped(channel, payload, skip_reason, idempotency_key)
+        elif digest:
+            destination = payload.get("to_phone") or payload.get("to_email")
+            record, created = await dispatcher.submit_digest(
+                channel, payload, f"{payload['user_id']}:{destination}", NOTIFICATION_DIGEST_WINDOW,
+                NOTIFICATION_DIGEST_MAX_WAIT, DIGEST_MERGE[channel], idempotency_key
+            )
+        else:
+            record, created = await dispatcher.submit(channel, payload, idempotency_key, collapse_key)
+    except QueueFull as e:
+        logger.error(f"Rejected {channel} notification: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    if not created:
+        # A retried request with the same Idempotency-Key gets the original notification back
+        response.status_code = 200
+        logger.info(f"Duplicate {channel} request for key {idempotency_key}: {record['id']}")
+    elif record.get("superseded"):
+        logger.info(f"{channel} {record['id']} superseded {record['superseded']} queued notification(s) for {collapse_key}")
+    if not created:
+        message = f"{label} already accepted ({record['status']})"
+    elif skip_reason:
+        logger.warning(f"{label} {record['id']} not sent: {skip_reason}")
+        message = f"{label} accepted but not sent: {skip_reason}"
+    elif record.get("merged"):
+        message = f"{label} merged into pending digest"
+    else:
+        message = f"{label} queued for sending"
+    return NotificationResponse(
+        success=True,
+        message=message,
+        provider=provider,
+        notification_id=record["id"]
+    )
+
+@app.post("/send-sms", response_model=NotificationResponse, status_code=202)
+async def send_sms(request: SmsRequest, response: Response,
+                   idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """Queue an SMS notification for Twilio"""
+    if not twilio_client:
+        raise HTTPException(status_code=503, detail="SMS service not configured")
+    logger.info(f"Queueing SMS to {request.to_phone}: {request.message[:30]}...")
+    return await enqueue("sms", request.model_dump(), "twilio", "SMS", idempotency_key, response)
 
-@app.post("/send-push", response_model=NotificationResponse)
-async def send_push_notification(request: PushNotificationRequest):
-    """Send push notification (placeholder - integrate with FCM/APNs)"""
+class TemplateValues(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+def render_message(template: str, variables: dict) -> str:
+    """Fill {placeholders} from variables; unknown placeholders are left as written."""
     try:
-        logger.info(f"Sending push notification to user {request.user_id}: {request.title}")
-        
-        # TODO: Integrate with Firebase Cloud Messaging or Apple Push Notification Service
-        # For now, log the request
-        logger.info(f"Push notification queued: User={request.user_id}, Title={request.title}")
-        
-        return NotificationResponse(
-            success=True,
-            message="Push notification queued",
-            provider="push_service",
-            notification_id=f"push_{request.user_id}_{hash(request.title)}"
-        )
-    except Exception as e:
-        logger.error(f"Error sending push notification: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to send push notification: {str(e)}")
+        return template.format_map(TemplateValues(variables))
+    except (ValueError, IndexError, AttributeError):
+        return template
+
+@app.post("/send-sms/bulk", response_model=BulkSmsResponse, status_code=202)
+async def send_sms_bulk(request: BulkSmsRequest, response: Response,
+                        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """Queue one SMS per recipient, sent concurrently within the Twilio rate limit"""
+    if not twilio_client:
+        raise HTTPException(status_code=503, detail="SMS service not configured")
+    if not request.recipients:
+        raise HTTPException(status_code=422, detail="recipients must not be empty")
+    if len(request.recipients) > SMS_BULK_MAX_RECIPIENTS:
+        raise HTTPException(status_code=413, detail=f"At most {SMS_BULK_MAX_RECIPIENTS} recipients per batch")
+
+    payloads = []
+    for recipient in request.recipients:
+        template = recipient.message or request.message
+        if not template:
+            raise HTTPException(status_code=422, detail=f"No message for {recipient.to_phone}")
+        payloads.append({
+            "to_phone": recipient.to_phone,
+            "message": render_message(template, recipient.variables),
+            "user_id": recipient.user_id
+        })
+
+    try:
+        batch, created = await dispatcher.submit_batch("sms", payloads, idempotency_key)
+    except QueueFull as e:
+        logger.error(f"Rejected bulk SMS: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    if not created:
+        response.status_code = 200
+        return BulkSmsResponse(success=True, message="Batch already accepted", batch_id=batch["id"], total=batch["total"])
+    logger.info(f"Queued bulk SMS batch {batch['id']}: {batch['total']} recipients")
+    return BulkSmsResponse(success=True, message="Batch queued for sending", batch_id=batch["id"], total=batch["total"])
+
+@app.get("/send-sms/bulk/{batch_id}")
+async def bulk_sms_progress(batch_id: str):
+    """Aggregate progress of a bulk SMS batch."""
+    progress = await dispatcher.get_batch(batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {**batch_view(progress), "rate_limit": dispatcher.limiters["sms"].stats()}
+
+@app.post("/send-email", response_model=NotificationResponse, status_code=202)
+async def send_email(request: EmailRequest, response: Response,
+                     idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """Queue an email notification"""
+    logger.info(f"Queueing email to {request.to_email}: {request.subject}")
+    return await enqueue("email", request.model_dump(), "email_service", "Email", idempotency_key, response,
+                         skip_reason=None if email_pool else "email service not configured")
+
+@app.post("/send-push", response_model=NotificationResponse, status_code=202)
+async def send_push_notification(request: PushNotificationRequest, response: Response,
+                                 idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """Queue a push notification to every registered device of a user"""
+    logger.info(f"Queueing push notification to user {request.user_id}: {request.title}")
+    return await enqueue("push", request.model_dump(), "fcm", "Push notification", idempotency_key, response,
+                   request.collapse_key, skip_reason=None if fcm_client else "push service not configured")
+
+@app.post("/send-push/multicast", response_model=NotificationResponse, status_code=202)
+async def send_push_multicast(request: MulticastPushRequest, response: Response,
+                              idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """Queue one push for all devices of the given users and topics (plus explicit tokens)"""
+    if not (request.user_ids or request.topics or request.tokens):
+        raise HTTPException(status_code=422, detail="Give at least one of user_ids, topics or tokens")
+    if len(request.user_ids) + len(request.tokens) > PUSH_MULTICAST_MAX_RECIPIENTS:
+        raise HTTPException(status_code=413, detail=f"At most {PUSH_MULTICAST_MAX_RECIPIENTS} recipients per push")
+    logger.info(f"Queueing multicast push to {len(request.user_ids)} users, {len(request.topics)} topics, "
+                f"{len(request.tokens)} tokens: {request.title}")
+    return await enqueue("push", request.model_dump(), "fcm", "Push notification", idempotency_key, response,
+                   request.collapse_key, skip_reason=None if fcm_client else "push service not configured")
+
+@app.post("/devices", status_code=201)
+async def register_device(request: DeviceRegistration):
+    """Register (or move) a device token for a user and subscribe it to topics."""
+    await asyncio.to_thread(device_registry.register, request.token, request.user_id, request.platform, request.topics)
+    return {"token": request.token, "user_id": request.user_id, "topics": request.topics}
+
+@app.delete("/devices/{token}")
+async def unregister_device(token: str):
+    if not await asyncio.to_thread(device_registry.remove, [token]):
+        raise HTTPException(status_code=404, detail="Device not registered")
+    return {"token": token, "removed": True}
+
+@app.delete("/devices/{token}/topics/{topic}")
+async def unsubscribe_device(token: str, topic: str):
+    await asyncio.to_thread(device_registry.unsubscribe, token, [topic])
+    return {"token": token, "topic": topic, "subscribed": False}
+
+@app.get("/notifications/{notification_id}")
+async def notification_status(notification_id: str):
+    """Delivery status of a notification: queued (incl. waiting to retry), sending, sent or dead."""
+    record = await dispatcher.get(notification_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    return notification_view(record)
+
+@app.post("/notifications/{notification_id}/retry")
+async def retry_notification(notification_id: str):
+    """Move a dead-lettered notification back to the queue with fresh attempts."""
+    if not await dispatcher.retry_dead(notification_id):
+        raise HTTPException(status_code=409, detail="Notification not found or not dead-lettered")
+    return notification_view(await dispatcher.get(notification_id))
 
 @app.get("/")
 async def root():
     return {
         "message": "RAHI Notification Service is running", 
         "version": "1.0.0", 
-        "endpoints": ["/send-sms", "/send-email", "/send-push", "/health"],
+        "endpoints": ["/send-sms", "/send-sms/bulk", "/send-email", "/send-push", "/send-push/multicast", "/devices", "/notifications/{id}", "/health"],
         "sms_enabled": twilio_client is not None
     }
 
@@ -144,7 +428,12 @@ async def health_check():
     return {
         "status": "healthy", 
         "service": "RAHI Notification Service",
-        "sms_enabled": twilio_client is not None
+        "sms_enabled": twilio_client is not None,
+        "email_enabled": email_pool is not None,
+        "push_enabled": fcm_client is not None,
+        "dispatch": await dispatcher.stats(),
+        "smtp": email_pool.stats() if email_pool else None,
+        "push": {**fcm_client.stats(), "devices": device_registry.stats()} if fcm_client else None
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,398 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+DEAD = "dead"
+SUPERSEDED = "superseded"
+SKIPPED = "skipped"  # accepted while the channel's provider is not configured; never sent
+STATUSES = (QUEUED, SENDING, SENT, DEAD, SUPERSEDED, SKIPPED)
+
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+_id_lock = threading.Lock()
+_last_id = [0, 0]  # [milliseconds, random part]
+
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_id() -> str:
+    """ULID-style ID: 48-bit millisecond timestamp + 80 random bits, Crockford base32.
+
+    IDs sort by creation time; within one millisecond the random part is
+    incremented so IDs from this process stay strictly increasing.
+    """
+    with _id_lock:
+        now_ms = int(time.time() * 1000)
+        if now_ms <= _last_id[0]:
+            now_ms = _last_id[0]
+            randomness = (_last_id[1] + 1) & ((1 << 80) - 1)
+        else:
+            randomness = int.from_bytes(os.urandom(10), "big")
+        _last_id[0], _last_id[1] = now_ms, randomness
+    return _encode(now_ms, 10) + _encode(randomness, 16)
+
+
+# Idempotency keys are scoped by channel: an SMS and an email may carry the same Idempotency-Key
+BATCHES_TABLE = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    channel TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    idempotency_key TEXT,
+    created_at REAL NOT NULL,
+    UNIQUE (channel, idempotency_key)
+)
+"""
+# Idempotency keys of messages merged into another row's digest
+MERGED_KEYS_TABLE = """
+CREATE TABLE IF NOT EXISTS merged_keys (
+    channel TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    notification_id TEXT NOT NULL,
+    PRIMARY KEY (channel, idempotency_key)
+)
+"""
+
+
+class Outbox:
+    """Durable notification outbox in a WAL-mode SQLite table.
+
+    Every accepted notification is written here before the request returns,
+    so a burst or a restart never loses it. Rows move queued -> sending ->
+    sent, or back to queued with a later `next_attempt_at` after a failure,
+    and finally to dead once retries are exhausted. A client-supplied
+    idempotency key maps repeated requests on the same channel onto the
+    original row. A row
+    stored with a collapse key supersedes queued rows of the same channel and
+    key, so only the latest update for e.g. a booking is sent. Rows stored
+    with a digest key are held for a window and later messages with the same
+    key are merged into them (`add_digest`).
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                idempotency_key TEXT,
+                batch_id TEXT,
+                provider_id TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            DROP INDEX IF EXISTS outbox_idempotency_key;
+            CREATE UNIQUE INDEX IF NOT EXISTS outbox_channel_idempotency_key ON outbox (channel, idempotency_key);
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS outbox_batch ON outbox (batch_id, status);
+            """
+        )
+        self._conn.execute(BATCHES_TABLE)
+        self._rebuild_unscoped("batches", BATCHES_TABLE, "SELECT * FROM batches_unscoped")
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        for column in ("collapse_key", "digest_key"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_collapse ON outbox (channel, collapse_key, status)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_digest ON outbox (channel, digest_key, status)")
+        self._conn.execute(MERGED_KEYS_TABLE)
+        self._rebuild_unscoped(
+            "merged_keys",
+            MERGED_KEYS_TABLE,
+            "SELECT outbox.channel, merged_keys_unscoped.idempotency_key, merged_keys_unscoped.notification_id "
+            "FROM merged_keys_unscoped JOIN outbox ON outbox.id = merged_keys_unscoped.notification_id",
+        )
+
+    def _rebuild_unscoped(self, table: str, create_table: str, copy_rows: str):
+        """Recreate a table from an older release whose idempotency keys were unique across channels."""
+        schema = self._conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if "(channel, idempotency_key)" in schema["sql"]:
+            return
+        # SQLite cannot drop an inline UNIQUE constraint, so the rows move to a new table
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(f"ALTER TABLE {table} RENAME TO {table}_unscoped")
+            self._conn.execute(create_table)
+            self._conn.execute(f"INSERT OR IGNORE INTO {table} {copy_rows}")
+            self._conn.execute(f"DROP TABLE {table}_unscoped")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row(row) -> dict:
+        record = dict(row)
+        record["payload"] = json.loads(record["payload"])
+        return record
+
+    def _insert(self, channel: str, payload: dict, idempotency_key=None, batch_id=None, now=None,
+                collapse_key=None, digest_key=None, send_at=None, status=QUEUED, error=None) -> str:
+        now = now or time.time()
+        notification_id = new_id()
+        self._conn.execute(
+            "INSERT INTO outbox (id, channel, payload, status, attempts, next_attempt_at, idempotency_key, "
+            "batch_id, collapse_key, digest_key, error, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (notification_id, channel, json.dumps(payload, ensure_ascii=False), status, send_at or now,
+             idempotency_key, batch_id, collapse_key, digest_key, error, now, now),
+        )
+        return notification_id
+
+    def _find_by_key(self, channel: str, idempotency_key: str):
+        row = self._conn.execute(
+            "SELECT * FROM outbox WHERE channel = ? AND idempotency_key = ?", (channel, idempotency_key)
+        ).fetchone()
+        if row is None:
+            row = self._conn.execute(
+                "SELECT outbox.* FROM merged_keys JOIN outbox ON outbox.id = merged_keys.notification_id "
+                "WHERE merged_keys.channel = ? AND merged_keys.idempotency_key = ?", (channel, idempotency_key)
+            ).fetchone()
+        return self._row(row) if row is not None else None
+
+    def add(self, channel: str, payload: dict, idempotency_key: str = None, collapse_key: str = None) -> tuple:
+        """Store a notification; returns (record, created). A known key returns the original.
+
+        With a collapse key, queued notifications on the same channel and key
+        are marked superseded in the same transaction; the new record's
+        `superseded` field holds how many.
+        """
+        with self._lock:
+            if idempotency_key:
+                existing = self._find_by_key(channel, idempotency_key)
+                if existing is not None:
+                    return existing, False
+            superseded = 0
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                if collapse_key:
+                    # Rows already claimed (sending) are left alone; only unsent ones are replaced
+                    superseded = self._conn.execute(
+                        "UPDATE outbox SET status = ?, updated_at = ? WHERE channel = ? AND collapse_key = ? AND status = ?",
+                        (SUPERSEDED, now, channel, collapse_key, QUEUED),
+                    ).rowcount
+                notification_id = self._insert(channel, payload, idempotency_key, now=now, collapse_key=collapse_key)
+                self._conn.execute("COMMIT")
+            except sqlite3.IntegrityError:
+                self._conn.execute("ROLLBACK")
+                # Another worker process stored the same key first
+                return self._find_by_key(channel, idempotency_key), False
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            record = self.get(notification_id)
+            record["superseded"] = superseded
+            return record, True
+
+    def add_skipped(self, channel: str, payload: dict, reason: str, idempotency_key: str = None) -> tuple:
+        """Record a notification that will not be sent, with `reason` as its error; returns (record, created)."""
+        with self._lock:
+            if idempotency_key:
+                existing = self._find_by_key(channel, idempotency_key)
+                if existing is not None:
+                    return existing, False
+            try:
+                notification_id = self._insert(channel, payload, idempotency_key, status=SKIPPED, error=reason)
+            except sqlite3.IntegrityError:
+                return self._find_by_key(channel, idempotency_key), False
+            return self.get(notification_id), True
+
+    def add_digest(self, channel: str, payload: dict, digest_key: str, window: float, max_wait: float,
+                   merge, idempotency_key: str = None) -> tuple:
+        """Hold a notification for `window` seconds, merging later ones with the same digest key.
+
+        If a queued, never-attempted row with this key exists, `merge(old
+        payload, new payload)` replaces its payload and its send time moves to
+        `window` from now, but never beyond `max_wait` after the row was
+        created. Otherwise a new row is stored to be sent `window` from now.
+        Returns (record, created); the record's `merged` field says which.
+        """
+        with self._lock:
+            if idempotency_key:
+                existing = self._find_by_key(channel, idempotency_key)
+                if existing is not None:
+                    return existing, False
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT * FROM outbox WHERE channel = ? AND digest_key = ? AND status = ? AND attempts = 0 "
+                    "ORDER BY id DESC LIMIT 1",
+                    (channel, digest_key, QUEUED),
+                ).fetchone()
+                if row is None:
+                    notification_id = self._insert(channel, payload, idempotency_key, now=now,
+                                                   digest_key=digest_key, send_at=now + window)
+                else:
+                    notification_id = row["id"]
+                    merged = merge(json.loads(row["payload"]), payload)
+                    self._conn.execute(
+                        "UPDATE outbox SET payload = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                        (json.dumps(merged, ensure_ascii=False), min(now + window, row["created_at"] + max_wait),
+                         now, notification_id),
+                    )
+                    if idempotency_key:
+                        self._conn.execute(
+                            "INSERT INTO merged_keys VALUES (?, ?, ?)", (channel, idempotency_key, notification_id)
+                        )
+                self._conn.execute("COMMIT")
+            except sqlite3.IntegrityError:
+                self._conn.execute("ROLLBACK")
+                return self._find_by_key(channel, idempotency_key), False
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            record = self.get(notification_id)
+            record["merged"] = row is not None
+            return record, True
+
+    def add_batch(self, channel: str, payloads: list, idempotency_key: str = None) -> tuple:
+        """Store many notifications in one transaction; returns (batch, created)."""
+        with self._lock:
+            if idempotency_key:
+                existing = self._conn.execute(
+                    "SELECT * FROM batches WHERE channel = ? AND idempotency_key = ?", (channel, idempotency_key)
+                ).fetchone()
+                if existing is not None:
+                    return dict(existing), False
+            now = time.time()
+            batch = {"id": new_id(), "channel": channel, "total": len(payloads), "idempotency_key": idempotency_key, "created_at": now}
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("INSERT INTO batches VALUES (:id, :channel, :total, :idempotency_key, :created_at)", batch)
+                for payload in payloads:
+                    self._insert(channel, payload, batch_id=batch["id"], now=now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return batch, True
+
+    def get(self, notification_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM outbox WHERE id = ?", (notification_id,)).fetchone()
+            return self._row(row) if row is not None else None
+
+    def claim_due(self, limit: int, now: float = None) -> list:
+        """Mark up to `limit` due notifications as sending and return them, oldest first."""
+        now = now or time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes never claim the same row
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT * FROM outbox WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                    (QUEUED, now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET status = ?, updated_at = ? WHERE id = ?",
+                    [(SENDING, now, row["id"]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return [self._row(row) for row in rows]
+
+    def next_due_at(self):
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?", (QUEUED,)).fetchone()
+            return row[0]
+
+    def mark_sent(self, notification_id: str, provider_id: str = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, provider_id = ?, error = NULL, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (SENT, provider_id, time.time(), notification_id),
+            )
+
+    def mark_retry(self, notification_id: str, error: str, next_attempt_at: float):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, error = ?, attempts = attempts + 1, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                (QUEUED, error, next_attempt_at, time.time(), notification_id),
+            )
+
+    def mark_dead(self, notification_id: str, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, error = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (DEAD, error, time.time(), notification_id),
+            )
+
+    def requeue_dead(self, notification_id: str) -> bool:
+        """Give a dead-lettered notification a fresh set of attempts."""
+        with self._lock:
+            now = time.time()
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, now, now, notification_id, DEAD),
+            )
+            return cursor.rowcount > 0
+
+    def recover(self, stale_after: float) -> int:
+        """Requeue notifications stuck in `sending` (e.g. the process died mid-send).
+
+        Delivery is at-least-once: a send that did reach the provider before
+        the crash will be repeated.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, SENDING, time.time() - stale_after),
+            )
+            return cursor.rowcount
+
+    def purge(self, older_than: float) -> int:
+        """Delete sent, dead, superseded and skipped notifications last updated before `older_than`."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM outbox WHERE status IN (?, ?, ?, ?) AND updated_at < ?",
+                (SENT, DEAD, SUPERSEDED, SKIPPED, older_than),
+            )
+            self._conn.execute(
+                "DELETE FROM batches WHERE created_at < ? AND id NOT IN (SELECT DISTINCT batch_id FROM outbox WHERE batch_id IS NOT NULL)",
+                (older_than,),
+            )
+            self._conn.execute("DELETE FROM merged_keys WHERE notification_id NOT IN (SELECT id FROM outbox)")
+            return cursor.rowcount
+
+    def batch_progress(self, batch_id: str):
+        with self._lock:
+            batch = self._conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            if batch is None:
+                return None
+            counts = {status: 0 for status in STATUSES}
+            counts.update(dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM outbox WHERE batch_id = ? GROUP BY status", (batch_id,)
+            ).fetchall()))
+            last_update = self._conn.execute("SELECT MAX(updated_at) FROM outbox WHERE batch_id = ?", (batch_id,)).fetchone()[0]
+        return {"batch": dict(batch), "counts": counts, "last_update": last_update}
+
+    def counts(self) -> dict:
+        with self._lock:
+            counts = {status: 0 for status in STATUSES}
+            counts.update(dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()))
+            return counts
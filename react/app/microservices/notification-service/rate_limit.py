@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """True for provider throttling errors (HTTP 429), e.g. TwilioRestException."""
+    return getattr(error, "status", None) == 429 or getattr(error, "status_code", None) == 429
+
+
+class TokenBucket:
+    """Async token bucket sized to a provider's messages-per-second quota.
+
+    `acquire()` waits for a token. A throttling response from the provider
+    (`record_throttle`) halves the send rate and pauses the bucket with an
+    exponentially growing backoff; each success (`record_success`) restores the
+    rate additively until it is back at the configured quota.
+    """
+
+    def __init__(self, rate: float, burst: float = None, min_rate: float = None, max_backoff: float = 30.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.min_rate = min_rate or max(0.1, rate / 16)
+        self.max_backoff = max_backoff
+
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.backoff = 0.0
+        self.throttles = 0
+        self.acquired = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.acquired += 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def record_throttle(self, retry_after: float = None):
+        now = time.monotonic()
+        self.throttles += 1
+        if now < self.paused_until:
+            return  # calls already in flight when the first 429 arrived; one backoff covers them
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else 1.0)
+        self.tokens = 0.0
+        self.updated_at = now
+        self.paused_until = max(self.paused_until, now + (retry_after or self.backoff))
+
+    def record_success(self):
+        self.backoff = 0.0
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": round(self.rate, 3),
+            "max_rate_per_second": self.max_rate,
+            "tokens": round(self.tokens, 2),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 3),
+            "throttles": self.throttles,
+            "acquired": self.acquired,
+        }
@@ -0,0 +1,119 @@
+import asyncio
+
+from dispatch import Dispatcher
+from outbox import QUEUED, SENT, SKIPPED, SUPERSEDED, Outbox
+
+
+def test_idempotency_key_returns_original(tmp_path):
+    outbox = Outbox(str(tmp_path / "notifications.db"))
+    first, created = outbox.add("sms", {"message": "hi"}, idempotency_key="key-1")
+    again, created_again = outbox.add("sms", {"message": "hi again"}, idempotency_key="key-1")
+    assert created and not created_again
+    assert again["id"] == first["id"]
+    assert again["payload"] == {"message": "hi"}
+    assert outbox.counts()[QUEUED] == 1
+
+
+def test_idempotency_keys_are_scoped_by_channel(tmp_path):
+    outbox = Outbox(str(tmp_path / "notifications.db"))
+    sms, _ = outbox.add("sms", {"message": "hi"}, idempotency_key="key-1")
+    email, created = outbox.add("email", {"subject": "hi"}, idempotency_key="key-1")
+    assert created and email["id"] != sms["id"]
+
+    def merge(current, new):
+        return {**current, **new}
+
+    outbox.add_digest("sms", {"message": "a"}, "user-1", 30, 120, merge, idempotency_key="key-2")
+    _, created = outbox.add_digest("email", {"subject": "a"}, "user-1", 30, 120, merge, idempotency_key="key-2")
+    assert created
+
+    outbox.add_batch("sms", [{"message": "a"}], idempotency_key="key-3")
+    _, created = outbox.add_batch("email", [{"subject": "a"}], idempotency_key="key-3")
+    assert created
+
+
+def test_unscoped_tables_are_migrated(tmp_path):
+    db = str(tmp_path / "notifications.db")
+    outbox = Outbox(db)
+    digest, _ = outbox.add_digest("sms", {"message": "a"}, "user-1", 30, 120, lambda c, n: n, idempotency_key="key-1")
+    outbox.add_batch("sms", [{"message": "a"}], idempotency_key="key-2")
+    # Recreate the tables as an older release left them
+    outbox._conn.executescript(
+        """
+        DROP TABLE merged_keys;
+        CREATE TABLE merged_keys (idempotency_key TEXT PRIMARY KEY, notification_id TEXT NOT NULL);
+        ALTER TABLE batches RENAME TO batches_new;
+        CREATE TABLE batches (id TEXT PRIMARY KEY, channel TEXT NOT NULL, total INTEGER NOT NULL,
+                              idempotency_key TEXT UNIQUE, created_at REAL NOT NULL);
+        INSERT INTO batches SELECT * FROM batches_new;
+        DROP TABLE batches_new;
+        """
+    )
+    outbox._conn.execute("INSERT INTO merged_keys VALUES ('key-3', ?)", (digest["id"],))
+
+    migrated = Outbox(db)
+    assert migrated.add_digest("sms", {"message": "b"}, "user-1", 30, 120, lambda c, n: n,
+                               idempotency_key="key-3")[0]["id"] == digest["id"]
+    assert not migrated.add_batch("sms", [{"message": "a"}], idempotency_key="key-2")[1]
+    assert migrated.add_batch("email", [{"subject": "a"}], idempotency_key="key-2")[1]
+
+
+def test_skipped_notification_is_recorded_but_never_claimed(tmp_path):
+    outbox = Outbox(str(tmp_path / "notifications.db"))
+    record, created = outbox.add_skipped("email", {"subject": "hi"}, "email service not configured", "key-1")
+    assert created and record["status"] == SKIPPED
+    assert record["error"] == "email service not configured"
+    assert outbox.add_skipped("email", {"subject": "hi"}, "email service not configured", "key-1")[0]["id"] == record["id"]
+    assert outbox.claim_due(10) == []
+    assert outbox.purge(record["updated_at"] + 1) == 1
+
+
+def test_collapse_key_supersedes_queued_rows(tmp_path):
+    outbox = Outbox(str(tmp_path / "notifications.db"))
+    old, _ = outbox.add("push", {"title": "matched"}, collapse_key="booking-1")
+    other, _ = outbox.add("push", {"title": "other"}, collapse_key="booking-2")
+    new, _ = outbox.add("push", {"title": "on the way"}, collapse_key="booking-1")
+    assert new["superseded"] == 1
+    assert outbox.get(old["id"])["status"] == SUPERSEDED
+    assert outbox.get(other["id"])["status"] == QUEUED
+    assert [row["id"] for row in outbox.claim_due(10)] == [other["id"], new["id"]]
+
+
+def test_digest_merges_into_pending_row(tmp_path):
+    outbox = Outbox(str(tmp_path / "notifications.db"))
+
+    def merge(current, new):
+        return {"message": current["message"] + "\n" + new["message"]}
+
+    first, _ = outbox.add_digest("sms", {"message": "a"}, "user-1", 30, 120, merge, idempotency_key="k1")
+    merged, created = outbox.add_digest("sms", {"message": "b"}, "user-1", 30, 120, merge, idempotency_key="k2")
+    assert created and merged["merged"] and merged["id"] == first["id"]
+    assert merged["payload"]["message"] == "a\nb"
+    # The merged message's key still finds the digest row
+    again, created_again = outbox.add_digest("sms", {"message": "b"}, "user-1", 30, 120, merge, idempotency_key="k2")
+    assert not created_again and again["id"] == first["id"]
+
+
+def test_dispatcher_delivers_from_outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / "notifications.db"))
+    sent = []
+
+    async def send(payload):
+        sent.append(payload["message"])
+        return f"provider-{len(sent)}"
+
+    async def run():
+        dispatcher = Dispatcher(outbox, {"sms": send}, workers=2, poll_interval=0.05)
+        dispatcher.start()
+        record, _ = await dispatcher.submit("sms", {"message": "hello"})
+        for _ in range(100):
+            if (await dispatcher.get(record["id"]))["status"] == SENT:
+                break
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+        return await dispatcher.get(record["id"])
+
+    record = asyncio.run(run())
+    assert record["status"] == SENT
+    assert record["provider_id"] == "provider-1"
+    assert sent == ["hello"]
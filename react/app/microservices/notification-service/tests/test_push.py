@@ -0,0 +1,115 @@
+import asyncio
+import json
+import threading
+
+import httpx
+import pytest
+
+from device_registry import DeviceRegistry
+from fcm import FcmClient, PushError
+
+
+class FakeFcm:
+    """FCM v1 stand-in: tokens starting with "dead" are unregistered, "flaky" ones fail once with 503."""
+
+    def __init__(self):
+        self.requests = []
+        self.flaked = set()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        message = json.loads(request.content)["message"]
+        token = message["token"]
+        self.requests.append(message)
+        assert request.headers["Authorization"] == "Bearer test-token"
+        if token.startswith("dead"):
+            return httpx.Response(404, json={"error": {"status": "NOT_FOUND", "details": [
+                {"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError", "errorCode": "UNREGISTERED"}
+            ]}})
+        if token.startswith("flaky") and token not in self.flaked:
+            self.flaked.add(token)
+            return httpx.Response(503, headers={"Retry-After": "0"}, json={"error": {"status": "UNAVAILABLE"}})
+        return httpx.Response(200, json={"name": f"projects/rahi/messages/{len(self.requests)}"})
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = DeviceRegistry(str(tmp_path / "notifications.db"))
+    registry.register("ok-1", "user-1", "android", topics=["bookings"])
+    registry.register("dead-1", "user-1", "ios", topics=["bookings"])
+    registry.register("flaky-1", "user-2", "web")
+    return registry
+
+
+def fcm_client(fake, registry, **kwargs) -> FcmClient:
+    return FcmClient("https://fcm.test/v1/projects/rahi/messages:send", access_token="test-token",
+                     on_invalid=registry.remove, transport=httpx.MockTransport(fake), **kwargs)
+
+
+def test_send_prunes_unregistered_tokens(registry, tmp_path):
+    fake = FakeFcm()
+    client = fcm_client(fake, registry, batch_size=2)
+    tokens = registry.resolve(["user-1", "user-2"])
+
+    async def run():
+        try:
+            return await client.send_multicast(tokens, "Booking", "Worker on the way", {"id": 7}, "booking-7")
+        finally:
+            await client.close()
+
+    result = asyncio.run(run())
+    assert result["recipients"] == 3
+    assert result["delivered"] == 2  # ok-1, and flaky-1 on its retry
+    assert result["invalid_removed"] == 1
+    assert result["failed"] == 0
+
+    assert registry.resolve(["user-1"]) == ["ok-1"]
+    assert registry.resolve(topics=["bookings"]) == ["ok-1"]
+    # The removal was written through to SQLite
+    assert DeviceRegistry(str(tmp_path / "notifications.db")).resolve(["user-1"]) == ["ok-1"]
+
+    sent = fake.requests[0]
+    assert sent["data"] == {"id": "7"}
+    assert sent["android"] == {"collapse_key": "booking-7"}
+
+
+def test_nothing_delivered_raises(registry):
+    fake = FakeFcm()
+    client = fcm_client(fake, registry)
+
+    async def run():
+        try:
+            return await client.send_multicast(["dead-1"], "Booking", "Cancelled")
+        finally:
+            await client.close()
+
+    result = asyncio.run(run())
+    assert result["delivered"] == 0 and result["invalid_removed"] == 1
+
+    def always_down(request):
+        return httpx.Response(500, json={"error": {"status": "INTERNAL"}})
+
+    failing = fcm_client(always_down, registry, retries=0)
+    with pytest.raises(PushError):
+        asyncio.run(failing.send_multicast(["ok-1"], "Booking", "Cancelled"))
+
+
+def test_prune_runs_off_the_event_loop(registry):
+    threads = []
+
+    def remove(tokens):
+        threads.append(threading.get_ident())
+        return registry.remove(tokens)
+
+    client = FcmClient("https://fcm.test/v1/projects/rahi/messages:send", access_token="test-token",
+                       on_invalid=remove, transport=httpx.MockTransport(FakeFcm()))
+
+    async def run():
+        try:
+            await client.send_multicast(["ok-1", "dead-1"], "Booking", "Worker on the way")
+            return threading.get_ident()
+        finally:
+            await client.close()
+
+    loop_thread = asyncio.run(run())
+    assert threads and threads[0] != loop_thread
+    assert registry.resolve(["user-1"]) == ["ok-1"]
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+from rate_limit import TokenBucket, is_rate_limited
+
+
+class Throttled(Exception):
+    status = 429
+
+
+def test_acquire_paces_to_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+
+    async def run():
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(run())
+    # The first token is free, the next five wait 1/50 s each
+    assert 0.08 <= elapsed < 0.5
+    assert bucket.acquired == 6
+
+
+def test_throttle_halves_rate_and_pauses():
+    bucket = TokenBucket(rate=10)
+    bucket.record_throttle()
+    assert bucket.rate == 5
+    assert bucket.tokens == 0
+    assert bucket.stats()["paused_for"] > 0.9
+
+    # A second 429 from a call already in flight does not halve again
+    bucket.record_throttle()
+    assert bucket.rate == 5
+    assert bucket.throttles == 2
+
+
+def test_success_restores_rate_additively():
+    bucket = TokenBucket(rate=20)
+    bucket.record_throttle()
+    bucket.record_success()
+    assert bucket.rate == 11
+    assert bucket.backoff == 0
+    for _ in range(20):
+        bucket.record_success()
+    assert bucket.rate == 20
+
+
+def test_rate_never_drops_below_min_rate():
+    bucket = TokenBucket(rate=16, min_rate=2)
+    for _ in range(10):
+        bucket.paused_until = 0.0
+        bucket.record_throttle()
+    assert bucket.rate == 2
+    assert bucket.backoff == bucket.max_backoff
+
+
+def test_is_rate_limited():
+    assert is_rate_limited(Throttled())
+    assert not is_rate_limited(ValueError())
@@ -0,0 +1,5 @@
+"""Modules shared by the RAHI Python services (chatbot-service, core-api, notification-service).
+
+Each service puts ../shared on sys.path at startup; Docker images copy this
+directory to /shared next to the service in /app.
+"""
@@ -0,0 +1,508 @@
+import asyncio
+import json
+import os
+import time
+from typing import Annotated, List, TypedDict
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+from langchain_groq import ChatGroq
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+
+from rahi_common.conversation_store import ConversationStore
+from rahi_common.instrumentation import span
+from rahi_common.intent_router import IntentRouter
+from rahi_common.llm_router import CLOSED, ModelRouter
+from rahi_common.llm_usage import LlmUsageTracker
+from rahi_common.response_cache import ResponseCache, normalize_message
+from rahi_common.retrieval import KnowledgeIndex
+from rahi_common.single_flight import SingleFlight
+
+
+class ChatState(TypedDict):
+    messages: Annotated[List[BaseMessage], add_messages]
+    intents: List[str]
+
+
+# Try multiple GROQ models in order of preference
+MODELS_TO_TRY = [
+    "llama-3.1-70b-versatile",
+    "llama-3.1-8b-instant",
+    "llama3-groq-70b-8192-tool-use-preview",
+    "llama3-groq-8b-8192-tool-use-preview",
+    "gemma2-9b-it"
+]
+
+# The model that passed its probe is remembered in LLM_STATE_FILE so restarts skip probing
+LLM_STATE_TTL = int(os.getenv("LLM_STATE_TTL", "21600"))  # seconds
+LLM_PROBE_TIMEOUT = float(os.getenv("LLM_PROBE_TIMEOUT", "10"))
+
+# Runtime routing: the router fails over between models, so each call is not retried
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "0"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30"))
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+LLM_CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))
+
+# Local intent matcher: answers navigational questions without calling the LLM
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.75"))
+
+# Policy documents are searched per message and only the best-matching chunks are sent
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() == "true"
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "1.0"))
+
+# Conversation memory: history older than the token budget is dropped from the state
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "1500"))
+
+# Replies to repeated questions are served from memory instead of the LLM
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "true").lower() == "true"
+
+# Identical first-turn questions in flight at the same time share one model call
+CHAT_COALESCE_ENABLED = os.getenv("CHAT_COALESCE_ENABLED", "true").lower() == "true"
+
+
+class FallbackLLM:
+    """Answers from the intent router when no GROQ model is available."""
+
+    def __init__(self, intent_router: IntentRouter):
+        self.intent_router = intent_router
+
+    def invoke(self, messages):
+        # Extract the latest user message (the system prompt comes first)
+        user_message = ""
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage):
+                user_message = str(msg.content)
+                break
+
+        # Generate a helpful response based on the user's intent
+        match = self.intent_router.match(user_message)
+        if match.intent:
+            response_text = match.reply
+        else:
+            response_text = f"I understand you're asking about '{user_message}'. As RAHI Assistant, I can help you navigate our platform. Visit /services to find professionals, /tracking to monitor bookings, or /login to manage your account. How else can I assist? 🤝"
+
+        # Return a real message so the graph state (and streaming) accept it
+        return AIMessage(content=response_text, response_metadata={"fallback": True})
+
+    async def ainvoke(self, messages):
+        return self.invoke(messages)
+
+
+def create_groq_llm(model_name: str, groq_api_key: str, max_retries: int = LLM_MAX_RETRIES):
+    return ChatGroq(
+        model=model_name,
+        temperature=0.7,
+        groq_api_key=groq_api_key,
+        max_retries=max_retries
+    )
+
+
+def load_cached_model(state_file: str):
+    """Return the last known-good model name if the state file is still fresh."""
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    model_name = state.get("model")
+    if model_name not in MODELS_TO_TRY:
+        return None
+    if time.time() - state.get("selected_at", 0) > LLM_STATE_TTL:
+        return None
+    return model_name
+
+
+def save_cached_model(state_file: str, model_name: str):
+    try:
+        tmp_path = state_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": model_name, "selected_at": time.time()}, f)
+        os.replace(tmp_path, state_file)
+    except OSError as e:
+        print(f"Could not save LLM state to {state_file}: {str(e)}")
+
+
+def content_to_text(content) -> str:
+    """Flatten message content to a plain string."""
+    if isinstance(content, list):
+        # Handle possible list-format content in some LLM types
+        return " ".join([part.get('text', '') if isinstance(part, dict) else str(part) for part in content])
+    return str(content)
+
+
+def trim_history(messages: list) -> list:
+    """Keep the most recent turns that fit the conversation token budget."""
+    trimmed = trim_messages(
+        messages,
+        max_tokens=CONVERSATION_TOKEN_BUDGET,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on="human",
+    )
+    # The current question is always sent, even if it alone exceeds the budget
+    return trimmed or messages[-1:]
+
+
+def conversation_config(conversation_id: str) -> dict:
+    return {"configurable": {"thread_id": conversation_id}}
+
+
+class ChatTurnFailed(Exception):
+    """A turn that produced an error reply; coalesced callers retry instead of sharing it."""
+
+    def __init__(self, reply: str):
+        super().__init__(reply)
+        self.reply = reply
+
+
+class ChatService:
+    """The RAHI assistant: model routing, the LangGraph chat graph, and everything around it.
+
+    chatbot-service and core-api differ only in their system prompt, so each
+    builds one of these from its own `PromptBuilder` and file locations. The
+    LLM is selected lazily (on the first request, or by `warm_up_llm` at
+    startup); high-confidence navigational questions are answered by the intent
+    router without a model call; repeated first-turn questions are served from
+    the reply cache, and identical ones in flight share a single call.
+    """
+
+    def __init__(self, prompt_builder, service_dir: str, knowledge_file: str):
+        self.prompt_builder = prompt_builder
+        self.llm_state_file = os.getenv("LLM_STATE_FILE", os.path.join(service_dir, ".llm_state.json"))
+
+        # Token and latency accounting for every call; the last LLM_USAGE_BUFFER calls are kept for /debug/llm
+        self.llm_usage = LlmUsageTracker(capacity=int(os.getenv("LLM_USAGE_BUFFER", "500")))
+        self.intent_router = IntentRouter()
+
+        self.llm = None
+        self.llm_status = {"ready": False, "model": None, "source": None, "error": None}
+        self._llm_lock = asyncio.Lock()
+
+        self.knowledge_index = KnowledgeIndex(
+            os.path.normpath(knowledge_file),
+            os.getenv("KNOWLEDGE_INDEX_DIR", os.path.join(service_dir, "knowledge_index")),
+            chunk_words=int(os.getenv("RETRIEVAL_CHUNK_WORDS", "120")),
+            retry_interval=float(os.getenv("RETRIEVAL_RETRY_SECONDS", "30")),
+            refresh_interval=float(os.getenv("RETRIEVAL_REFRESH_SECONDS", "30"))
+        )
+        self._index_check = None
+
+        graph = StateGraph(ChatState)
+        graph.add_node("intent", self.intent_node)
+        graph.add_node("chat", self.chat_node)
+        graph.add_edge(START, "intent")
+        graph.add_conditional_edges("intent", self.route_after_intent, {"chat": "chat", END: END})
+        graph.add_edge("chat", END)
+        self.chatbot = graph.compile()
+
+        # Multi-turn conversations keep their state in the checkpointer, keyed by conversation_id
+        self.conversation_store = ConversationStore(
+            os.getenv("CONVERSATION_DB", os.path.join(service_dir, "conversations.db")),
+            max_hot=int(os.getenv("CONVERSATION_HOT_LIMIT", "1000")),
+            idle_seconds=float(os.getenv("CONVERSATION_IDLE_SECONDS", "600")),
+            ttl=float(os.getenv("CONVERSATION_TTL", str(7 * 24 * 3600)))
+        )
+        self.conversational_chatbot = graph.compile(checkpointer=self.conversation_store)
+
+        self.response_cache = ResponseCache(
+            max_entries=int(os.getenv("CHAT_CACHE_SIZE", "512")),
+            ttl=float(os.getenv("CHAT_CACHE_TTL", "3600")),
+            similarity_threshold=float(os.getenv("CHAT_CACHE_SIMILARITY", "0.8"))
+        )
+        self.single_flight = SingleFlight(wait_timeout=float(os.getenv("CHAT_COALESCE_WAIT", "15")))
+
+    # LLM selection
+
+    async def initialize_llm(self):
+        groq_api_key = os.getenv("GROQ_API_KEY")
+
+        if not groq_api_key:
+            raise ValueError("GROQ_API_KEY environment variable not set properly")
+
+        # Route over every model at runtime; selection only decides which one goes first
+        router = ModelRouter(
+            [(model_name, create_groq_llm(model_name, groq_api_key)) for model_name in MODELS_TO_TRY],
+            FallbackLLM(self.intent_router),
+            call_timeout=LLM_CALL_TIMEOUT,
+            usage=self.llm_usage,
+            failure_threshold=LLM_CIRCUIT_FAILURES,
+            cooldown=LLM_CIRCUIT_COOLDOWN
+        )
+
+        # A recent successful probe is trusted as-is
+        cached_model = load_cached_model(self.llm_state_file)
+        if cached_model:
+            print(f"Using cached GROQ model selection: {cached_model}")
+            router.get(cached_model).priority = -1
+            self.llm_status.update(model=cached_model, source="cache")
+            return router
+
+        for model_name in MODELS_TO_TRY:
+            health = router.get(model_name)
+            try:
+                # Test the model with a single, non-retried call to verify it works
+                probe = create_groq_llm(model_name, groq_api_key, max_retries=0)
+                started = time.perf_counter()
+                await asyncio.wait_for(probe.ainvoke([HumanMessage(content="Test")]), timeout=LLM_PROBE_TIMEOUT)
+                health.record_success(time.perf_counter() - started)
+                print(f"Successfully initialized with GROQ model: {model_name}")
+                save_cached_model(self.llm_state_file, model_name)
+                self.llm_status.update(model=model_name, source="probe")
+                return router
+            except Exception as e:
+                print(f"GROQ Model {model_name} not available or failed: {str(e)}")
+                health.record_failure(e)
+                health.trip()
+                continue
+
+        # No GROQ model answered: the router serves FallbackLLM until a circuit recovers
+        print("No GROQ models available. Creating fallback response handler.")
+        self.llm_status.update(model=None, source="fallback")
+        return router
+
+    async def get_llm(self):
+        if self.llm is None:
+            async with self._llm_lock:
+                if self.llm is None:
+                    self.llm = await self.initialize_llm()
+                    self.llm_status.update(ready=True, error=None)
+        return self.llm
+
+    def llm_ready(self) -> bool:
+        """True once a Groq model is known to work; serving only FallbackLLM is not ready."""
+        if not self.llm_status["ready"]:
+            return False
+        if self.llm_status["model"] is None and isinstance(self.llm, ModelRouter):
+            # Started on the fallback: ready as soon as a model has answered since
+            working = next((h for h in self.llm.models if h.state == CLOSED and h.ewma_latency is not None), None)
+            if working:
+                self.llm_status.update(model=working.name, source="recovered")
+        return self.llm_status["model"] is not None
+
+    def model_router_state(self) -> dict:
+        """Per-model routing state for the debug endpoint."""
+        if isinstance(self.llm, ModelRouter):
+            return self.llm.snapshot()
+        return {"models": [], "preferred": None, "fallback_calls": 0}
+
+    async def warm_up_llm(self):
+        """Select the model and load the knowledge index in the background so the first chat does not pay for it."""
+        try:
+            await self.get_llm()
+        except Exception as e:
+            self.llm_status["error"] = str(e)
+            print(f"LLM warm-up failed: {str(e)}")
+        if RETRIEVAL_ENABLED:
+            # Maps the knowledge index (building it if the knowledge file changed) off the event loop
+            await asyncio.to_thread(self.knowledge_index.ensure_loaded)
+
+    # Graph
+
+    def knowledge_excerpts(self, message: str) -> str:
+        """Top-k document chunks for the message, formatted for the system prompt."""
+        if not RETRIEVAL_ENABLED:
+            return ""
+        index = self.knowledge_index
+        # The index is loaded by warm_up_llm; until then chats go out without excerpts.
+        # A failed load is retried, and a loaded index checked for changed knowledge
+        # files, in the background once the interval has passed.
+        if (index.retry_due or index.refresh_due) and (self._index_check is None or self._index_check.done()):
+            self._index_check = asyncio.create_task(asyncio.to_thread(index.ensure_loaded))
+        if not index.ready:
+            return ""
+        results = index.search(message, RETRIEVAL_TOP_K, RETRIEVAL_MIN_SCORE)
+        if not results:
+            return ""
+        lines = ["Relevant excerpts from RAHI documents (use them only if they answer the question):"]
+        lines += [f"[{i}] ({result['source']}) {result['text']}" for i, result in enumerate(results, 1)]
+        return "\n".join(lines)
+
+    async def intent_node(self, state: ChatState):
+        """High-confidence navigational questions are answered locally."""
+        message = content_to_text(state["messages"][-1].content)
+        match = self.intent_router.match(message)
+        if INTENT_ROUTER_ENABLED and match.intent and match.confidence >= INTENT_CONFIDENCE_THRESHOLD:
+            reply = AIMessage(content=match.reply, response_metadata={"intent": match.intent, "confidence": match.confidence})
+            return {"messages": [reply], "intents": list(match.intents)}
+        return {"intents": list(match.intents)}
+
+    @staticmethod
+    def route_after_intent(state: ChatState) -> str:
+        return END if isinstance(state["messages"][-1], AIMessage) else "chat"
+
+    async def chat_node(self, state: ChatState):
+        history = trim_history(state["messages"])
+        kept_ids = {message.id for message in history}
+        dropped = [RemoveMessage(id=message.id) for message in state["messages"] if message.id not in kept_ids]
+
+        # The system prompt is added per call and never stored in the conversation
+        message_text = content_to_text(history[-1].content)
+        system_prompt, report = self.prompt_builder.build(message_text, state.get("intents", ()))
+        # Retrieved excerpts go after the static prompt so its prefix stays identical between calls
+        excerpts = self.knowledge_excerpts(message_text)
+        if excerpts:
+            system_prompt = f"{system_prompt}\n\n{excerpts}"
+        messages = [SystemMessage(content=system_prompt)] + history
+
+        try:
+            model = await self.get_llm()
+            # The router records every attempt (model, latency, tokens, outcome) in llm_usage
+            async with span("llm.invoke"):
+                response = await model.ainvoke(messages, sections=report["sections"])
+            return {"messages": dropped + [response]}
+        except Exception as e:
+            # Return a helpful error message
+            error_message = AIMessage(
+                content=f"I'm having trouble processing your request right now. Please try again later. Error: {str(e)}",
+                response_metadata={"error": True}
+            )
+            return {"messages": dropped + [error_message]}
+
+    # API
+
+    async def answer_stateless(self, user_input: str, use_cache: bool) -> str:
+        """Run one turn without conversation history and cache a real answer."""
+        async with span("chatbot.invoke"):
+            result = await self.chatbot.ainvoke({"messages": [HumanMessage(content=user_input)]})
+        reply_message = result["messages"][-1]
+        reply = content_to_text(reply_message.content)
+        # Fallback and error replies are not cached so real answers return once models recover
+        metadata = reply_message.response_metadata or {}
+        if metadata.get("error"):
+            raise ChatTurnFailed(reply)
+        if use_cache and not metadata.get("fallback"):
+            self.response_cache.put(user_input, reply)
+        return reply
+
+    async def remember_exchange(self, conversation_id: str, user_input: str, reply: str):
+        """Record a turn answered outside the graph (e.g. from cache) in the conversation."""
+        await self.conversational_chatbot.aupdate_state(
+            conversation_config(conversation_id),
+            {"messages": [HumanMessage(content=user_input), AIMessage(content=reply)]},
+            as_node="chat"
+        )
+
+    async def ask_chatbot(self, user_input: str, context: dict = None, conversation_id: str = None) -> str:
+        """Answer one message. Pass context={"cache": False} to bypass the reply cache.
+
+        With a conversation_id the turn is stored and later turns see the history.
+        Only the first turn of a conversation can be answered from the cache, and
+        concurrent identical first turns share a single model call.
+        """
+        resuming = conversation_id is not None and await self.conversation_store.ahas_thread(conversation_id)
+        use_cache = CHAT_CACHE_ENABLED and (context or {}).get("cache", True) and not resuming
+        if use_cache:
+            cached_reply = self.response_cache.get(user_input)
+            if cached_reply is not None:
+                if conversation_id:
+                    await self.remember_exchange(conversation_id, user_input, cached_reply)
+                return cached_reply
+
+        try:
+            if not resuming:
+                # No history yet, so the answer depends only on the message
+                if CHAT_COALESCE_ENABLED:
+                    key = normalize_message(user_input) or user_input
+                    reply = await self.single_flight.run(key, lambda: self.answer_stateless(user_input, use_cache))
+                else:
+                    reply = await self.answer_stateless(user_input, use_cache)
+                if conversation_id:
+                    await self.remember_exchange(conversation_id, user_input, reply)
+                return reply
+
+            initial_state = {
+                "messages": [HumanMessage(content=user_input)]
+            }
+            async with span("chatbot.invoke"):
+                result = await self.conversational_chatbot.ainvoke(initial_state, conversation_config(conversation_id))
+            # Ensure we return a string
+            return content_to_text(result["messages"][-1].content)
+        except ChatTurnFailed as e:
+            return e.reply
+        except Exception as e:
+            return f"I'm having trouble processing your request: {str(e)}. You can try navigating to /services for bookings."
+
+    async def ask_chatbot_batch(self, user_inputs: list, context: dict = None, max_concurrency: int = 16) -> list:
+        """Answer many independent messages concurrently.
+
+        Returns one (reply, error) pair per input, in order; a failing item only
+        sets its own error. Cache hits are answered up front and the rest go
+        through the graph's abatch with at most `max_concurrency` running at once.
+        """
+        use_cache = CHAT_CACHE_ENABLED and (context or {}).get("cache", True)
+        results = [None] * len(user_inputs)
+        pending = []
+        for index, user_input in enumerate(user_inputs):
+            cached_reply = self.response_cache.get(user_input) if use_cache else None
+            if cached_reply is not None:
+                results[index] = (cached_reply, None)
+            else:
+                pending.append(index)
+
+        states = [{"messages": [HumanMessage(content=user_inputs[index])]} for index in pending]
+        async with span("chatbot.batch"):
+            outputs = await self.chatbot.abatch(states, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+
+        for index, output in zip(pending, outputs):
+            if isinstance(output, Exception):
+                results[index] = (None, str(output))
+                continue
+            reply_message = output["messages"][-1]
+            reply = content_to_text(reply_message.content)
+            metadata = reply_message.response_metadata or {}
+            if metadata.get("error"):
+                results[index] = (None, reply)
+                continue
+            if use_cache and not metadata.get("fallback"):
+                self.response_cache.put(user_inputs[index], reply)
+            results[index] = (reply, None)
+        return results
+
+    async def stream_chatbot(self, user_input: str, conversation_id: str = None):
+        """Yield reply text chunks as the model produces them.
+
+        Tokens come from the graph's "messages" stream. Models that do not stream
+        (e.g. FallbackLLM) produce no chunks, so their final reply is yielded as a
+        single chunk from the "values" stream instead.
+        """
+        initial_state = {
+            "messages": [HumanMessage(content=user_input)]
+        }
+        if conversation_id:
+            graph_run = self.conversational_chatbot.astream(initial_state, conversation_config(conversation_id), stream_mode=["messages", "values"])
+        else:
+            graph_run = self.chatbot.astream(initial_state, stream_mode=["messages", "values"])
+
+        streamed = False
+        final_state = None
+        stream_usage = None
+        try:
+            async with span("chatbot.stream"):
+                with self.llm_usage.collect() as calls:
+                    async for mode, payload in graph_run:
+                        if mode == "messages":
+                            chunk, _metadata = payload
+                            if not isinstance(chunk, AIMessage):
+                                continue
+                            # A streamed call reports its token usage in its last chunk
+                            stream_usage = chunk.usage_metadata or stream_usage
+                            text = content_to_text(chunk.content)
+                            if text:
+                                streamed = True
+                                yield text
+                        else:
+                            final_state = payload
+
+                successful = [call for call in calls if call["outcome"] == "ok"]
+                if stream_usage and successful:
+                    self.llm_usage.set_tokens(successful[-1], int(stream_usage.get("input_tokens") or 0),
+                                              int(stream_usage.get("output_tokens") or 0))
+
+            if not streamed and final_state:
+                yield content_to_text(final_state["messages"][-1].content)
+        except Exception as e:
+            yield f"I'm having trouble processing your request: {str(e)}. You can try navigating to /services for bookings."
@@ -0,0 +1,83 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from starlette.responses import StreamingResponse
+
+
+class CapacityExceeded(Exception):
+    """Raised when no in-flight slot frees up within the queue timeout."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Too many requests in flight")
+        self.retry_after = retry_after
+
+
+class InFlightLimiter:
+    """Caps the number of concurrent requests handled by a worker.
+
+    Requests wait at most `queue_timeout` seconds for a free slot and are then
+    rejected with `CapacityExceeded`, so callers can answer 503 + Retry-After
+    instead of piling up behind a slow model.
+    """
+
+    def __init__(self, limit: int, queue_timeout: float = 0.0, retry_after: int = 1):
+        self.limit = max(1, limit)
+        self.queue_timeout = max(0.0, queue_timeout)
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        """Take a slot, waiting up to `queue_timeout`. Pair with `release()`."""
+        if self._semaphore.locked() and self.queue_timeout == 0:
+            self.rejected += 1
+            raise CapacityExceeded(self.retry_after)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout or None)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise CapacityExceeded(self.retry_after)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "rejected": self.rejected}
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """StreamingResponse that gives back an in-flight slot once the response is over.
+
+    The endpoint takes the slot before returning, so a full limiter can still
+    answer 503. The slot is released when the ASGI call ends for any reason:
+    body finished, client gone before or during the body, or a send error. A
+    `finally` in the body generator is not enough, because a generator that
+    never starts never runs it.
+    """
+
+    def __init__(self, content, limiter: InFlightLimiter, **kwargs):
+        super().__init__(content, **kwargs)
+        self.limiter = limiter
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.limiter.release()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
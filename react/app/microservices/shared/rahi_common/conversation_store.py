@@ -0,0 +1,218 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple, get_checkpoint_metadata
+
+
+class ConversationStore(BaseCheckpointSaver):
+    """LangGraph checkpointer with a hot in-memory LRU and a SQLite spill.
+
+    Only the latest checkpoint of each conversation is kept, which is all a chat
+    needs to resume. Conversations idle for `idle_seconds` (or pushed out of the
+    LRU by `max_hot`) are serialized into a WAL-mode SQLite table and promoted
+    back on their next turn; the row stays until the session is spilled again
+    (overwriting it) or expires, so a restart loses at most the turns since.
+    Spilled conversations expire after `ttl` seconds. The async methods used by
+    the graph run the SQLite work in a thread so disk I/O never blocks the loop.
+    """
+
+    def __init__(self, db_path: str, max_hot: int = 1000, idle_seconds: float = 600.0,
+                 ttl: float = 7 * 24 * 3600.0, serde=None):
+        super().__init__(serde=serde)
+        self.max_hot = max_hot
+        self.idle_seconds = idle_seconds
+        self.ttl = ttl
+
+        self._hot = OrderedDict()  # (thread_id, checkpoint_ns) -> entry dict
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS conversations (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_type TEXT NOT NULL,
+                checkpoint BLOB NOT NULL,
+                metadata_type TEXT NOT NULL,
+                metadata BLOB NOT NULL,
+                parent_id TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)")
+        self.spills = 0
+        self.promotions = 0
+
+    # -- tiers -----------------------------------------------------------
+
+    def _spill(self, key):
+        entry = self._hot.pop(key)
+        checkpoint_type, checkpoint = self.serde.dumps_typed(entry["checkpoint"])
+        metadata_type, metadata = self.serde.dumps_typed(entry["metadata"])
+        self._conn.execute(
+            "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key[0], key[1], checkpoint_type, checkpoint, metadata_type, metadata, entry["parent_id"], entry["touched_at"]),
+        )
+        self.spills += 1
+        if self.spills % 100 == 0:
+            self.purge_expired()
+
+    def _promote(self, key):
+        row = self._conn.execute(
+            "SELECT checkpoint_type, checkpoint, metadata_type, metadata, parent_id, updated_at "
+            "FROM conversations WHERE thread_id = ? AND checkpoint_ns = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[5] > self.ttl:
+            self._conn.execute("DELETE FROM conversations WHERE thread_id = ? AND checkpoint_ns = ?", key)
+            return None
+        entry = {
+            "checkpoint": self.serde.loads_typed((row[0], row[1])),
+            "metadata": self.serde.loads_typed((row[2], row[3])),
+            "parent_id": row[4],
+            "writes": [],
+            "touched_at": time.time(),
+        }
+        self._hot[key] = entry
+        self.promotions += 1
+        return entry
+
+    def _entry(self, key):
+        entry = self._hot.get(key)
+        if entry is None:
+            entry = self._promote(key)
+        if entry is not None:
+            self._hot.move_to_end(key)
+        return entry
+
+    def _evict(self):
+        """Spill idle conversations and anything beyond the hot LRU limit."""
+        now = time.time()
+        while self._hot:
+            key, entry = next(iter(self._hot.items()))
+            if len(self._hot) <= self.max_hot and now - entry["touched_at"] < self.idle_seconds:
+                break
+            self._spill(key)
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM conversations WHERE updated_at < ?", (time.time() - self.ttl,))
+            return cursor.rowcount
+
+    def has_thread(self, thread_id: str) -> bool:
+        with self._lock:
+            if (thread_id, "") in self._hot:
+                return True
+            row = self._conn.execute(
+                "SELECT 1 FROM conversations WHERE thread_id = ? AND updated_at >= ?",
+                (thread_id, time.time() - self.ttl),
+            ).fetchone()
+            return row is not None
+
+    async def ahas_thread(self, thread_id: str) -> bool:
+        return await asyncio.to_thread(self.has_thread, thread_id)
+
+    def stats(self) -> dict:
+        """`spilled` counts conversations with a row on disk, including promoted ones."""
+        with self._lock:
+            spilled = self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+            return {"hot": len(self._hot), "spilled": spilled, "spills": self.spills, "promotions": self.promotions}
+
+    # -- BaseCheckpointSaver ---------------------------------------------
+
+    @staticmethod
+    def _key(config) -> tuple:
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+    def _tuple(self, key, entry) -> CheckpointTuple:
+        checkpoint = entry["checkpoint"]
+        parent_config = None
+        if entry["parent_id"]:
+            parent_config = {"configurable": {"thread_id": key[0], "checkpoint_ns": key[1], "checkpoint_id": entry["parent_id"]}}
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": key[0], "checkpoint_ns": key[1], "checkpoint_id": checkpoint["id"]}},
+            checkpoint=checkpoint,
+            metadata=entry["metadata"],
+            parent_config=parent_config,
+            pending_writes=list(entry["writes"]),
+        )
+
+    def get_tuple(self, config):
+        key = self._key(config)
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return None
+            checkpoint_id = config["configurable"].get("checkpoint_id")
+            if checkpoint_id and checkpoint_id != entry["checkpoint"]["id"]:
+                return None  # only the latest checkpoint is retained
+            return self._tuple(key, entry)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        if config is None:
+            return
+        checkpoint_tuple = self.get_tuple(config)
+        if checkpoint_tuple is not None:
+            yield checkpoint_tuple
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        key = self._key(config)
+        with self._lock:
+            previous = self._entry(key)
+            checkpoint = dict(checkpoint)
+            # Channels that did not change keep their previous values
+            values = dict(previous["checkpoint"]["channel_values"]) if previous else {}
+            values.update(checkpoint.get("channel_values", {}))
+            checkpoint["channel_values"] = {k: v for k, v in values.items() if k in checkpoint["channel_versions"]}
+
+            self._hot[key] = {
+                "checkpoint": checkpoint,
+                "metadata": get_checkpoint_metadata(config, metadata),
+                "parent_id": config["configurable"].get("checkpoint_id"),
+                "writes": [],
+                "touched_at": time.time(),
+            }
+            self._hot.move_to_end(key)
+            self._evict()
+        return {"configurable": {"thread_id": key[0], "checkpoint_ns": key[1], "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        key = self._key(config)
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None or entry["checkpoint"]["id"] != config["configurable"].get("checkpoint_id"):
+                return
+            entry["writes"].extend((task_id, channel, value) for channel, value in writes)
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            for key in [key for key in self._hot if key[0] == thread_id]:
+                del self._hot[key]
+            self._conn.execute("DELETE FROM conversations WHERE thread_id = ?", (thread_id,))
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        if config is None:
+            return
+        checkpoint_tuple = await self.aget_tuple(config)
+        if checkpoint_tuple is not None:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        await asyncio.to_thread(self.delete_thread, thread_id)
@@ -0,0 +1,248 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+
+# Everything below is skipped (no middleware, no-op spans) when this is false
+INSTRUMENTATION_ENABLED = os.getenv("INSTRUMENTATION_ENABLED", "true").lower() == "true"
+
+# Seconds; covers fast routes through slow LLM calls
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+
+def current_request_id():
+    """The X-Request-ID of the request being handled, or None outside a request."""
+    return request_id_var.get()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Registry:
+    """Thread-safe counters, gauges and histograms rendered in the Prometheus text format.
+
+    Metrics are created on first use; `describe` adds HELP text. Label sets are
+    kept as sorted tuples, so callers pass labels as keyword arguments.
+    Collectors registered with `add_collector` return extra exposition lines
+    at render time for state that lives elsewhere.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}
+        self._help = {}
+        self._values = {}  # (name, labels) -> float
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._collectors = []
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._types[name] = kind
+        self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types.setdefault(name, "counter")
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types.setdefault(name, "gauge")
+            self._values[key] = value
+
+    def add(self, name: str, amount: float, **labels):
+        """Move a gauge up or down (e.g. requests in flight)."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types.setdefault(name, "gauge")
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = len(DURATION_BUCKETS)
+        for position, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            self._types.setdefault(name, "histogram")
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0, 0]
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+        lines = []
+        names = sorted({name for name, _ in values} | {name for name, _ in histograms})
+        for name in names:
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {self._types[name]}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(dict(labels))} {value:g}")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS + ("+Inf",), histogram):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_labels({**dict(labels), 'le': le})} {cumulative}")
+                lines.append(f"{name}_sum{_labels(dict(labels))} {histogram[-2]:.6f}")
+                lines.append(f"{name}_count{_labels(dict(labels))} {histogram[-1]}")
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Registry()
+metrics.describe("http_requests_total", "counter", "HTTP requests by route and status code.")
+metrics.describe("http_request_duration_seconds", "histogram", "HTTP request latency by route, until the body is sent.")
+metrics.describe("http_requests_in_flight", "gauge", "HTTP requests being handled.")
+metrics.describe("span_duration_seconds", "histogram", "Duration of instrumented calls (LLM, graph, providers).")
+
+
+class _Span:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = "ok" if exc_type is None else "error"
+        metrics.observe("span_duration_seconds", time.perf_counter() - self.started,
+                        span=self.name, outcome=outcome, **self.labels)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **labels):
+    """Time a block as `span_duration_seconds{span=name}`; usable with `with` and `async with`."""
+    if not INSTRUMENTATION_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name, labels)
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware: request IDs, per-route latency, status counters and an in-flight gauge.
+
+    The request ID comes from the X-Request-ID header (set by nginx) or is
+    generated, is available to handlers via `current_request_id()`, and is
+    echoed on the response. Routes are labelled by their path template
+    ("/notifications/{notification_id}"), so IDs in URLs do not create new
+    series; requests that match no route share the label "unmatched".
+    Written against raw ASGI so streaming responses pass through untouched.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+        self._paths = None
+
+    def _route_path(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None and getattr(route, "path", None):
+            return route.path
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._paths is None:
+            # Older Starlette only leaves the endpoint in the scope; map it back to its path
+            router = scope.get("app") or scope.get("router")
+            self._paths = {getattr(r, "endpoint", None): r.path for r in getattr(router, "routes", [])}
+        return self._paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope.get("headers", ()):
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = [500]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]}
+            await send(message)
+
+        started = time.perf_counter()
+        metrics.add("http_requests_in_flight", 1, service=self.service)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.add("http_requests_in_flight", -1, service=self.service)
+            route = self._route_path(scope)
+            method = scope.get("method", "")
+            metrics.observe("http_request_duration_seconds", elapsed, service=self.service, method=method, route=route)
+            metrics.inc("http_requests_total", service=self.service, method=method, route=route, status=str(status[0]))
+            request_id_var.reset(token)
+
+
+def instrument(app, service: str):
+    """Mount the middleware and GET /metrics on a FastAPI app (no-op when disabled)."""
+    if not INSTRUMENTATION_ENABLED:
+        return
+    from fastapi.responses import PlainTextResponse
+
+    app.add_middleware(InstrumentationMiddleware, service=service)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,224 @@
+from collections import deque
+from functools import lru_cache
+
+from rahi_common.response_cache import FILLER_WORDS, normalize_message
+
+# Extra Hinglish words that carry no intent of their own
+INTENT_FILLER_WORDS = FILLER_WORDS | frozenset([
+    "mujhe", "ek", "aap", "aapka", "mera", "meri", "mere", "my", "for", "to", "want", "need",
+    "chahiye", "karna", "karo", "kar", "ho", "how", "what", "where", "kya", "kaise", "kahan",
+    "kab", "main", "hum", "get", "help", "with", "some", "someone", "any", "in", "of", "and", "now",
+    "take", "much", "is", "your", "its", "am", "at", "on", "मुझे", "चाहिए", "है",
+])
+
+# Tokens shorter than this are never fuzzy-corrected: short words sit one edit
+# away from too many keywords ("here" -> "hire", "older" -> "order")
+MIN_FUZZY_LENGTH = 6
+
+# Real words one or two edits from a keyword; they are left as typed
+COMMON_WORDS = frozenset([
+    "change", "changes", "changed", "charger", "chargers", "charles", "states", "stated", "statue",
+    "statues", "prince", "princes", "printer", "printers", "pointer", "painted", "worked", "electrical",
+    "electricity", "mechanical", "mechanism", "commissioner", "compassion", "clearing", "clearer",
+    "cleansing", "mourning", "moaning", "tracing", "trucking", "booming", "booing", "cooking", "looking",
+    "hooking", "border", "borders", "profession", "professions",
+])
+
+# Confidence cap for a match that only holds because a token was corrected,
+# kept below the default local-answer threshold so the model answers instead
+CORRECTED_CONFIDENCE = 0.5
+
+# intent -> phrases (already in normalized form); multi-word phrases are matched as a unit
+INTENT_KEYWORDS = {
+    "greeting": [
+        "hello", "hi", "hey", "namaste", "namaskar", "good morning", "good evening", "hii", "helo",
+        "नमस्ते", "नमस्कार",
+    ],
+    "find_worker": [
+        "plumber", "electrician", "carpenter", "painter", "mistri", "bijli", "mechanic",
+        "ac repair", "cleaner", "cleaning", "maid",
+        # On their own, "worker" and "professional" are as likely to come from workers
+        # asking about onboarding or payouts, so they only count as part of a request
+        "find worker", "find workers", "find a worker", "need worker", "need a worker", "worker chahiye",
+        "find professional", "find a professional", "need professional", "need a professional",
+        "प्लंबर", "बिजली", "इलेक्ट्रीशियन", "बढ़ई", "मिस्त्री",
+    ],
+    "book": [
+        "book", "booking", "hire", "appointment", "schedule", "bulao", "bulana", "बुक", "बुकिंग",
+    ],
+    "track": [
+        "track", "tracking", "status", "where is my", "kab aayega", "order status", "booking status",
+    ],
+    "payment": [
+        "payment", "pay", "commission", "payout", "payouts", "fee", "fees", "charges", "bhugtan",
+        "booking refund", "payment refund", "price", "pricing", "cost", "charge", "how much", "kitna", "lagega", "पेमेंट",
+    ],
+}
+
+# When both intents match, the first one wins outright (e.g. "track my booking")
+SUPPRESSES = {
+    "track": {"book", "greeting"},
+    "find_worker": {"book", "greeting"},
+    "book": {"greeting"},
+    "payment": {"book", "greeting"},
+}
+
+TRADES = {
+    "plumber": "plumber", "electrician": "electrician", "bijli": "electrician", "carpenter": "carpenter",
+    "प्लंबर": "plumber", "बिजली": "electrician", "इलेक्ट्रीशियन": "electrician", "बढ़ई": "carpenter",
+    "painter": "painter", "mechanic": "mechanic", "ac repair": "AC repair professional",
+    "cleaner": "cleaner", "cleaning": "cleaner", "maid": "cleaner",
+}
+
+REPLIES = {
+    "greeting": "Hello! I'm the RAHI Assistant. How can I help you find services or navigate our platform today? 🇮🇳",
+    "find_worker": "I can help you find a {trade}! Please visit our Services page (/services) to browse professionals in your area. RAHI connects you with trusted local workers. 🛠️",
+    "book": "To book a service, please visit our Services page (/services) where you can find and hire skilled professionals like electricians, plumbers, and carpenters. Easy booking with fair prices! 💼",
+    "track": "You can track your bookings and check status on the Tracking page (/tracking). Enter your booking ID to see real-time updates! 📍",
+    "payment": "RAHI ensures fair payments with transparent pricing. Workers receive same-day payouts with our low 8-12% commission. Payments are secure and timely! 💰",
+}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up early once it exceeds `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class IntentMatch:
+    def __init__(self, intent=None, confidence=0.0, intents=(), trade=None, corrected=False):
+        self.intent = intent
+        self.confidence = confidence
+        self.intents = tuple(intents)
+        self.trade = trade
+        self.corrected = corrected
+
+    @property
+    def reply(self):
+        if self.intent is None:
+            return None
+        return REPLIES[self.intent].format(trade=self.trade or "professional")
+
+
+class IntentRouter:
+    """Keyword intent matcher compiled into a token-level Aho-Corasick automaton.
+
+    Messages are normalized, long unknown tokens are corrected to the nearest
+    keyword token with the same first letter within a small edit distance
+    ("plumbar" -> "plumber"), and a single pass over the tokens finds every
+    keyword phrase. Confidence is the share of the message's content words
+    explained by keywords, halved when two intents that do not suppress each
+    other both match, and capped at `CORRECTED_CONFIDENCE` when a corrected
+    token was needed.
+    """
+
+    def __init__(self, intent_keywords=INTENT_KEYWORDS, suppresses=SUPPRESSES):
+        self.suppresses = suppresses
+        self.token_ids = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]  # state -> [(intent, phrase, phrase_length)]
+
+        for intent, phrases in intent_keywords.items():
+            for phrase in phrases:
+                self._add(intent, normalize_message(phrase))
+        self._build_failure_links()
+
+        # Fuzzy matching candidates bucketed by length
+        self._vocab_by_length = {}
+        for token in self.token_ids:
+            if len(token) >= MIN_FUZZY_LENGTH - 1:
+                self._vocab_by_length.setdefault(len(token), []).append(token)
+        self._correct = lru_cache(maxsize=4096)(self._nearest_token)
+
+    def _add(self, intent, phrase):
+        state = 0
+        tokens = phrase.split()
+        for token in tokens:
+            token_id = self.token_ids.setdefault(token, len(self.token_ids))
+            if token_id not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][token_id] = len(self._goto) - 1
+            state = self._goto[state][token_id]
+        self._output[state].append((intent, phrase, len(tokens)))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token_id, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and token_id not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(token_id, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def _nearest_token(self, token):
+        if (token in self.token_ids or len(token) < MIN_FUZZY_LENGTH
+                or token in INTENT_FILLER_WORDS or token in COMMON_WORDS):
+            return token
+        limit = 1 if len(token) < 9 else 2
+        best, best_distance = token, limit + 1
+        for length in range(len(token) - limit, len(token) + limit + 1):
+            for candidate in self._vocab_by_length.get(length, ()):
+                if candidate[0] != token[0]:
+                    continue
+                distance = edit_distance(token, candidate, limit)
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return best
+
+    def match(self, message: str) -> IntentMatch:
+        typed = normalize_message(message).split()
+        tokens = [self._correct(token) for token in typed]
+        content_words = [token for token in tokens if token not in INTENT_FILLER_WORDS]
+        if not tokens:
+            return IntentMatch()
+
+        covered = {}  # intent -> set of token positions
+        trade = None
+        state = 0
+        for position, token in enumerate(tokens):
+            token_id = self.token_ids.get(token)
+            while state and token_id not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token_id, 0)
+            for intent, phrase, length in self._output[state]:
+                covered.setdefault(intent, set()).update(range(position - length + 1, position + 1))
+                if intent == "find_worker" and phrase in TRADES:
+                    trade = TRADES[phrase]
+
+        if not covered:
+            return IntentMatch()
+
+        intents = set(covered)
+        for intent in list(intents):
+            intents -= self.suppresses.get(intent, set()) - {intent}
+        ranked = sorted(intents, key=lambda intent: len(covered[intent]), reverse=True)
+        winner = ranked[0]
+
+        # Share of content words explained by any matched intent, halved if intents conflict
+        explained = {tokens[i] for intent in covered for i in covered[intent]}
+        total = max(1, len(content_words))
+        confidence = min(1.0, sum(1 for word in content_words if word in explained) / total)
+        if not content_words:
+            confidence = 1.0
+        if len(ranked) > 1:
+            confidence *= 0.5
+        corrected = any(tokens[i] != typed[i] for intent in covered for i in covered[intent])
+        if corrected:
+            confidence = min(confidence, CORRECTED_CONFIDENCE)
+        return IntentMatch(winner, round(confidence, 3), sorted(covered), trade, corrected)
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ModelHealth:
+    """Rolling latency/error statistics and circuit breaker for one model."""
+
+    def __init__(self, name: str, llm, priority: int, alpha: float = 0.3, window: int = 20,
+                 failure_threshold: int = 3, error_rate_threshold: float = 0.5, cooldown: float = 30.0):
+        self.name = name
+        self.llm = llm
+        self.priority = priority
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown = cooldown
+
+        self.ewma_latency = None
+        self.outcomes = deque(maxlen=window)  # True = success
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.calls = 0
+        self.failures = 0
+        self.last_error = None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def available(self, now: float) -> bool:
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return not self.trial_in_flight
+        return self.state == CLOSED
+
+    def record_success(self, latency: float):
+        self.calls += 1
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+        self.state = CLOSED
+
+    def record_failure(self, error: Exception):
+        self.calls += 1
+        self.failures += 1
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.last_error = str(error)[:200]
+
+        # Half-open trials get one chance; closed circuits open on repeated failures
+        min_samples = max(self.failure_threshold, self.outcomes.maxlen // 2)
+        if (self.state == HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+                or (len(self.outcomes) >= min_samples and self.error_rate >= self.error_rate_threshold)):
+            self.trip()
+
+    def trip(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {
+            "model": self.name,
+            "state": self.state,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "calls": self.calls,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRouter:
+    """LLM-like object that sends each call to the fastest healthy model.
+
+    Models with a known latency are tried fastest first, then untried models in
+    priority order. A failed call moves on to the next candidate; FallbackLLM is
+    only used when every circuit is open. With a `usage` tracker every attempt
+    is recorded under the model it went to, with its own latency and outcome.
+    """
+
+    def __init__(self, models: list, fallback, call_timeout: float = 30.0, usage=None, **health_options):
+        self.models = [ModelHealth(name, llm, priority, **health_options) for priority, (name, llm) in enumerate(models)]
+        self.fallback = fallback
+        self.call_timeout = call_timeout
+        self.usage = usage
+        self.fallback_calls = 0
+
+    def get(self, name: str):
+        for health in self.models:
+            if health.name == name:
+                return health
+        return None
+
+    def candidates(self) -> list:
+        now = time.monotonic()
+        available = [h for h in self.models if h.available(now)]
+        return sorted(available, key=lambda h: (h.ewma_latency is None, h.ewma_latency or 0.0, h.priority))
+
+    async def ainvoke(self, messages, sections=()):
+        for health in self.candidates():
+            if health.state == HALF_OPEN:
+                if health.trial_in_flight:
+                    continue
+                health.trial_in_flight = True
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(health.llm.ainvoke(messages), timeout=self.call_timeout)
+            except Exception as e:
+                latency = time.perf_counter() - started
+                health.record_failure(e)
+                if self.usage is not None:
+                    self.usage.record(health.name, latency, outcome="error", sections=sections,
+                                      error=(str(e) or type(e).__name__)[:200])
+                print(f"GROQ Model {health.name} failed, trying next model: {str(e)}")
+                continue
+            finally:
+                health.trial_in_flight = False
+            latency = time.perf_counter() - started
+            health.record_success(latency)
+            if self.usage is not None:
+                self.usage.record_response(response, latency, sections, model=health.name)
+            return response
+
+        self.fallback_calls += 1
+        started = time.perf_counter()
+        response = await self.fallback.ainvoke(messages)
+        if self.usage is not None:
+            self.usage.record_response(response, time.perf_counter() - started, sections)
+        return response
+
+    def snapshot(self) -> dict:
+        return {
+            "models": [h.snapshot() for h in self.models],
+            "preferred": next((h.name for h in self.candidates()), None),
+            "fallback_calls": self.fallback_calls,
+        }
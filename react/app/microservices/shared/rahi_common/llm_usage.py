@@ -0,0 +1,171 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from rahi_common.instrumentation import current_request_id, metrics
+
+metrics.describe("llm_calls_total", "counter", "LLM calls by model and outcome.")
+metrics.describe("llm_tokens_total", "counter", "LLM tokens by model and kind (prompt, completion).")
+metrics.describe("llm_call_duration_seconds", "histogram", "LLM call latency by model, as seen by this service.")
+metrics.describe("llm_queue_wait_seconds", "histogram", "Time calls spent queued at the provider before processing.")
+
+# Calls recorded by the current request while `LlmUsageTracker.collect()` is active
+_collected = ContextVar("llm_usage_collected", default=None)
+
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def response_usage(response) -> dict:
+    """Model name, token counts and provider queue time from an LLM response.
+
+    Prefers LangChain's `usage_metadata`; Groq's raw `token_usage` fills in
+    what is missing and is the only source of `queue_time`. The fallback
+    model has neither and is reported as "fallback" with zero tokens.
+    """
+    metadata = getattr(response, "response_metadata", None) or {}
+    usage = getattr(response, "usage_metadata", None) or {}
+    token_usage = metadata.get("token_usage") or {}
+    if metadata.get("fallback"):
+        model = "fallback"
+    else:
+        model = metadata.get("model_name") or metadata.get("model") or "unknown"
+    return {
+        "model": model,
+        "prompt_tokens": int(usage.get("input_tokens") or token_usage.get("prompt_tokens") or 0),
+        "completion_tokens": int(usage.get("output_tokens") or token_usage.get("completion_tokens") or 0),
+        "queue_seconds": float(token_usage.get("queue_time") or 0.0),
+    }
+
+
+class LlmUsageTracker:
+    """Token and latency accounting for every LLM call.
+
+    The last `capacity` calls are kept in a fixed-size ring (a bounded deque,
+    so old calls fall off without any cleanup), each with its model, tokens,
+    provider queue wait, latency, prompt sections and request ID. Cumulative
+    per-model totals never reset and are mirrored into Prometheus counters;
+    percentiles in `snapshot()` are computed over the calls still in the ring.
+    """
+
+    def __init__(self, capacity: int = 500):
+        self.capacity = capacity
+        self.recent = deque(maxlen=capacity)
+        self.models = {}
+
+    def record(self, model: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+               queue_seconds: float = 0.0, outcome: str = "ok", sections=(), error: str = None) -> dict:
+        call = {
+            "at": round(time.time(), 3),
+            "request_id": current_request_id(),
+            "model": model,
+            "outcome": outcome,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "queue_ms": round(queue_seconds * 1000, 1),
+            "latency_ms": round(latency * 1000, 1),
+            "sections": list(sections),
+            "error": error,
+        }
+        self.recent.append(call)
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(call)
+
+        totals = self.models.get(model)
+        if totals is None:
+            totals = self.models[model] = {
+                "calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "latency_seconds": 0.0, "queue_seconds": 0.0, "max_latency_seconds": 0.0,
+            }
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        totals["latency_seconds"] += latency
+        totals["queue_seconds"] += queue_seconds
+        totals["max_latency_seconds"] = max(totals["max_latency_seconds"], latency)
+        if outcome != "ok":
+            totals["errors"] += 1
+
+        metrics.inc("llm_calls_total", model=model, outcome=outcome)
+        metrics.inc("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+        metrics.inc("llm_tokens_total", completion_tokens, model=model, kind="completion")
+        metrics.observe("llm_call_duration_seconds", latency, model=model)
+        if queue_seconds:
+            metrics.observe("llm_queue_wait_seconds", queue_seconds, model=model)
+        return call
+
+    def record_response(self, response, latency: float, sections=(), model: str = None) -> dict:
+        """Record a successful call; `model` overrides the name found in the response metadata."""
+        usage = response_usage(response)
+        if model:
+            usage["model"] = model
+        return self.record(latency=latency, sections=sections, **usage)
+
+    @contextmanager
+    def collect(self):
+        """Collect the calls recorded inside this block (and tasks it starts) into a list."""
+        calls = []
+        token = _collected.set(calls)
+        try:
+            yield calls
+        finally:
+            try:
+                _collected.reset(token)
+            except ValueError:
+                pass  # an abandoned async generator is closed from another context
+
+    def set_tokens(self, call: dict, prompt_tokens: int, completion_tokens: int):
+        """Replace a recorded call's token counts, e.g. with the usage a stream reported in its last chunk."""
+        prompt_delta = prompt_tokens - call["prompt_tokens"]
+        completion_delta = completion_tokens - call["completion_tokens"]
+        call["prompt_tokens"], call["completion_tokens"] = prompt_tokens, completion_tokens
+        totals = self.models[call["model"]]
+        totals["prompt_tokens"] += prompt_delta
+        totals["completion_tokens"] += completion_delta
+        # Prometheus counters only go up
+        if prompt_delta > 0:
+            metrics.inc("llm_tokens_total", prompt_delta, model=call["model"], kind="prompt")
+        if completion_delta > 0:
+            metrics.inc("llm_tokens_total", completion_delta, model=call["model"], kind="completion")
+
+    def snapshot(self, limit: int = 50) -> dict:
+        recent = list(self.recent)
+        models = {}
+        for model, totals in self.models.items():
+            latencies = [call["latency_ms"] for call in recent if call["model"] == model and call["outcome"] == "ok"]
+            calls = totals["calls"]
+            answered = max(1, calls - totals["errors"])  # failed calls have no token counts
+            models[model] = {
+                **{key: value for key, value in totals.items() if not key.endswith("_seconds")},
+                "total_tokens": totals["prompt_tokens"] + totals["completion_tokens"],
+                "avg_prompt_tokens": round(totals["prompt_tokens"] / answered, 1),
+                "avg_completion_tokens": round(totals["completion_tokens"] / answered, 1),
+                "avg_latency_ms": round(totals["latency_seconds"] / calls * 1000, 1),
+                "avg_queue_ms": round(totals["queue_seconds"] / calls * 1000, 1),
+                "max_latency_ms": round(totals["max_latency_seconds"] * 1000, 1),
+                "recent_p50_latency_ms": _percentile(latencies, 0.5),
+                "recent_p95_latency_ms": _percentile(latencies, 0.95),
+            }
+
+        # Which prompt sections the recent tokens were spent on
+        sections = {}
+        for call in recent:
+            for name in call["sections"] or ["core"]:
+                entry = sections.setdefault(name, {"calls": 0, "prompt_tokens": 0})
+                entry["calls"] += 1
+                entry["prompt_tokens"] += call["prompt_tokens"]
+
+        return {
+            "capacity": self.capacity,
+            "buffered": len(recent),
+            "models": models,
+            "recent_sections": sections,
+            "slowest": sorted(recent, key=lambda call: call["latency_ms"], reverse=True)[:5],
+            "recent": recent[-limit:][::-1] if limit > 0 else [],
+        }
@@ -0,0 +1,87 @@
+import logging
+
+from langchain_core.messages import SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from rahi_common.response_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+
+def count_tokens(text: str) -> int:
+    return count_tokens_approximately([SystemMessage(content=text)])
+
+
+class PromptSection:
+    """An optional block of the system prompt, included when a keyword matches."""
+
+    def __init__(self, name: str, text: str, keywords=()):
+        self.name = name
+        self.text = text.strip()
+        self.keywords = frozenset(keywords)
+        self.tokens = count_tokens(self.text)
+
+
+class PromptBuilder:
+    """Assembles a compact system prompt for each message.
+
+    The core prompt always comes first, sections follow in a fixed order and
+    the optional `closing` always ends the prompt, so prompts for the same
+    intent share an identical prefix the provider can reuse. Anything
+    per-request (retrieved context, etc.) belongs after it.
+    """
+
+    def __init__(self, core: str, sections: list, default_sections=(), closing: str = ""):
+        self.core = core.strip()
+        self.sections = sections
+        self.default_sections = tuple(default_sections)
+        self.closing = closing.strip()
+        self.full_prompt = self.assemble(sections)
+        self.full_tokens = count_tokens(self.full_prompt)
+
+        self.requests = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+
+    def select_sections(self, message: str, intents=()) -> list:
+        words = set(normalize_message(message).split()) | set(intents)
+        selected = [section for section in self.sections if section.keywords & words]
+        if not selected:
+            selected = [section for section in self.sections if section.name in self.default_sections]
+        return selected
+
+    def assemble(self, sections: list) -> str:
+        parts = [self.core] + [section.text for section in sections]
+        if self.closing:
+            parts.append(self.closing)
+        return "\n\n".join(parts)
+
+    def build(self, message: str, intents=()) -> tuple:
+        """Return (system_prompt, report) for one user message."""
+        sections = self.select_sections(message, intents)
+        prompt = self.assemble(sections)
+        prompt_tokens = count_tokens(prompt)
+        saved = max(0, self.full_tokens - prompt_tokens)
+
+        self.requests += 1
+        self.tokens_sent += prompt_tokens
+        self.tokens_saved += saved
+
+        report = {
+            "sections": [section.name for section in sections],
+            "prompt_tokens": prompt_tokens,
+            "full_prompt_tokens": self.full_tokens,
+            "tokens_saved": saved,
+        }
+        logger.info(f"System prompt: sections={report['sections']} tokens={prompt_tokens} saved={saved}")
+        return prompt, report
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "full_prompt_tokens": self.full_tokens,
+            "tokens_sent": self.tokens_sent,
+            "tokens_saved": self.tokens_saved,
+            "avg_prompt_tokens": round(self.tokens_sent / self.requests, 1) if self.requests else 0.0,
+            "sections": {section.name: section.tokens for section in self.sections},
+        }
@@ -0,0 +1,164 @@
+import math
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Common Hinglish / transliteration variants mapped to one spelling
+TRANSLITERATIONS = {
+    "plumbar": "plumber", "plamber": "plumber", "plumbr": "plumber", "nalsaaz": "plumber",
+    "electrition": "electrician", "electricion": "electrician", "elektrician": "electrician", "bijliwala": "electrician",
+    "carpentar": "carpenter", "carpanter": "carpenter", "badhai": "carpenter",
+    "chaiye": "chahiye", "chahie": "chahiye", "chahiyee": "chahiye", "chahiya": "chahiye",
+    "muje": "mujhe", "mujhko": "mujhe", "mereko": "mujhe",
+    "kitne": "kitna", "kitni": "kitna",
+    "comission": "commission", "commision": "commission",
+    "boking": "booking", "bookin": "booking",
+    "trak": "track", "trek": "track",
+    "paisa": "payment", "paise": "payment",
+}
+
+# Filler words ignored by the similarity tier (English and Hinglish)
+FILLER_WORDS = frozenset([
+    "please", "pls", "plz", "kindly", "ji", "the", "a", "an", "is", "are", "do", "does",
+    "can", "could", "i", "you", "hai", "ka", "ki", "ke", "ko", "se", "mein", "me",
+])
+
+def _strip_punctuation(text: str) -> str:
+    # Unicode punctuation and symbols only; Devanagari vowel signs are marks and must stay
+    return "".join(" " if unicodedata.category(char)[0] in "PS" else char for char in text)
+
+
+def normalize_message(text: str) -> str:
+    """Canonical form used as the exact-match cache key."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _strip_punctuation(text)
+    return " ".join(TRANSLITERATIONS.get(word, word) for word in text.split())
+
+
+class ResponseCache:
+    """Two-tier reply cache.
+
+    Tier one is an LRU with TTL keyed on the normalized message. Tier two keeps
+    a hashed TF-IDF vector per entry in a fixed NumPy matrix and returns the
+    nearest cached reply when its cosine similarity clears the threshold.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0,
+                 similarity_threshold: float = 0.8, dims: int = 2048):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.dims = dims
+
+        self._entries = OrderedDict()  # key -> (reply, expires_at, slot)
+        self._vectors = np.zeros((max_entries, dims), dtype=np.float32)
+        self._squares = np.zeros((max_entries, dims), dtype=np.float32)
+        self._doc_freq = np.zeros(dims, dtype=np.float32)
+        self._slot_keys = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _vectorize(self, key: str) -> np.ndarray:
+        """Sublinear term frequencies of hashed unigrams and bigrams."""
+        words = [word for word in key.split() if word not in FILLER_WORDS]
+        terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        counts = {}
+        for term in terms:
+            index = zlib.crc32(term.encode("utf-8")) % self.dims
+            counts[index] = counts.get(index, 0) + 1
+        vector = np.zeros(self.dims, dtype=np.float32)
+        for index, count in counts.items():
+            vector[index] = 1.0 + math.log(count)
+        return vector
+
+    def _remove(self, key: str):
+        _reply, _expires_at, slot = self._entries.pop(key)
+        self._doc_freq -= self._vectors[slot] > 0
+        self._vectors[slot] = 0.0
+        self._squares[slot] = 0.0
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    def _nearest(self, key: str):
+        if not self._entries:
+            return None
+        query = self._vectorize(key)
+        terms = np.flatnonzero(query)
+        if not len(terms):
+            return None
+
+        # cos(q, d) with idf weights, touching only the query's columns for the dot product
+        n_docs = len(self._entries)
+        idf_sq = np.square(np.log((n_docs + 1) / (self._doc_freq + 1)) + 1.0)
+        dots = self._vectors[:, terms] @ (query[terms] * idf_sq[terms])
+        norms = np.sqrt(self._squares @ idf_sq) * np.sqrt(np.square(query[terms]) @ idf_sq[terms])
+        scores = np.divide(dots, norms, out=np.zeros(self.max_entries, dtype=np.float32), where=norms > 0)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        return self._slot_keys[best]
+
+    def get(self, message: str):
+        key = normalize_message(message)
+        now = time.monotonic()
+
+        if key not in self._entries:
+            key = self._nearest(key)
+            if key is not None and self._entries[key][1] > now:
+                self.similar_hits += 1
+        elif self._entries[key][1] > now:
+            self.hits += 1
+        else:
+            self._remove(key)
+            self.expirations += 1
+            key = None
+
+        if key is None or self._entries[key][1] <= now:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, message: str, reply: str):
+        key = normalize_message(message)
+        if not key:
+            return
+        if key in self._entries:
+            self._remove(key)
+        elif not self._free_slots:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+        slot = self._free_slots.pop()
+        vector = self._vectorize(key)
+        self._vectors[slot] = vector
+        self._squares[slot] = np.square(vector)
+        self._doc_freq += vector > 0
+        self._slot_keys[slot] = key
+        self._entries[key] = (reply, time.monotonic() + self.ttl, slot)
+
+    def clear(self):
+        for key in list(self._entries):
+            self._remove(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+        }
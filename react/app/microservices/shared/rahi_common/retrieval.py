@@ -0,0 +1,483 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from scipy import sparse
+
+from rahi_common.response_cache import FILLER_WORDS, normalize_message
+
+logger = logging.getLogger(__name__)
+
+# Common English words that only add noise to keyword retrieval
+STOP_WORDS = FILLER_WORDS | frozenset([
+    "and", "or", "of", "to", "in", "on", "for", "with", "by", "at", "as", "be", "it", "this", "that",
+    "was", "were", "will", "shall", "may", "from", "not", "no", "all", "any", "its", "their", "which",
+    "has", "have", "had", "what", "how", "my", "we", "our", "your",
+])
+
+INDEX_VERSION = 3
+# Inside index_dir: the name of the build in use, and the lock taken to check, build or switch builds
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+
+
+def tokenize(text: str) -> list:
+    return [word for word in normalize_message(text).split() if word not in STOP_WORDS and len(word) > 1]
+
+
+def chunk_text(text: str, chunk_words: int = 120, overlap: int = 30) -> list:
+    """Split text into overlapping windows of roughly `chunk_words` words."""
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def knowledge_files(path: str) -> list:
+    """The knowledge file itself, or every JSONL shard in a knowledge directory."""
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".jsonl"))
+    return [path]
+
+
+def load_knowledge(path: str):
+    """Yield entries ({"source", "content", optional "page"}) from extracted knowledge.
+
+    Accepts the JSONL shards written by scripts/extract.py (one page per line,
+    read line by line) as well as a legacy knowledge.json list.
+    """
+    for file_path in knowledge_files(path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            if file_path.endswith(".jsonl"):
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield from json.load(f)
+
+
+def lock_file(fd: int):
+    """Block until this process holds the exclusive lock on the open file `fd`."""
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    os.lseek(fd, 0, os.SEEK_SET)
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)  # gives up after ~10s, so keep waiting
+            return
+        except OSError:
+            pass
+
+
+def unlock_file(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return
+    os.lseek(fd, 0, os.SEEK_SET)
+    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class StringTable:
+    """Strings saved as one UTF-8 blob plus an offsets array, both memory-mapped."""
+
+    def __init__(self, directory: str, name: str):
+        self.offsets = np.load(os.path.join(directory, f"{name}_offsets.npy"), mmap_mode="r")
+        # np.memmap refuses empty files
+        path = os.path.join(directory, f"{name}.bin")
+        self.data = np.memmap(path, dtype=np.uint8, mode="r") if self.offsets[-1] else None
+
+    @staticmethod
+    def save(directory: str, name: str, strings: list):
+        encoded = [text.encode("utf-8") for text in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded])
+        np.save(os.path.join(directory, f"{name}_offsets.npy"), offsets)
+        with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+            for data in encoded:
+                f.write(data)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _bytes(self, i: int) -> bytes:
+        return bytes(self.data[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+    def __getitem__(self, i: int) -> str:
+        return self._bytes(i).decode("utf-8")
+
+    def find(self, text: str) -> int:
+        """Position of `text` in a table saved in byte order, or -1."""
+        target = text.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._bytes(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self) and self._bytes(low) == target else -1
+
+
+@dataclass
+class LoadedIndex:
+    """The arrays of one build, replaced as a unit so a query never mixes two builds."""
+
+    directory: str
+    meta: dict
+    indptr: np.ndarray
+    chunk_ids: np.ndarray
+    weights: np.ndarray
+    terms: StringTable
+    chunks: StringTable
+    sources: StringTable
+    chunk_sources: np.ndarray
+
+
+class KnowledgeIndex:
+    """BM25 index over chunks of the extracted policy documents.
+
+    The index is built once from the knowledge file and saved as plain .npy
+    arrays: a CSC inverted index (term -> chunk ids and precomputed BM25
+    weights), plus the sorted vocabulary, the chunk text and the chunk sources
+    as UTF-8 blobs with offsets. Loading maps all of them with mmap_mode="r"
+    and parses only a small meta.json, so startup cost does not grow with the
+    index and every worker shares the same page cache.
+
+    `index_dir` holds versioned builds and a CURRENT file naming the one in
+    use. Workers check, build and switch builds under an exclusive file lock,
+    so one worker builds while the others wait and then load its result. The
+    index is rebuilt when the knowledge files change (count, total size or
+    newest mtime); a loaded index checks for that every `refresh_interval`
+    seconds and swaps in the new build. A failed load is retried after
+    `retry_interval` seconds.
+    """
+
+    def __init__(self, source_path: str, index_dir: str, chunk_words: int = 120, overlap: int = 30,
+                 k1: float = 1.5, b: float = 0.75, retry_interval: float = 30.0, refresh_interval: float = 30.0):
+        self.source_path = source_path
+        self.index_dir = index_dir
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.k1 = k1
+        self.b = b
+        self.retry_interval = retry_interval
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._retry_at = 0.0
+        self._refresh_at = 0.0
+        self.error = None
+        self._latencies = deque(maxlen=500)
+        self.queries = 0
+        self.reloads = 0
+
+    # -- build -----------------------------------------------------------
+
+    def _source_signature(self) -> dict:
+        stats = [os.stat(file_path) for file_path in knowledge_files(self.source_path)]
+        return {
+            "source_files": len(stats),
+            "source_size": sum(stat.st_size for stat in stats),
+            "source_mtime": max((stat.st_mtime for stat in stats), default=0.0),
+        }
+
+    def build(self) -> dict:
+        """Build a new version of the index and make it current. Call under the file lock."""
+        started = time.perf_counter()
+        signature = self._source_signature()
+
+        chunk_texts, chunk_sources = [], []
+        for entry in load_knowledge(self.source_path):
+            source = entry.get("source", "")
+            if entry.get("page"):
+                source = f"{source} p.{entry['page']}"
+            for chunk in chunk_text(entry.get("content", ""), self.chunk_words, self.overlap):
+                chunk_texts.append(chunk)
+                chunk_sources.append(source)
+
+        vocab = {}
+        rows, cols = [], []
+        for row, chunk in enumerate(chunk_texts):
+            for token in tokenize(chunk):
+                rows.append(row)
+                cols.append(vocab.setdefault(token, len(vocab)))
+
+        # Number the terms in byte order so a query can binary-search the mapped vocabulary
+        terms = sorted(vocab, key=lambda term: term.encode("utf-8"))
+        term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        renumber = np.array([term_ids[term] for term in vocab], dtype=np.int64)
+        cols = renumber[np.asarray(cols, dtype=np.int64)]
+
+        n_chunks = len(chunk_texts)
+        tf = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n_chunks, len(vocab)), dtype=np.float32
+        )
+        tf.sum_duplicates()
+
+        # BM25 weight for every (chunk, term) pair, so a query is just a sum over postings
+        lengths = np.asarray(tf.sum(axis=1)).ravel()
+        avg_length = lengths.mean() if n_chunks else 0.0
+        doc_freq = np.bincount(tf.indices, minlength=len(vocab))
+        idf = np.log(1.0 + (n_chunks - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        row_norm = self.k1 * (1 - self.b + self.b * lengths / max(avg_length, 1e-9))
+        row_of_entry = np.repeat(np.arange(n_chunks), np.diff(tf.indptr))
+        tf.data = (tf.data * (self.k1 + 1) / (tf.data + row_norm[row_of_entry]) * idf[tf.indices]).astype(np.float32)
+        postings = tf.tocsc()
+
+        source_ids = {}
+        for source in chunk_sources:
+            source_ids.setdefault(source, len(source_ids))
+
+        # Write a new versioned directory, then point CURRENT at it, so readers never see a partial index
+        version_name = f"v{time.time_ns()}-{os.getpid()}"
+        version_dir = os.path.join(self.index_dir, version_name)
+        os.makedirs(version_dir)
+        np.save(os.path.join(version_dir, "postings_indptr.npy"), postings.indptr.astype(np.int64))
+        np.save(os.path.join(version_dir, "postings_chunks.npy"), postings.indices.astype(np.int32))
+        np.save(os.path.join(version_dir, "postings_weights.npy"), postings.data.astype(np.float32))
+        np.save(
+            os.path.join(version_dir, "chunk_sources.npy"),
+            np.array([source_ids[source] for source in chunk_sources], dtype=np.int32),
+        )
+        StringTable.save(version_dir, "terms", terms)
+        StringTable.save(version_dir, "chunks", chunk_texts)
+        StringTable.save(version_dir, "sources", list(source_ids))
+
+        meta = {
+            "version": INDEX_VERSION,
+            **signature,
+            "chunk_words": self.chunk_words,
+            "overlap": self.overlap,
+            "chunks": n_chunks,
+            "documents": len({source.split(" p.")[0] for source in source_ids}),
+            "vocab_size": len(vocab),
+            "postings": int(postings.nnz),
+            "build_seconds": round(time.perf_counter() - started, 3),
+        }
+        with open(os.path.join(version_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        self._swap_in(version_name)
+        logger.info(f"Knowledge index built: {n_chunks} chunks, {len(vocab)} terms in {meta['build_seconds']}s")
+        return meta
+
+    def _swap_in(self, version_name: str):
+        """Make `version_name` current and delete what it replaces. Call under the file lock."""
+        pointer = os.path.join(self.index_dir, f"{CURRENT_FILE}.{os.getpid()}")
+        with open(pointer, "w", encoding="utf-8") as f:
+            f.write(version_name)
+        os.replace(pointer, os.path.join(self.index_dir, CURRENT_FILE))
+
+        for name in os.listdir(self.index_dir):
+            if name in (CURRENT_FILE, LOCK_FILE, version_name):
+                continue
+            # Older builds, or the files of an unversioned index. Workers that mapped an old
+            # build keep reading it after the unlink; where the OS refuses (Windows), it is
+            # removed by a later build.
+            path = os.path.join(self.index_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process using this index directory."""
+        if os.path.islink(self.index_dir):
+            os.remove(self.index_dir)  # symlinked layout from an older release
+        os.makedirs(self.index_dir, exist_ok=True)
+        fd = os.open(os.path.join(self.index_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT)
+        try:
+            lock_file(fd)
+            try:
+                yield
+            finally:
+                unlock_file(fd)
+        finally:
+            os.close(fd)
+
+    # -- load ------------------------------------------------------------
+
+    def _current_dir(self):
+        try:
+            with open(os.path.join(self.index_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+                return os.path.join(self.index_dir, f.read().strip())
+        except OSError:
+            return None
+
+    def _read_meta(self, version_dir):
+        if version_dir is None:
+            return None
+        try:
+            with open(os.path.join(version_dir, "meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_current(self, meta) -> bool:
+        if meta is None or meta.get("version") != INDEX_VERSION:
+            return False
+        if meta.get("chunk_words") != self.chunk_words or meta.get("overlap") != self.overlap:
+            return False
+        signature = self._source_signature()
+        return all(meta.get(key) == value for key, value in signature.items())
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    @property
+    def meta(self):
+        return self._index.meta if self._index is not None else None
+
+    @property
+    def retry_due(self) -> bool:
+        """True when the index is not loaded and `ensure_loaded` would try again."""
+        return self._index is None and time.monotonic() >= self._retry_at
+
+    @property
+    def refresh_due(self) -> bool:
+        """True when the index is loaded and `ensure_loaded` would check the knowledge files for changes."""
+        return self._index is not None and time.monotonic() >= self._refresh_at
+
+    def ensure_loaded(self) -> bool:
+        """Load the index, building it first if missing or stale. Returns False if unavailable.
+
+        Once loaded, a call after `refresh_interval` seconds rebuilds the index if the
+        knowledge files changed (or picks up another worker's rebuild) and swaps it in.
+        """
+        if self._index is not None and not self.refresh_due:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self._index is not None and now < self._refresh_at:
+                return True
+            if self._index is None and now < self._retry_at:
+                return False
+            try:
+                if not os.path.exists(self.source_path):
+                    raise FileNotFoundError(f"Knowledge file not found: {self.source_path}")
+                with self._file_lock():
+                    version_dir = self._current_dir()
+                    meta = self._read_meta(version_dir)
+                    if not self._is_current(meta):
+                        meta = self.build()
+                        version_dir = self._current_dir()
+                    if self._index is None or self._index.directory != version_dir:
+                        if self._index is not None:
+                            self.reloads += 1
+                        self._index = self._load(version_dir, meta)
+                        logger.info(f"Knowledge index loaded: {meta['chunks']} chunks from {version_dir}")
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+                if self._index is not None:
+                    logger.warning(f"Knowledge index refresh failed, keeping the loaded build: {self.error}")
+                else:
+                    self._retry_at = time.monotonic() + self.retry_interval
+                    logger.warning(f"Knowledge retrieval unavailable, retrying in {self.retry_interval:g}s: {self.error}")
+            self._refresh_at = time.monotonic() + self.refresh_interval
+            return self._index is not None
+
+    def _load(self, version_dir: str, meta: dict) -> LoadedIndex:
+        def mapped(name):
+            return np.load(os.path.join(version_dir, name), mmap_mode="r")
+
+        return LoadedIndex(
+            directory=version_dir,
+            meta=meta,
+            indptr=mapped("postings_indptr.npy"),
+            chunk_ids=mapped("postings_chunks.npy"),
+            weights=mapped("postings_weights.npy"),
+            terms=StringTable(version_dir, "terms"),
+            chunks=StringTable(version_dir, "chunks"),
+            sources=StringTable(version_dir, "sources"),
+            chunk_sources=mapped("chunk_sources.npy"),
+        )
+
+    # -- query -----------------------------------------------------------
+
+    def search(self, query: str, k: int = 3, min_score: float = 0.0) -> list:
+        """Top-k chunks for the query as [{"score", "source", "text"}], best first.
+
+        Loads the index on first use; checking for changed knowledge files is left
+        to `ensure_loaded`, which callers should run off the event loop.
+        """
+        if self._index is None and not self.ensure_loaded():
+            return []
+        index = self._index
+        if not index.meta["chunks"]:
+            return []
+        started = time.perf_counter()
+
+        term_ids = set()
+        for token in tokenize(query):
+            term_id = index.terms.find(token)
+            if term_id >= 0:
+                term_ids.add(term_id)
+        scores = np.zeros(index.meta["chunks"], dtype=np.float32)
+        for term_id in term_ids:
+            start, end = index.indptr[term_id], index.indptr[term_id + 1]
+            scores[index.chunk_ids[start:end]] += index.weights[start:end]
+
+        results = []
+        if term_ids:
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            for chunk_id in top[np.argsort(-scores[top])]:
+                if scores[chunk_id] <= min_score:
+                    break
+                results.append({
+                    "score": round(float(scores[chunk_id]), 3),
+                    "source": index.sources[int(index.chunk_sources[chunk_id])],
+                    "text": index.chunks[int(chunk_id)],
+                })
+
+        self.queries += 1
+        self._latencies.append(time.perf_counter() - started)
+        return results
+
+    def stats(self) -> dict:
+        index = self._index
+        if index is None:
+            return {"loaded": False, "source": self.source_path, "error": self.error}
+        index_bytes = sum(os.path.getsize(os.path.join(index.directory, name)) for name in os.listdir(index.directory))
+        latencies = sorted(self._latencies)
+        return {
+            "loaded": True,
+            "source": self.source_path,
+            "chunks": index.meta["chunks"],
+            "documents": index.meta["documents"],
+            "vocab_size": index.meta["vocab_size"],
+            "postings": index.meta["postings"],
+            "index_bytes": index_bytes,
+            "build_seconds": index.meta["build_seconds"],
+            "reloads": self.reloads,
+            "queries": self.queries,
+            "query_p50_ms": round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+            "query_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3) if latencies else None,
+        }
@@ -0,0 +1,57 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one in-flight call.
+
+    The first caller for a key (the leader) runs the call; callers arriving
+    while it is in flight wait up to `wait_timeout` seconds for its result.
+    If the leader fails, is cancelled, or takes too long, each waiting caller
+    runs the call itself instead, so one bad call never fails the others.
+    """
+
+    def __init__(self, wait_timeout: float = 15.0):
+        self.wait_timeout = wait_timeout
+        self._in_flight = {}  # key -> Future of the leader's result
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.follower_retries = 0
+
+    async def run(self, key, call):
+        """Return `await call()`, sharing the result with concurrent callers of the same key."""
+        future = self._in_flight.get(key)
+        if future is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), timeout=self.wait_timeout)
+                self.coalesced += 1
+                return result
+            except Exception:
+                # Leader failed or was too slow: answer this caller independently
+                self.follower_retries += 1
+                return await call()
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        self.leaders += 1
+        try:
+            result = await call()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("leader call cancelled"))
+            future.exception()  # mark retrieved so an unawaited failure is not logged
+            raise
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.coalesced
+        return {
+            "leader_calls": self.leaders,
+            "coalesced_calls": self.coalesced,
+            "follower_retries": self.follower_retries,
+            "in_flight": len(self._in_flight),
+            "coalesced_rate": round(self.coalesced / calls, 3) if calls else 0.0,
+        }
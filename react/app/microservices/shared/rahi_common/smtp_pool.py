@@ -0,0 +1,241 @@
+import smtplib
+import ssl
+import threading
+import time
+from collections import deque
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+
+def is_connection_error(error: Exception) -> bool:
+    """The session is unusable (dropped, timed out); the message itself may still be fine."""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    # SMTPException subclasses OSError, but a server reply is not a broken connection
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def build_message(sender: str, to, subject: str, body: str, html: str = None) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to if isinstance(to, str) else ", ".join(to)
+    msg["Subject"] = subject
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid(domain=sender.split("@")[-1] if "@" in sender else None)
+    msg.set_content(body)
+    if html:
+        msg.add_alternative(html, subtype="html")
+    return msg
+
+
+class _Session:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.opened_at = time.monotonic()
+        self.last_used = self.opened_at
+        self.sent = 0
+
+
+class SmtpPool:
+    """Thread-safe pool of authenticated SMTP sessions that are kept open and reused.
+
+    Opening a session costs a TCP handshake, STARTTLS and AUTH; reusing one
+    costs only the message itself, and `send_many` sends a whole batch on one
+    session. With `starttls` a server that does not offer STARTTLS is refused
+    rather than logged into in plaintext. Sessions idle for longer than
+    `max_idle` or that have sent `max_messages` are closed and replaced. A
+    send that hits a dropped connection reconnects once and retries. Errors
+    the server returns for the message itself (5xx, refused recipients) are
+    raised with `permanent = True` so callers do not retry them.
+    """
+
+    def __init__(self, host: str, port: int = 587, username: str = None, password: str = None,
+                 starttls: bool = True, use_ssl: bool = False, size: int = 4, timeout: float = 10.0,
+                 max_idle: float = 60.0, max_messages: int = 500, check_after: float = 5.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.check_after = check_after
+
+        self._idle = deque()  # most recently used last
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._open = 0
+
+        self.connects = 0
+        self.reconnects = 0
+        self.sent = 0
+        self.failed = 0
+
+    # -- sessions --------------------------------------------------------
+
+    def _connect(self) -> _Session:
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls and not self.use_ssl:
+                # Never fall back to plaintext: the password would go over the wire in the clear
+                if not smtp.has_extn("starttls"):
+                    raise smtplib.SMTPNotSupportedError(f"{self.host} does not offer STARTTLS")
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._quit(smtp)
+            raise
+        with self._lock:
+            self._open += 1
+            self.connects += 1
+        return _Session(smtp)
+
+    @staticmethod
+    def _quit(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _discard(self, session: _Session):
+        self._quit(session.smtp)
+        with self._lock:
+            self._open -= 1
+
+    def _usable(self, session: _Session) -> bool:
+        now = time.monotonic()
+        if now - session.last_used > self.max_idle or session.sent >= self.max_messages:
+            return False
+        if now - session.last_used > self.check_after:
+            # The server may have dropped a quiet connection; NOOP is cheaper than a failed send
+            try:
+                return session.smtp.noop()[0] == 250
+            except Exception:
+                return False
+        return True
+
+    def _acquire(self) -> _Session:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No SMTP session free within {self.timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    session = self._idle.pop() if self._idle else None
+                if session is None:
+                    return self._connect()
+                if self._usable(session):
+                    return session
+                self._discard(session)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, session: _Session):
+        if session is not None:
+            session.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(session)
+        self._slots.release()
+
+    # -- sending ---------------------------------------------------------
+
+    def _mark(self, error: Exception):
+        if isinstance(error, smtplib.SMTPRecipientsRefused) or (
+                isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500):
+            error.permanent = True
+
+    def _try_send(self, session, msg: EmailMessage) -> tuple:
+        """Send one message, reconnecting once if the session turns out to be dead.
+
+        Returns (session to keep using or None, error or None); never raises.
+        """
+        try:
+            if session is None:
+                session = self._connect()
+            try:
+                session.smtp.send_message(msg)
+            except Exception as e:
+                if not is_connection_error(e):
+                    raise
+                self._discard(session)
+                session = None
+                with self._lock:
+                    self.reconnects += 1
+                session = self._connect()
+                session.smtp.send_message(msg)
+            session.sent += 1
+            with self._lock:
+                self.sent += 1
+            return session, None
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            if session is not None and is_connection_error(e):
+                self._discard(session)
+                session = None
+            self._mark(e)
+            return session, e
+
+    def send(self, msg: EmailMessage) -> str:
+        """Send one message on a pooled session; returns its Message-ID."""
+        session, error = self._try_send(self._acquire(), msg)
+        self._release(session)
+        if error is not None:
+            raise error
+        return msg["Message-ID"]
+
+    def send_many(self, messages: list) -> list:
+        """Send messages back to back on one pooled session; returns (message_id, error) per message.
+
+        A dropped session is reconnected mid-batch. If the new session cannot
+        send either, the rest of the batch fails with the same error rather than
+        waiting on a dead server once per message.
+        """
+        results = []
+        session = self._acquire()
+        try:
+            for msg in messages:
+                session, error = self._try_send(session, msg)
+                results.append((msg["Message-ID"], error))
+                if error is not None and is_connection_error(error):
+                    break
+        finally:
+            self._release(session)
+        skipped = messages[len(results):]
+        if skipped:
+            with self._lock:
+                self.failed += len(skipped)
+            results += [(msg["Message-ID"], error) for msg in skipped]
+        return results
+
+    def close(self):
+        with self._lock:
+            sessions, self._idle = list(self._idle), deque()
+        for session in sessions:
+            self._discard(session)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "host": self.host,
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "connects": self.connects,
+                "reconnects": self.reconnects,
+                "sent": self.sent,
+                "failed": self.failed,
+                "messages_per_connect": round(self.sent / self.connects, 1) if self.connects else 0.0,
+            }
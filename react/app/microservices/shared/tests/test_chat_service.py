@@ -0,0 +1,79 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+
+from rahi_common.chat_service import ChatService
+from rahi_common.prompt_builder import PromptBuilder, PromptSection
+
+
+class RecordingLLM:
+    """Stands in for the model router and remembers the system prompts it was sent."""
+
+    def __init__(self, reply="Our commission is 8-12%."):
+        self.reply = reply
+        self.prompts = []
+
+    async def ainvoke(self, messages, sections=()):
+        self.prompts.append(messages[0].content)
+        return AIMessage(content=self.reply)
+
+
+def make_service(tmp_path, llm):
+    builder = PromptBuilder(
+        "You are a test assistant.",
+        [PromptSection("pricing", "Pricing: 8-12% commission.", ("commission",))],
+        closing="Be brief."
+    )
+    service = ChatService(builder, str(tmp_path), str(tmp_path / "missing-knowledge"))
+    service.llm = llm
+    service.llm_status.update(ready=True, model="test", source="test")
+    return service
+
+
+def test_service_prompt_is_sent_to_the_model(tmp_path):
+    llm = RecordingLLM()
+    service = make_service(tmp_path, llm)
+
+    reply = asyncio.run(service.ask_chatbot("what is the commission you take on earnings today"))
+    assert reply == "Our commission is 8-12%."
+    assert len(llm.prompts) == 1
+    assert llm.prompts[0].startswith("You are a test assistant.")
+    assert "Pricing: 8-12% commission." in llm.prompts[0]
+    assert llm.prompts[0].endswith("Be brief.")
+
+    # The same question again comes from the reply cache
+    assert asyncio.run(service.ask_chatbot("what is the commission you take on earnings today")) == reply
+    assert len(llm.prompts) == 1
+
+
+def test_navigational_question_is_answered_without_the_model(tmp_path):
+    llm = RecordingLLM()
+    service = make_service(tmp_path, llm)
+
+    reply = asyncio.run(service.ask_chatbot("track my booking"))
+    assert "/tracking" in reply
+    assert llm.prompts == []
+
+
+def test_conversation_keeps_history(tmp_path):
+    llm = RecordingLLM()
+    service = make_service(tmp_path, llm)
+
+    async def run():
+        await service.ask_chatbot("tell me about your platform please", conversation_id="c1")
+        await service.ask_chatbot("and what else should I know", conversation_id="c1")
+        state = await service.conversational_chatbot.aget_state({"configurable": {"thread_id": "c1"}})
+        return [message.content for message in state.values["messages"]]
+
+    assert asyncio.run(run()) == [
+        "tell me about your platform please", "Our commission is 8-12%.",
+        "and what else should I know", "Our commission is 8-12%.",
+    ]
+
+
+def test_batch_reports_each_item(tmp_path):
+    service = make_service(tmp_path, RecordingLLM())
+
+    results = asyncio.run(service.ask_chatbot_batch(["tell me about rahi", "track my booking"]))
+    assert results[0] == ("Our commission is 8-12%.", None)
+    assert "/tracking" in results[1][0] and results[1][1] is None
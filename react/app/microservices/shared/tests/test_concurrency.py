@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from rahi_common.concurrency import CapacityExceeded, InFlightLimiter, SlotStreamingResponse
+
+SCOPE = {"type": "http", "method": "POST", "path": "/chat/stream", "headers": []}
+
+
+async def body():
+    yield "data: a\n\n"
+    await asyncio.sleep(0.05)
+    yield "data: b\n\n"
+
+
+def test_limiter_rejects_when_full():
+    async def run():
+        limiter = InFlightLimiter(1, queue_timeout=0.01)
+        await limiter.acquire()
+        with pytest.raises(CapacityExceeded):
+            await limiter.acquire()
+        limiter.release()
+        async with limiter.slot():
+            assert limiter.in_flight == 1
+        return limiter
+
+    limiter = asyncio.run(run())
+    assert limiter.in_flight == 0
+    assert limiter.rejected == 1
+
+
+def test_stream_releases_slot_after_body():
+    async def run():
+        limiter = InFlightLimiter(1)
+        await limiter.acquire()
+        sent = []
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def send(message):
+            sent.append(message)
+
+        await SlotStreamingResponse(body(), limiter)(SCOPE, receive, send)
+        return limiter, sent
+
+    limiter, sent = asyncio.run(run())
+    assert limiter.in_flight == 0
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_stream_releases_slot_when_send_fails_before_body():
+    async def run():
+        limiter = InFlightLimiter(1)
+        await limiter.acquire()
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def send(message):
+            raise OSError("client went away")
+
+        with pytest.raises(OSError):
+            await SlotStreamingResponse(body(), limiter)(SCOPE, receive, send)
+        return limiter
+
+    assert asyncio.run(run()).in_flight == 0
+
+
+def test_stream_releases_slot_on_early_disconnect():
+    async def run():
+        limiter = InFlightLimiter(1)
+        await limiter.acquire()
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            await asyncio.sleep(0.01)
+
+        try:
+            await SlotStreamingResponse(body(), limiter)(SCOPE, receive, send)
+        except OSError:
+            pass  # newer Starlette reports the disconnect as an error
+        return limiter
+
+    limiter = asyncio.run(run())
+    assert limiter.in_flight == 0
+    assert not limiter._semaphore.locked()
@@ -0,0 +1,57 @@
+import asyncio
+
+from langgraph.checkpoint.base import empty_checkpoint
+
+from rahi_common.conversation_store import ConversationStore
+
+
+def config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+
+
+def checkpoint(value: str) -> dict:
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": [value]}
+    checkpoint["channel_versions"] = {"messages": 1}
+    return checkpoint
+
+
+def test_promoted_conversation_survives_restart(tmp_path):
+    db = str(tmp_path / "conversations.db")
+    store = ConversationStore(db, max_hot=1)
+    store.put(config("a"), checkpoint("first"), {}, {})
+    store.put(config("b"), checkpoint("second"), {}, {})  # pushes "a" out to SQLite
+    assert store.stats()["spilled"] == 1
+
+    assert store.get_tuple(config("a")).checkpoint["channel_values"]["messages"] == ["first"]
+    assert store.promotions == 1
+    assert store.stats()["spilled"] >= 1  # the promoted row is kept
+
+    # A crash loses the hot tier, but "a" is still on disk
+    restarted = ConversationStore(db, max_hot=1)
+    assert restarted.has_thread("a")
+    assert restarted.get_tuple(config("a")).checkpoint["channel_values"]["messages"] == ["first"]
+
+
+def test_expired_conversation_is_dropped(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"), max_hot=0, ttl=-1)
+    store.put(config("a"), checkpoint("old"), {}, {})
+    assert store.get_tuple(config("a")) is None
+    assert store.stats()["spilled"] == 0
+
+
+def test_async_methods(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+
+    async def run():
+        await store.aput(config("a"), checkpoint("hello"), {}, {})
+        found = await store.aget_tuple(config("a"))
+        listed = [item async for item in store.alist(config("a"))]
+        exists = await store.ahas_thread("a")
+        await store.adelete_thread("a")
+        return found, listed, exists, await store.ahas_thread("a")
+
+    found, listed, exists, after_delete = asyncio.run(run())
+    assert found.checkpoint["channel_values"]["messages"] == ["hello"]
+    assert len(listed) == 1
+    assert exists and not after_delete
@@ -0,0 +1,63 @@
+import pytest
+
+from rahi_common.intent_router import CORRECTED_CONFIDENCE, IntentRouter
+
+THRESHOLD = 0.75  # INTENT_CONFIDENCE_THRESHOLD default in both chatbots
+
+router = IntentRouter()
+
+
+@pytest.mark.parametrize("message", [
+    "I am here",
+    "I want a refund",
+    "help",
+    "hell",
+    "I love cooking",
+    "my parents are older",
+    "which states do you cover",
+    "can I change my address",
+    "i am a worker",
+    "how do I register as a worker",
+    "worker payouts?",
+    "I am a professional electrician looking for jobs",
+])
+def test_common_words_are_not_answered_locally(message):
+    match = router.match(message)
+    assert match.intent is None or match.confidence < THRESHOLD
+
+
+@pytest.mark.parametrize("typed, expected", [
+    ("here", "here"),
+    ("cooking", "cooking"),
+    ("older", "older"),
+    ("states", "states"),
+    ("plummber", "plumber"),
+    ("electrican", "electrician"),
+])
+def test_fuzzy_correction(typed, expected):
+    assert router._nearest_token(typed) == expected
+
+
+def test_corrected_match_stays_below_threshold():
+    match = router.match("plummber chahiye")
+    assert match.intent == "find_worker"
+    assert match.trade == "plumber"
+    assert match.corrected
+    assert match.confidence == CORRECTED_CONFIDENCE < THRESHOLD
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("I need a plumber", "find_worker"),
+    ("I need a worker", "find_worker"),
+    ("mujhe worker chahiye", "find_worker"),
+    ("find a professional", "find_worker"),
+    ("track my booking", "track"),
+    ("order status", "track"),
+    ("booking refund", "payment"),
+    ("namaste", "greeting"),
+])
+def test_exact_keywords_are_answered_locally(message, intent):
+    match = router.match(message)
+    assert match.intent == intent
+    assert not match.corrected
+    assert match.confidence >= THRESHOLD
@@ -0,0 +1,71 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from rahi_common.llm_router import ModelRouter
+from rahi_common.llm_usage import LlmUsageTracker
+
+
+class FakeModel:
+    def __init__(self, reply=None, error=None, delay=0.0):
+        self.reply, self.error, self.delay = reply, error, delay
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return AIMessage(content=self.reply, usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15},
+                         response_metadata={"model_name": "provider-name"})
+
+
+class Fallback:
+    async def ainvoke(self, messages):
+        return AIMessage(content="fallback", response_metadata={"fallback": True})
+
+
+def test_every_attempt_is_recorded_under_its_model():
+    usage = LlmUsageTracker()
+    router = ModelRouter(
+        [("broken", FakeModel(error=RuntimeError("503 from provider"))), ("slow", FakeModel("late", delay=1)),
+         ("good", FakeModel("hello"))],
+        Fallback(), call_timeout=0.05, usage=usage,
+    )
+    response = asyncio.run(router.ainvoke([HumanMessage(content="hi")], sections=["pricing"]))
+    assert response.content == "hello"
+
+    calls = list(usage.recent)
+    assert [(call["model"], call["outcome"]) for call in calls] == [("broken", "error"), ("slow", "error"), ("good", "ok")]
+    assert calls[0]["error"] == "503 from provider"
+    assert calls[1]["error"] == "TimeoutError"
+    assert calls[1]["latency_ms"] >= 50
+    assert calls[2]["prompt_tokens"] == 12 and calls[2]["sections"] == ["pricing"]
+    assert usage.models["good"]["calls"] == 1 and usage.models["broken"]["errors"] == 1
+
+
+def test_fallback_is_recorded_when_all_circuits_are_open():
+    usage = LlmUsageTracker()
+    router = ModelRouter([("good", FakeModel("hello"))], Fallback(), usage=usage)
+    router.get("good").trip()
+    assert asyncio.run(router.ainvoke([HumanMessage(content="hi")])).content == "fallback"
+    assert [call["model"] for call in usage.recent] == ["fallback"]
+
+
+def test_collect_and_set_tokens():
+    usage = LlmUsageTracker()
+
+    async def call_model():
+        usage.record("good", 0.2)
+
+    async def run():
+        with usage.collect() as calls:
+            # Calls recorded in tasks started inside the block are collected too
+            await asyncio.create_task(call_model())
+        return calls
+
+    calls = asyncio.run(run())
+    assert len(calls) == 1 and calls[0]["prompt_tokens"] == 0
+    usage.set_tokens(calls[0], 40, 9)
+    assert calls[0]["prompt_tokens"] == 40
+    assert usage.snapshot()["models"]["good"]["total_tokens"] == 49
+    usage.record("good", 0.1)
+    assert len(calls) == 1  # outside the block
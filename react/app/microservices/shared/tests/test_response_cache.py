@@ -0,0 +1,48 @@
+from rahi_common.response_cache import ResponseCache, normalize_message
+
+
+def test_normalize_message():
+    assert normalize_message("  Plumbar   CHAIYE!! ") == "plumber chahiye"
+    assert normalize_message("बिजली वाला?") == "बिजली वाला"
+
+
+def test_exact_hit_after_normalization():
+    cache = ResponseCache(max_entries=4)
+    cache.put("How do I track my booking?", "Use /tracking")
+    assert cache.get("how do i TRACK my booking") == "Use /tracking"
+    assert cache.stats()["hits"] == 1
+
+
+def test_similar_message_hits_and_unrelated_misses():
+    cache = ResponseCache(max_entries=8, similarity_threshold=0.8)
+    cache.put("how do payments work for workers", "Same-day payouts")
+    cache.put("find an electrician near me", "Visit /services")
+    assert cache.get("please how do payments work for workers") == "Same-day payouts"  # filler word only
+    assert cache.get("cancel my booking") is None
+    stats = cache.stats()
+    assert stats["similar_hits"] == 1 and stats["misses"] == 1
+
+
+def test_lru_eviction_frees_the_slot():
+    cache = ResponseCache(max_entries=2)
+    cache.put("plumber price", "1")
+    cache.put("electrician timing", "2")
+    cache.get("plumber price")  # now most recently used
+    cache.put("carpenter booking", "3")
+    assert cache.get("electrician timing") is None
+    assert cache.get("plumber price") == "1"
+    assert cache.get("carpenter booking") == "3"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_expired_entry_is_removed():
+    cache = ResponseCache(max_entries=2, ttl=-1)
+    cache.put("hello", "hi")
+    assert cache.get("hello") is None
+    stats = cache.stats()
+    assert stats["expirations"] == 1 and stats["entries"] == 0
+    # The freed slot is reused
+    cache.ttl = 60
+    cache.put("hello", "hi again")
+    assert cache.get("hello") == "hi again"
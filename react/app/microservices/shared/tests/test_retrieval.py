@@ -0,0 +1,85 @@
+import json
+import multiprocessing
+import os
+
+from rahi_common.retrieval import KnowledgeIndex
+
+
+def write_knowledge(path, text="Workers receive same-day payouts with a low commission."):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"source": "policy.pdf", "page": 1, "content": text}) + "\n")
+
+
+def load_in_worker(source, index_dir, results):
+    index = KnowledgeIndex(source, index_dir)
+    results.put((index.ensure_loaded(), index.error))
+
+
+def test_concurrent_workers_share_one_build(tmp_path):
+    source = str(tmp_path / "knowledge.jsonl")
+    index_dir = str(tmp_path / "knowledge_index")
+    write_knowledge(source)
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [context.Process(target=load_in_worker, args=(source, index_dir, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+
+    assert [results.get(timeout=5) for _ in workers] == [(True, None)] * 4
+    assert len([name for name in os.listdir(index_dir) if name.startswith("v")]) == 1
+
+
+def test_rebuild_swaps_in_new_version(tmp_path):
+    source = str(tmp_path / "knowledge.jsonl")
+    index_dir = str(tmp_path / "knowledge_index")
+    write_knowledge(source)
+    old = KnowledgeIndex(source, index_dir)
+    assert old.search("payouts")
+
+    write_knowledge(source, "Cancel a booking from the Tracking page before the worker arrives.")
+    new = KnowledgeIndex(source, index_dir)
+    assert new.search("cancel")[0]["source"] == "policy.pdf p.1"
+    # The old worker keeps answering from the build it mapped
+    assert old.search("payouts")
+
+
+def test_loaded_index_picks_up_rebuild(tmp_path):
+    source = str(tmp_path / "knowledge")
+    os.makedirs(source)
+    write_knowledge(os.path.join(source, "policy.jsonl"))
+    index = KnowledgeIndex(source, str(tmp_path / "knowledge_index"), refresh_interval=0)
+    assert index.search("payouts")
+    assert not index.search("cancel")
+
+    # scripts/extract.py adds a shard while the service is running
+    write_knowledge(os.path.join(source, "faq.jsonl"), "Cancel a booking from the Tracking page.")
+    assert index.refresh_due
+    assert index.ensure_loaded()
+    assert index.search("cancel")
+    assert index.search("payouts")
+    assert index.stats()["reloads"] == 1
+
+
+def test_vocabulary_is_looked_up_in_the_mapped_table(tmp_path):
+    source = str(tmp_path / "knowledge.jsonl")
+    write_knowledge(source, "Zebra apple mango café booking worker apple")
+    index = KnowledgeIndex(source, str(tmp_path / "knowledge_index"))
+    assert index.ensure_loaded()
+    assert [index.search(word)[0]["source"] for word in ("zebra", "apple", "café", "worker")] == ["policy.pdf p.1"] * 4
+    assert index.search("banana") == []
+    assert index.meta["vocab_size"] == 6
+    assert "vocab" not in index.meta
+
+
+def test_failed_load_is_retried(tmp_path):
+    source = str(tmp_path / "knowledge.jsonl")
+    index = KnowledgeIndex(source, str(tmp_path / "knowledge_index"), retry_interval=0)
+    assert not index.ensure_loaded()
+    assert index.error
+
+    write_knowledge(source)
+    assert index.ensure_loaded()
+    assert index.error is None
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from rahi_common.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "reply"
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.run("what are your fees", call) for _ in range(10)))
+        return flight, results
+
+    flight, results = asyncio.run(run())
+    assert results == ["reply"] * 10
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert stats["leader_calls"] == 1
+    assert stats["coalesced_calls"] == 9
+    assert stats["follower_retries"] == 0
+    assert stats["in_flight"] == 0
+    assert stats["coalesced_rate"] == 0.9
+
+
+def test_different_keys_are_not_coalesced():
+    async def call():
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def run():
+        flight = SingleFlight()
+        await asyncio.gather(flight.run("a", call), flight.run("b", call))
+        return flight
+
+    assert asyncio.run(run()).stats()["leader_calls"] == 2
+
+
+def test_leader_failure_does_not_poison_followers():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        if len(calls) == 1:
+            raise RuntimeError("model unavailable")
+        return "reply"
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.run("key", call) for _ in range(3)), return_exceptions=True)
+        return flight, results
+
+    flight, results = asyncio.run(run())
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == ["reply", "reply"]
+    assert len(calls) == 3  # the leader, then each follower on its own
+    stats = flight.stats()
+    assert stats["leader_calls"] == 1
+    assert stats["coalesced_calls"] == 0
+    assert stats["follower_retries"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_follower_stops_waiting_after_timeout():
+    async def slow():
+        await asyncio.sleep(1)
+        return "slow"
+
+    async def fast():
+        return "fast"
+
+    async def run():
+        flight = SingleFlight(wait_timeout=0.05)
+        leader = asyncio.create_task(flight.run("key", slow))
+        await asyncio.sleep(0)
+        started = asyncio.get_running_loop().time()
+        follower = await flight.run("key", fast)
+        waited = asyncio.get_running_loop().time() - started
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return flight, follower, waited
+
+    flight, follower, waited = asyncio.run(run())
+    assert follower == "fast"
+    assert waited < 0.5
+    assert flight.stats()["follower_retries"] == 1
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,110 @@
+import asyncio
+import smtplib
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from rahi_common.smtp_pool import SmtpPool, build_message
+
+
+class Inbox:
+    def __init__(self, drop_after=None):
+        self.messages = []
+        self.drop_after = drop_after
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        if len(self.messages) == self.drop_after:
+            # Close the connection once this reply is out, as a server timing out a session would
+            asyncio.get_running_loop().call_soon(server.transport.close)
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    inbox = Inbox()
+    controller = Controller(inbox, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller, inbox
+    controller.stop()
+
+
+def message(n: int):
+    return build_message("alerts@rahi.com", "ops@rahi.com", f"Alert {n}", "body")
+
+
+def test_starttls_required_but_not_offered(smtp_server):
+    controller, inbox = smtp_server
+    pool = SmtpPool(controller.hostname, controller.port, "user", "secret", starttls=True, timeout=5)
+    with pytest.raises(smtplib.SMTPNotSupportedError):
+        pool.send(message(1))
+    assert inbox.messages == []
+    assert pool.stats()["open"] == 0
+
+
+def test_sessions_are_reused(smtp_server):
+    controller, inbox = smtp_server
+    pool = SmtpPool(controller.hostname, controller.port, starttls=False, size=1, timeout=5)
+    ids = [pool.send(message(n)) for n in range(3)]
+    pool.close()
+    assert len(inbox.messages) == 3
+    assert len(set(ids)) == 3
+    stats = pool.stats()
+    assert stats["connects"] == 1
+    assert stats["sent"] == 3
+    assert stats["open"] == 0
+
+
+def test_dropped_session_reconnects(smtp_server):
+    controller, inbox = smtp_server
+    pool = SmtpPool(controller.hostname, controller.port, starttls=False, size=1, timeout=5)
+    pool.send(message(1))
+    pool._idle[-1].smtp.sock.shutdown(socket.SHUT_RDWR)  # the connection dropped while idle
+    pool.send(message(2))
+    pool.close()
+    assert len(inbox.messages) == 2
+    assert pool.stats()["reconnects"] == 1
+
+
+def test_send_many_uses_one_session(smtp_server):
+    controller, inbox = smtp_server
+    pool = SmtpPool(controller.hostname, controller.port, starttls=False, size=1, timeout=5)
+    results = pool.send_many([message(n) for n in range(5)])
+    pool.close()
+    assert [error for _, error in results] == [None] * 5
+    assert len({message_id for message_id, _ in results}) == 5
+    assert len(inbox.messages) == 5
+    assert pool.stats()["connects"] == 1
+
+
+def test_send_many_reconnects_mid_batch():
+    inbox = Inbox(drop_after=2)
+    controller = Controller(inbox, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    try:
+        pool = SmtpPool(controller.hostname, controller.port, starttls=False, size=1, timeout=5)
+        results = pool.send_many([message(n) for n in range(4)])
+        pool.close()
+    finally:
+        controller.stop()
+    assert [error for _, error in results] == [None] * 4
+    assert [envelope.content.count(b"Alert ") for envelope in inbox.messages] == [1] * 4
+    assert pool.stats()["reconnects"] == 1
+
+
+def test_send_many_gives_up_when_the_server_is_gone():
+    controller = Controller(Inbox(), hostname="127.0.0.1", port=free_port())
+    controller.start()
+    pool = SmtpPool(controller.hostname, controller.port, starttls=False, size=1, timeout=5)
+    pool.send(message(0))
+    controller.stop()
+    results = pool.send_many([message(n) for n in range(3)])
+    assert all(isinstance(error, OSError) for _, error in results)
+    assert pool.stats()["failed"] == 3
@@ -1,50 +1,203 @@
-import os
+import argparse
+import hashlib
 import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pypdf import PdfReader
 
 PDF_DIR = "resources/pdf"
-OUTPUT_FILE = "backend/data/knowledge.json"
+OUTPUT_DIR = "backend/data/knowledge"
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "manifest.json")
+LEGACY_OUTPUT_FILE = "backend/data/knowledge.json"
+PAGES_PER_TASK = 8
+
+# Output layout: one JSONL shard per PDF, one line per page with text:
+#   {"source": "policy.pdf", "page": 1, "offset": 0, "content": "..."}
+# `offset` is the character offset of the page within the document's text.
+# The manifest records path, size, mtime and sha256 of every extracted PDF so
+# re-runs only extract PDFs that changed. With --legacy-json the shards are also
+# combined into the old single knowledge.json ({"source", "content", "pages"}).
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def shard_path(filename):
+    return os.path.join(OUTPUT_DIR, os.path.splitext(filename)[0] + ".jsonl")
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    tmp = MANIFEST_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, MANIFEST_FILE)
+
+
+@lru_cache(maxsize=2)
+def open_reader(path, mtime_ns):
+    """Parse a PDF once per process; `mtime_ns` keeps a changed file from being served stale."""
+    return PdfReader(path)
+
+
+def extract_pages(task):
+    """Worker: extract and clean the text of pages [start, end) of one PDF."""
+    path, mtime_ns, start, end = task
+    reader = open_reader(path, mtime_ns)
+    pages = []
+    for number in range(start, end):
+        extracted = reader.pages[number].extract_text() or ""
+        pages.append((number + 1, " ".join(extracted.split())))
+    return pages
+
+
+def bounded_map(pool, tasks, window):
+    """Ordered pool.map that keeps at most `window` tasks in flight, so memory stays bounded."""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(extract_pages, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
-def extract_text():
+
+def is_unchanged(entry, path, stat):
+    if not entry:
+        return False
+    if entry["pages_with_text"] and not os.path.exists(shard_path(os.path.basename(path))):
+        return False
+    if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return True
+    # Touched but identical content (e.g. re-copied): refresh mtime, skip extraction
+    if entry["size"] == stat.st_size and entry["sha256"] == file_sha256(path):
+        entry["mtime"] = stat.st_mtime
+        return True
+    return False
+
+
+def extract_document(filename, path, mtime_ns, page_count, run_tasks, workers):
+    """Stream one PDF's pages to its shard; returns (pages with text, characters)."""
+    # Small PDFs are still split so every worker gets pages
+    step = max(1, min(PAGES_PER_TASK, -(-page_count // workers)))
+    tasks = [(path, mtime_ns, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    out_path = shard_path(filename)
+    tmp_path = out_path + ".tmp"
+    offset = 0
+    pages_with_text = 0
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            for pages in run_tasks(tasks):
+                for number, content in pages:
+                    if not content:
+                        continue
+                    out.write(json.dumps({"source": filename, "page": number, "offset": offset, "content": content}, ensure_ascii=False) + "\n")
+                    offset += len(content) + 1
+                    pages_with_text += 1
+        if pages_with_text:
+            os.replace(tmp_path, out_path)
+        elif os.path.exists(out_path):
+            os.remove(out_path)
+    finally:
+        # A failed task leaves a partial shard behind; the previous shard (if any) stays in place
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return pages_with_text, offset
+
+
+def write_legacy_json(manifest):
+    """Combine the shards into the single knowledge.json written by earlier versions of this script."""
+    knowledge = []
+    for filename in sorted(manifest):
+        if not manifest[filename]["pages_with_text"]:
+            continue
+        with open(shard_path(filename), "r", encoding="utf-8") as f:
+            content = " ".join(json.loads(line)["content"] for line in f if line.strip())
+        knowledge.append({"source": filename, "content": content, "pages": manifest[filename]["pages"]})
+
+    tmp = LEGACY_OUTPUT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(knowledge, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, LEGACY_OUTPUT_FILE)
+    print(f"🗂️ Legacy knowledge saved to {LEGACY_OUTPUT_FILE}")
+
+
+def extract_text(workers=None, force=False, legacy_json=False):
     if not os.path.exists(PDF_DIR):
         print("❌ PDF folder not found")
         return
 
-    knowledge = []
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    manifest = {} if force else load_manifest()
+    pdfs = sorted(filename for filename in os.listdir(PDF_DIR) if filename.lower().endswith(".pdf"))
+
+    # PDFs removed from the folder drop out of the knowledge base
+    for filename in set(manifest) - set(pdfs):
+        if os.path.exists(shard_path(filename)):
+            os.remove(shard_path(filename))
+        del manifest[filename]
+        print(f"🗑️ Removed {filename}")
+
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    run_tasks = (lambda tasks: bounded_map(pool, tasks, workers * 2)) if pool else (lambda tasks: map(extract_pages, tasks))
+    skipped = 0
 
-    for filename in os.listdir(PDF_DIR):
-        if filename.lower().endswith(".pdf"):
+    try:
+        for filename in pdfs:
             path = os.path.join(PDF_DIR, filename)
-            print(f"📄 Processing {filename}")
+            stat = os.stat(path)
+            if is_unchanged(manifest.get(filename), path, stat):
+                skipped += 1
+                continue
 
+            print(f"📄 Processing {filename}")
             try:
-                reader = PdfReader(path)
-                text = ""
-
-                for page in reader.pages:
-                    extracted = page.extract_text()
-                    if extracted:
-                        text += extracted + "\n"
-
-                clean = " ".join(text.split())
-                if clean:
-                    knowledge.append({
-                        "source": filename,
-                        "content": clean,
-                        "pages": len(reader.pages)
-                    })
-                    print("  ✅ Success")
+                page_count = len(open_reader(path, stat.st_mtime_ns).pages)
+                pages_with_text, characters = extract_document(filename, path, stat.st_mtime_ns, page_count, run_tasks, workers)
+                if pages_with_text:
+                    print(f"  ✅ Success ({pages_with_text}/{page_count} pages, {characters} chars)")
                 else:
                     print("  ⚠️ No text found")
-
+                manifest[filename] = {
+                    "path": path,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha256": file_sha256(path),
+                    "pages": page_count,
+                    "pages_with_text": pages_with_text,
+                }
+                save_manifest(manifest)
             except Exception as e:
                 print(f"  ❌ Error: {e}")
+    finally:
+        if pool:
+            pool.shutdown()
 
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(knowledge, f, indent=2, ensure_ascii=False)
+    save_manifest(manifest)
+    if legacy_json:
+        write_legacy_json(manifest)
+    print(f"\n🚀 Knowledge saved to {OUTPUT_DIR} ({skipped} unchanged PDFs skipped)")
 
-    print(f"\n🚀 Knowledge saved to {OUTPUT_FILE}")
 
 if __name__ == "__main__":
-    extract_text()
+    parser = argparse.ArgumentParser(description="Extract PDF text into JSONL knowledge shards")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count, 1 disables the pool)")
+    parser.add_argument("--force", action="store_true", help="Re-extract every PDF, ignoring the manifest")
+    parser.add_argument("--legacy-json", action="store_true", help=f"Also write {LEGACY_OUTPUT_FILE} for consumers of the old single-file format")
+    args = parser.parse_args()
+    extract_text(args.workers, args.force, args.legacy_json)